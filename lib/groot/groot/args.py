@@ -2,7 +2,7 @@
 from optparse import OptionParser
 import sys
 
-from command import *
+import command
 from err import *
 
 
@@ -35,8 +35,18 @@ class ParseArgs(object):
                           action="callback", callback=self.set_debug,
                           help="include extra debugging output")
             op.add_option("--in", type="string", dest="in_")
+            op.add_option("-j", "--jobs", type="int", dest="jobs",
+                          action="callback", callback=self.set_jobs,
+                          help="run per-submodule work in N parallel jobs")
+            op.add_option("--no-pager",
+                          action="store_false", dest="pager", default=True,
+                          help="don't send diff and log output to a pager")
+            op.add_option("--stream",
+                          action="callback", callback=self.set_stream,
+                          help="show output as it comes, prefixed by submodule")
 
             options, args = op.parse_args(args)
+            self.groot.use_pager = options.pager
 
             if len(args) == 0:
                 raise InvalidUsage("Missing command")
@@ -56,6 +66,16 @@ class ParseArgs(object):
     def set_verbose(self, option, opt_str, value, parser, *args, **kwargs):
         self.groot.verbose = True
         
+    def set_jobs(self, option, opt_str, value, parser, *args, **kwargs):
+        if value < 1:
+            raise InvalidUsage("Invalid number of jobs: %d" % (value))
+        self.groot.jobs = value
+        self.groot.jobs_given = True
+        
+    def set_stream(self, option, opt_str, value, parser, *args, **kwargs):
+        from groot.stream import LineStream
+        self.groot.stream = LineStream()
+        
     def set_debug(self, option, opt_str, value, parser, *args, **kwargs):
         self.groot.quiet = False
         self.groot.verbose = True
@@ -70,7 +90,7 @@ class ParseArgs(object):
                 cmd_args[0:0] = [self.options.in_,cmd_name]
                 cmd_name = 'in'
 
-            cmd_class = BaseCommand.find_command(cmd_name)
+            cmd_class = command.find_command(cmd_name)
             if not cmd_class:
                 raise InvalidUsage("Unknown command: %s" % cmd_name)
             self.command = cmd_class(self.groot,cmd_name)
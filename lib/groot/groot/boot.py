@@ -1,5 +1,6 @@
 
 import os, sys
+import threading
 
 from groot.err import *
 
@@ -13,6 +14,12 @@ class Groot(object):
   
   def __init__(self):
     Groot.instance = self
+    self.recorder = threading.local()
+    self.reset()
+
+
+  def reset(self):
+    """ Set up the state for running one command """
     self.root_repo = None
     self.verbose = False
     self.quiet = False
@@ -20,6 +27,10 @@ class Groot(object):
     self.ticking = False
     self.did_tick = False
     self.errors = 0
+    self.jobs = 1
+    self.jobs_given = False
+    self.stream = None
+    self.use_pager = True
     
     self.log_deferred = []
     
@@ -43,49 +54,124 @@ class Groot(object):
       except RepoNotFound, ex:
         self.fatal(ex)
 
+    pager = self.command.start_pager()
+    ssh_master = self.command.start_ssh_master()
     try:
       self.command.run()
       self.command.cleanup()
-    except GitCommandError, ex:
+    except (GitCommandError,IOError), ex:
+      if pager:
+        pager.stop()
+        # Quitting the pager before the end stops the command, and that's all
+        if pager.quit: return
+      if isinstance(ex,IOError): raise
       self.fatal("-E- Git command failed in %s:\n%s\n%s" % (ex.repo.path,ex.command_str(),ex.stderr or ''))
+    finally:
+      if ssh_master: ssh_master.stop()
+      if pager: pager.stop()
       
   
 
   def log(self,msg,deferred=False,tick=False):
+    if self.recorded('log',msg,deferred=deferred,tick=tick): return
     if not self.quiet:
       if deferred:
         self.log_deferred.append((sys.stdout,msg))
         if tick: self.tick()
       else:
         self.flush_log()
-        print(msg)
+        self.show(sys.stdout,msg)
       
   def debug(self,msg,deferred=False):
+    if self.recorded('debug',msg,deferred=deferred): return
     if self.debug_mode:
       if deferred:
         self.log_deferred.append((sys.stdout,msg))
       else:
         self.flush_log()
-        print(msg)
+        self.show(sys.stdout,msg)
       
   def warning(self,msg,deferred=False):
+    if self.recorded('warning',msg,deferred=deferred): return
     if deferred:
       self.log_deferred.append((sys.stderr,msg))
     else:
       self.flush_log()
-      print >> sys.stderr, msg
+      self.show(sys.stderr,msg)
       
   def error(self,msg,deferred=False):
+    if self.recorded('error',msg,deferred=deferred): return
     self.errors += 1
     
     if deferred:
       self.log_deferred.append((sys.stderr,msg))
     else:
       self.flush_log()
-      print >> sys.stderr, msg
+      self.show(sys.stderr,msg)
+
+
+  def write(self,data,fh=None):
+    """ Write raw output (e.g. from an uncaptured git command) without
+        touching the deferred log """
+    if self.recorded('write',data,fh=fh): return
+    if data:
+      fh = fh or sys.stdout
+      if hasattr(data,'chunks'):
+        for chunk in data.chunks(): fh.write(chunk)
+      else:
+        fh.write(data)
+      fh.flush()
+
+
+  def show(self,fh,msg):
+    """ Print a message, which may be captured output in a Spool: that's
+        written out a chunk at a time rather than read into memory """
+    if hasattr(msg,'chunks'):
+      for chunk in msg.chunks(): fh.write(chunk)
+      fh.write('\n')
+    else:
+      print >> fh, msg
+
+
+  def record(self,ops):
+    """ Start recording the output calls made by the current thread into the
+        ops list instead of writing them, so they can be replayed later. Passing
+        None stops recording """
+    self.recorder.ops = ops
+
+  def recording(self):
+    return getattr(self.recorder,'ops',None) is not None
+
+  def streaming(self):
+    """ Whether the current thread's output is being streamed (groot --stream)
+        rather than held back for replaying """
+    return hasattr(getattr(self.recorder,'ops',None),'prefix')
+
+  def stream_prefix(self):
+    """ What the current thread's streamed output lines are prefixed with,
+        if anything """
+    return getattr(getattr(self.recorder,'ops',None),'prefix',None)
+
+  def captures_output(self):
+    """ Whether git's output has to be captured and passed on through write(),
+        rather than going straight to the terminal """
+    return self.recording()
+
+  def recorded(self,name,*args,**kwargs):
+    ops = getattr(self.recorder,'ops',None)
+    if ops is None:
+      return False
+    ops.append((name,args,kwargs))
+    return True
+
+  def replay(self,ops):
+    """ Perform the output calls previously recorded by record() """
+    for name, args, kwargs in ops:
+      getattr(self,name)(*args,**kwargs)
 
 
   def tick(self):
+    if self.recorded('tick'): return
     if sys.stdout.isatty():
       self.ticking = True
       # The actual 'tick' doesn't happen until the log is cleared
@@ -100,6 +186,7 @@ class Groot(object):
         self.did_tick=False
         
   def clear_log(self):
+    if self.recorded('clear_log'): return
     self.log_deferred = []
     if self.ticking:
       # Reached the end of a logging point without the log getting flushed,
@@ -109,13 +196,33 @@ class Groot(object):
       self.did_tick=True
 
   def flush_log(self):
+    if self.recorded('flush_log'): return
     self.stop_ticking()
     for log in self.log_deferred:
       fh, msg = log
-      print >> fh, msg
+      self.show(fh,msg)
     self.clear_log()
     
       
+  def open_repo(self,path):
+    """ The Repo for the root repository at path, for a command to use """
+    from groot.repo import Repo
+    return Repo(self,path)
+
+  def close_repo(self,repo):
+    """ Called when a command is done with a Repo from open_repo() """
+    repo.close()
+
+  def known_clean(self,repo):
+    """ Paths of the submodules of repo that a running groot daemon already
+        knows to be clean, so they needn't be checked again """
+    import groot.client
+    sock_path = os.path.join(repo.git.git_dir,groot.client.SOCKET_PATH)
+    if not os.path.exists(sock_path):
+      return []
+    return groot.client.query(sock_path,{ 'clean': repo.path }) or []
+
+      
   def find_repo(self):
     """Look for a groot-managed repository, starting at the current directory.
     """
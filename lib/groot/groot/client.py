@@ -0,0 +1,144 @@
+# Thin client for a running groot daemon (see groot.daemon).
+#
+# bin/groot tries this before loading anything else, so it only uses
+# the standard library, and doesn't import the rest of groot.
+#
+
+import marshal
+import os
+import socket
+import struct
+import sys
+
+GIT_REPO_DIR = '.git'
+SOCKET_PATH = os.path.join('groot','daemon.sock')
+
+# Global options that pick a different repo than the one for the current
+# directory. Commands using them are always run directly
+REPO_OPTIONS = ['-r','--repo','--root']
+
+
+def send_frame(sock,obj):
+    data = marshal.dumps(obj)
+    sock.sendall(struct.pack('>I',len(data)) + data)
+
+
+def recv_frame(sock):
+    """ The next object sent, or None at the end of the connection """
+    header = recv_exactly(sock,4)
+    if header is None:
+        return None
+    data = recv_exactly(sock,struct.unpack('>I',header)[0])
+    if data is None:
+        return None
+    return marshal.loads(data)
+
+
+def recv_exactly(sock,size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size,65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def find_socket(path):
+    """ The daemon socket for the superproject containing path, found the
+        same way Groot.find_repo_from_pwd finds the repo, or None """
+    olddir = None
+    while path != '/' and path != olddir:
+        git_dir = os.path.join(path,GIT_REPO_DIR)
+        if os.path.isdir(git_dir) and os.path.exists(os.path.join(path,'.gitmodules')):
+            sock_path = os.path.join(git_dir,SOCKET_PATH)
+            if os.path.exists(sock_path):
+                return sock_path
+            return None
+        olddir = path
+        path = os.path.dirname(path)
+    return None
+
+
+def connect(sock_path):
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(sock_path)
+    except socket.error:
+        # Left behind by a daemon that's gone
+        sock.close()
+        return None
+    return sock
+
+
+def query(sock_path,request):
+    """ Send a request for information to the daemon, and return its
+        answer, or None if there's no daemon to answer """
+    if os.environ.get('GROOT_NO_DAEMON'):
+        return None
+    sock = connect(sock_path)
+    if not sock:
+        return None
+    try:
+        send_frame(sock,request)
+        frame = recv_frame(sock)
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+    if frame and frame[0] == 'answer':
+        return frame[1]
+    return None
+
+
+def run(argv):
+    """ Have the daemon for the current superproject run the command. Returns
+        the exit code, or None if there's no daemon, or it won't run this
+        command -- in which case the caller should run it itself """
+    if os.environ.get('GROOT_NO_DAEMON'):
+        return None
+    for arg in argv:
+        if arg in REPO_OPTIONS or arg.split('=',1)[0] in REPO_OPTIONS:
+            return None
+
+    try:
+        cwd = os.getcwd()
+    except OSError:
+        return None
+    sock_path = find_socket(cwd)
+    if not sock_path:
+        return None
+    sock = connect(sock_path)
+    if not sock:
+        return None
+
+    streams = { 'out': sys.stdout, 'err': sys.stderr }
+    started = False
+    try:
+        send_frame(sock,{ 'argv': argv,
+                          'cwd': cwd,
+                          'env': dict(os.environ),
+                          'tty': (sys.stdout.isatty(),sys.stderr.isatty()) })
+        while True:
+            frame = recv_frame(sock)
+            if frame is None:
+                break
+            kind = frame[0]
+            if kind == 'fallback':
+                return None
+            if kind == 'exit':
+                return frame[1]
+            started = True
+            streams[kind].write(frame[1])
+            streams[kind].flush()
+    except socket.error:
+        pass
+    finally:
+        sock.close()
+
+    # The daemon went away. That's fine if it hadn't started on the command
+    if not started:
+        return None
+    print >> sys.stderr, "-E- Lost connection to groot daemon"
+    return 1
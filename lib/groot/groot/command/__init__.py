@@ -1,22 +1,46 @@
+# Command handlers, one module per command (or group of simple ones).
+#
+# Only the module for the command being run is imported, as found in
+# the table below.
+#
 
-from add import *
-from aliased import *
-from branch import *
-from checkout import *
-from cherry_pick import *
-from clone import *
-from commit import *
-from diff import *
-from help import *
-from in_submodule import *
-from info import *
-from init import *
-from log import *
-from merge import *
-from pull import *
-from push import *
-from stash import *
-from status import *
-from submodule import *
-from tag import *
+import importlib
 
+# Command name or alias -> (module, class)
+COMMANDS = {
+    'add':          ('add','Add'),
+    'branch':       ('branch','Branch'),
+    'checkout':     ('checkout','Checkout'),
+    'co':           ('checkout','Checkout'),
+    'cherry-pick':  ('cherry_pick','CherryPick'),
+    'clone':        ('clone','Clone'),
+    'commit':       ('commit','Commit'),
+    'daemon':       ('daemon','Daemon'),
+    'diff':         ('diff','Diff'),
+    'help':         ('help','Help'),
+    'in':           ('in_submodule','In'),
+    'info':         ('info','Info'),
+    'init':         ('init','Init'),
+    'log':          ('log','Log'),
+    'merge':        ('merge','Merge'),
+    'pull':         ('pull','Pull'),
+    'push':         ('push','Push'),
+    'rebase':       ('aliased','Rebase'),
+    'remote':       ('aliased','Remote'),
+    'reset':        ('aliased','Reset'),
+    'stash':        ('stash','Stash'),
+    'stat':         ('status','Status'),
+    'st':           ('status','Status'),
+    'status':       ('status','Status'),
+    'submodule':    ('submodule','Submodule'),
+    'tag':          ('tag','Tag'),
+}
+
+
+def find_command(cmd_name):
+    """ The command handler class for a command name or alias, or None """
+    if not cmd_name in COMMANDS:
+        return None
+    module_name, class_name = COMMANDS[cmd_name]
+    module = importlib.import_module('%s.%s' % (__name__,module_name))
+    return getattr(module,class_name)
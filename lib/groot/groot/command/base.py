@@ -1,38 +1,20 @@
 
 import os
-
-from groot.repo import Repo
+import Queue
+import sys
+import threading
 
 
 class BaseCommand(object):
     """ All of the command handlers derive from this class """
 
-    @classmethod
-    def command_names(cls):
-        try:
-            return cls.__aliases__
-        except AttributeError:
-            return [ cls.__name__.lower() ]
-
-    @classmethod
-    def find_command(cls,cmd_name):
-        for sub in cls.__subclasses__():
-            for alias in sub.command_names():
-                if alias == cmd_name:
-                    return sub
-
-            found = sub.find_command(cmd_name)
-            if found: return found
-
-        return None
-
-
     def __init__(self,groot,cmd_name):
         self.groot = groot
         self.groot.debug("# init command: %s (%s)" % (cmd_name,self.__class__))
         self.cmd_name = cmd_name
         self.root_repo = None
         self.cleanup_files = []
+        self.ssh_master = None
         self.init()
         
 
@@ -49,6 +31,52 @@ class BaseCommand(object):
         """ Whether this command requires a current repo to operate """
         raise NotImplementedError("%s.requires_repo() is missing" % (self.__class__.__name__))
 
+
+    def served_by_daemon(self):
+        """ Whether a running groot daemon may run this command for bin/groot.
+            Only commands that don't change anything, and don't need the
+            terminal (an editor, a pager, a password prompt), should say yes """
+        return False
+
+
+    def uses_pager(self):
+        """ Whether the command's output goes through a pager, when it's
+            going to a terminal """
+        return False
+
+
+    def start_pager(self):
+        """ Start the pager for the command's output, if it has one, as
+            git would for the same command. Returns the Pager, or None """
+        if not self.uses_pager() or not self.groot.use_pager:
+            return None
+        from groot.pager import Pager
+        command = Pager.command_for(self.get_repo().git,self.cmd_name)
+        if not command:
+            return None
+        pager = Pager(command)
+        pager.start()
+        return pager
+
+
+    def uses_network(self):
+        """ Whether the command goes to the remotes, so its ssh connections
+            to each host should be shared """
+        return False
+
+
+    def start_ssh_master(self):
+        """ Have the command's ssh connections go through an SshMaster, if it
+            uses the network. Returns the SshMaster, or None """
+        if not self.uses_network():
+            return None
+        from groot.remote import SshMaster
+        if not SshMaster.wanted(self.get_repo().git):
+            return None
+        self.ssh_master = SshMaster()
+        self.ssh_master.start()
+        return self.ssh_master
+
     
     def run(self):
         """ Perform the actual command """
@@ -59,16 +87,25 @@ class BaseCommand(object):
         self.groot.debug("# cleanup command: %s" % (self.cmd_name))
         for path in self.cleanup_files:
             os.unlink(path)
+        if self.root_repo:
+            self.groot.close_repo(self.root_repo)
 
             
     def get_repo(self):
         """ Return a Repo instance representing the root repository """
         if not self.root_repo:
-            self.root_repo = Repo(self.groot,self.groot.find_repo())
+            self.root_repo = self.groot.open_repo(self.groot.find_repo())
 
         return self.root_repo
 
 
+    def skip_known_clean(self):
+        """ Let a running groot daemon say which submodules it already knows
+            are clean, so they don't have to be checked again """
+        root = self.get_repo()
+        root.mark_clean(self.groot.known_clean(root))
+
+
     def get_submodule(self,name):
         """ Return a Repo instance representing the specific submodule """
         repo = self.get_repo()
@@ -76,9 +113,40 @@ class BaseCommand(object):
 
 
     def get_submodules(self):
-        """ Return an array Repo instances representing the child repositories """
+        """ Return an array Repo instances representing the child repositories,
+            including nested submodules (each after the submodule it's in) """
         repo = self.get_repo()
-        return repo.get_submodules()
+        return repo.all_submodules()
+
+
+    def for_each_submodule(self,func,submodules=None,jobs=None):
+        """ Call func(subm) for each submodule (all of them by default), running up
+            to --jobs of them at a time. Returns the results in submodule order """
+        if submodules is None:
+            submodules = self.get_submodules()
+        return Executor(self.groot,jobs).map(func,submodules)
+
+
+    def walk_submodules(self,func,jobs=None):
+        """ Call func(subm,results) for each submodule in the tree, where results
+            are what func returned for the submodule's own submodules. So a
+            submodule is only done once everything under it is, while separate
+            subtrees are done in parallel. Returns the results for the top-level
+            submodules """
+        return Executor(self.groot,jobs).walk(func,self.get_repo())
+
+
+    def run_tasks(self,tasks,jobs=None):
+        """ Run a TaskGraph, up to --jobs tasks at a time """
+        Executor(self.groot,jobs).schedule(tasks)
+
+
+    def default_jobs(self,jobs):
+        """ --jobs if it was given, or else jobs, for work that's worth doing
+            in parallel even when that wasn't asked for """
+        if self.groot.jobs_given:
+            return self.groot.jobs
+        return jobs
 
 
     def which_submodule(self,path):
@@ -86,13 +154,7 @@ class BaseCommand(object):
             to the matched submodule.
             
             If it is not a submodule path, returns None """
-
-        for subm in self.get_submodules():
-            rel_path = subm.relative_path(path)
-            if rel_path is not None:
-                return (subm,rel_path)
-
-        return (None,path)
+        return self.get_repo().which_submodule(path)
 
 
     def map_args_to_submodules(self,**kwargs):
@@ -110,17 +172,21 @@ class BaseCommand(object):
 
             if not sub_path:
                 # For the case of an arg the corresponds exactly to a subm path,
-                # determine whether it should be considered a path for the root,
-                # or an empty path in the submodule
+                # determine whether it should be considered a path for the root
+                # (or the submodule it's nested in), or an empty path in the submodule
                 if subm_path_goes_to_root:
                     sub_path = subm.rel_path
-                    subm = None
-                    
+                    parent = subm.parent_repo()
+                    if parent.parent_repo():
+                        subm = parent
+                    else:
+                        subm = None
+
             if subm:
-                if not subm.rel_path in map:
-                    map[subm.rel_path] = {'subm': subm, 'paths': []}
+                if not subm.tree_path in map:
+                    map[subm.tree_path] = {'subm': subm, 'paths': []}
                 if sub_path != '':
-                    map[subm.rel_path]['paths'].append(sub_path)
+                    map[subm.tree_path]['paths'].append(sub_path)
                 
             else:
                 if not '' in map:
@@ -142,7 +208,7 @@ class BaseCommand(object):
         map = {}
         map[''] = { 'subm': None, 'paths': [] }
         for subm in self.get_submodules():
-            map[subm.rel_path] = {'subm':subm, 'paths':[]}
+            map[subm.tree_path] = {'subm':subm, 'paths':[]}
         return map
 
     
@@ -160,6 +226,220 @@ class AliasedCommand(BaseCommand):
         if self.requires_repo():
             repo = self.get_repo()
         else:
+            from groot.repo import Repo
             repo = Repo(self.groot,None)
         repo.do_git([self.cmd_name] + self.args)
         
+
+
+
+class Executor(object):
+    """ Runs a function for each of a list of items (usually submodules) on a
+        bounded pool of worker threads.
+
+        Output from each task -- groot.log(), warnings, etc, and anything written
+        by uncaptured git commands -- is recorded instead of being written, then
+        replayed on the main thread in the order of the items. So the output is
+        the same as running the tasks one at a time, no matter which finishes first.
+
+        Tasks can depend on others (see TaskGraph), and only start once those are done.
+
+        With a single job, the tasks simply run in order on the calling thread.
+
+        With groot --stream, the output isn't held back at all: it's written as it
+        comes, each line prefixed with the task's label (see groot.stream). That
+        always uses worker threads, unless the caller asked for one job at a time.
+    """
+
+    def __init__(self,groot,jobs=None):
+        self.groot = groot
+        self.jobs = jobs or groot.jobs
+        self.stream = None
+        if jobs != 1: self.stream = groot.stream
+        self.cancelled = False
+
+
+    def serial(self,count):
+        return not self.stream and (self.jobs <= 1 or count <= 1)
+
+
+    def map(self,func,items):
+        items = list(items)
+        if self.serial(len(items)):
+            return [func(item) for item in items]
+
+        ordered = [Executor.Task(func,(item,),getattr(item,'tree_path',None)) for item in items]
+        self.run(ordered)
+        return [task.result for task in ordered]
+
+
+    def walk(self,func,repo):
+        """ Calls func(subm,results) for each submodule in the tree under repo,
+            with the results func gave for the submodule's own submodules.
+            Returns the results for repo's submodules """
+        tasks = TaskGraph()
+
+        def visit(parent):
+            names = []
+            for subm in parent.get_submodules():
+                nested = visit(subm)
+                tasks.add(subm.tree_path,self.walk_step,(tasks,func,subm,nested),after=nested,
+                          label=subm.tree_path)
+                names.append(subm.tree_path)
+            return names
+
+        top = visit(repo)
+        self.schedule(tasks)
+        return [tasks.result(name) for name in top]
+
+
+    def walk_step(self,tasks,func,subm,nested):
+        return func(subm,[tasks.result(name) for name in nested])
+
+
+    def schedule(self,tasks):
+        """ Run the tasks in a TaskGraph """
+        if self.serial(len(tasks.ordered)):
+            for task in tasks.ordered:
+                task.result = task.func(*task.args)
+        else:
+            self.run(tasks.ordered)
+
+
+    def run(self,ordered):
+        """ Runs the tasks on the worker threads, each once the tasks it depends
+            on are done. Every task has to come after those in the list """
+        if self.stream:
+            from groot.stream import StreamedOutput
+
+        ready = Queue.Queue()
+        for task in ordered:
+            if not task.waiting:
+                ready.put(task)
+            if self.stream:
+                task.ops = StreamedOutput(self.groot,self.stream,task.label)
+
+        workers = []
+        for i in range(min(self.jobs,len(ordered))):
+            worker = threading.Thread(target=self.worker,args=(ready,))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        try:
+            for task in ordered:
+                if self.stream:
+                    task.wait(self.stream.flush)
+                    task.ops.finish()
+                else:
+                    task.wait()
+                    self.groot.replay(task.ops)
+                if task.exc_info:
+                    raise task.exc_info[0], task.exc_info[1], task.exc_info[2]
+        finally:
+            # Don't start anything else if a task failed
+            self.cancelled = True
+            for worker in workers:
+                ready.put(None)
+            # ...but let those already running finish, rather than have them
+            # die mid-task when the interpreter exits
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.1)
+            if self.stream:
+                self.stream.flush()
+
+
+    def worker(self,ready):
+        while not self.cancelled:
+            task = ready.get()
+            if task is None:
+                return
+            task.run(self.groot)
+            for dependent in task.dependents:
+                if dependent.dependency_done():
+                    ready.put(dependent)
+
+
+    class Task(object):
+        def __init__(self,func,args,label=None):
+            self.func = func
+            self.args = args
+            self.label = label
+            self.ops = []
+            self.result = None
+            self.exc_info = None
+            self.skipped = False
+            self.done = threading.Event()
+            self.dependencies = []
+            self.dependents = []
+            self.waiting = 0
+            self.lock = threading.Lock()
+
+        def depend_on(self,tasks):
+            for task in tasks:
+                self.dependencies.append(task)
+                task.dependents.append(self)
+            self.waiting = len(self.dependencies)
+
+        def dependency_done(self):
+            """ Returns True when the last of its dependencies is done """
+            with self.lock:
+                self.waiting -= 1
+                return self.waiting == 0
+
+        def run(self,groot):
+            # Nothing that needed a failed task can run. The failure is raised
+            # on the main thread before this task's turn comes
+            if any(task.exc_info or task.skipped for task in self.dependencies):
+                self.skipped = True
+                self.done.set()
+                return
+
+            groot.record(self.ops)
+            try:
+                self.result = self.func(*self.args)
+            except:
+                # Includes SystemExit from groot.fatal(), which is re-raised
+                # on the main thread when this task's output is replayed
+                self.exc_info = sys.exc_info()
+            finally:
+                groot.record(None)
+                self.done.set()
+
+        def wait(self,idle=None):
+            # Wait in short intervals so the main thread still sees Ctrl-C
+            while not self.done.wait(0.1):
+                if idle: idle()
+
+
+
+class TaskGraph(object):
+    """ The work for a command, as named tasks that depend on each other,
+        e.g. "commit the root" after "pull in each submodule". Run with
+        BaseCommand.run_tasks(), which starts each task as soon as the tasks
+        it depends on are done, so independent work overlaps.
+
+        Tasks are added after those they depend on. Their output comes out in
+        the order they were added, just as if they had been run in that order """
+
+    def __init__(self):
+        self.ordered = []
+        self.tasks = {}
+
+
+    def add(self,name,func,args=(),after=(),label=None):
+        """ Add a task that runs func(*args) after the named tasks. The label
+            (e.g. a submodule's tree path) prefixes its output when streamed """
+        if name in self.tasks:
+            raise ValueError("duplicate task: %s" % (name,))
+        task = Executor.Task(func,tuple(args),label)
+        task.depend_on([self.tasks[each] for each in after])
+        self.ordered.append(task)
+        self.tasks[name] = task
+        return name
+
+
+    def result(self,name):
+        """ What the named task's func returned """
+        return self.tasks[name].result
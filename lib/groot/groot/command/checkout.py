@@ -13,8 +13,6 @@ class Checkout(BaseCommand):
 
     """
 
-    __aliases__ = ['checkout','co']
-
 
     def init(self):
         self.target_submodules = []
@@ -7,6 +7,4 @@ class CherryPick(AliasedCommand):
     """ 
 
     """
-    __aliases__ = ['cherry-pick']
-
 
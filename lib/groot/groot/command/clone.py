@@ -2,6 +2,7 @@
 from optparse import OptionParser
 
 from base import *
+from groot.repo import Repo
 
 class Clone(BaseCommand):
     """ Make a clone of a remote repository, and all of the submodules.
@@ -8,13 +8,17 @@ from base import *
 
 class CommitMessages(object):
     def message_for_commit(self, subm, from_commit,to_commit=None):
+        """ Equivalent of 'git log --pretty=oneline from..to' (or 'from^..from'),
+            read through the submodule's cat-file process instead of running git log """
         if from_commit and to_commit:
-            version='%s..%s' % (from_commit,to_commit)
+            commits = subm.git.commits_between(from_commit,to_commit)
         else:
-            version='%s^..%s' % (from_commit,from_commit)
-            
-        log = ['log','--pretty=oneline', version]
-        stdout = subm.do_git(log,capture=True)
+            commit = subm.git.read_commit(from_commit)
+            first_parent = None
+            if commit and commit.parents: first_parent = commit.parents[0]
+            commits = subm.git.commits_between(first_parent,from_commit)
+
+        stdout = ''.join("%s\n" % (c.oneline()) for c in commits)
 
         lines = []
         for line in stdout.split("\n"):
@@ -102,32 +106,83 @@ class Commit(BaseCommand,CommitMessages):
         """
 
         self.groot.debug("commit_submodules: map=%s" % (map))
-        
-        for subm in self.get_submodules():
-            subm.banner(deferred=True,tick=True)
-            
-            if not subm.rel_path in map:
-                self.groot.debug("# Skipping submodule: %s" % (subm.rel_path))
-                continue
-
-            at_head_before = subm.is_at_head()
-            self.groot.debug("# At head of '%s' before commit? %s" %
-                             (subm.preferred_branch(),at_head_before),deferred=True)
-            commit_before = subm.get_current_commit()
-            
-            self.commit_submodule(subm,map[subm.rel_path]['paths'])
 
-            at_head_after = subm.is_at_head()
-            self.groot.log("# At head of '%s' after commit? %s" %
-                           (subm.preferred_branch(),at_head_before),deferred=True)
-            
-            if at_head_before: #and not at_head_after:
-                self.add_submodule(subm,commit_before)
+        # Without a message (or with --reedit-message), each commit brings
+        # up the editor, so they have to be done one at a time
+        jobs = None
+        if not self.has_message() or self.options.reedit: jobs = 1
+
+        # Submodules nested in a submodule are committed first, so the
+        # commit there can include them
+        committed = self.walk_submodules(lambda subm, nested: self.commit_mapped_submodule(subm,map,nested),
+                                         jobs=jobs)
+
+        # Adding to the root index has to be done serially
+        for c in committed:
+            if c: self.add_submodule(*c)
+
+
+    def commit_mapped_submodule(self,subm,map,nested=None):
+        """ Commit in one submodule, along with any of the submodules nested in
+            it that were committed (as returned for them). Returns
+            (subm,commit_before) if the submodule should then be added to the root """
+        subm.banner(deferred=True,tick=True)
+
+        nested = [n for n in nested or [] if n]
+        if not subm.tree_path in map and not nested:
+            self.groot.debug("# Skipping submodule: %s" % (subm.tree_path))
+            return None
+
+        at_head_before = subm.is_at_head()
+        self.groot.debug("# At head of '%s' before commit? %s" %
+                         (subm.preferred_branch(),at_head_before),deferred=True)
+        commit_before = subm.get_current_commit()
+
+        paths = []
+        if subm.tree_path in map:
+            paths = list(map[subm.tree_path]['paths'])
+        message_file = None
+        if nested:
+            message_file = self.add_nested(subm,nested,paths)
 
+        self.commit_submodule(subm,paths,message_file)
 
-    def commit_submodule(self,subm,paths):
+        at_head_after = subm.is_at_head()
+        self.groot.log("# At head of '%s' after commit? %s" %
+                       (subm.preferred_branch(),at_head_before),deferred=True)
+
+        if at_head_before: #and not at_head_after:
+            return (subm,commit_before)
+
+
+    def add_nested(self,subm,nested,paths):
+        """ Add the committed nested submodules in subm, and make sure they go
+            into its commit. Without a message given, the commit gets their
+            commit messages, the way the root's does. Returns the file with
+            that message, if there is one """
+        for n, commit_before in nested:
+            stdout = subm.do_git(['add',n.rel_path],capture=True,tty=True)
+            self.groot.log(stdout,deferred=True)
+            if paths:
+                paths.append(n.rel_path)
+
+        if not self.has_message():
+            return self.message_file([self.message_for_commit(n,from_commit=commit_before,to_commit='HEAD')
+                                      for n, commit_before in nested])
+
+
+    def message_file(self,msg):
+        msg_tmp = NamedTemporaryFile(prefix="groot-",delete=False)
+        msg_tmp.write(''.join(msg))
+        msg_tmp.close()
+        self.cleanup_files.append(msg_tmp.name)
+        return msg_tmp.name
+
+
+    def commit_submodule(self,subm,paths,message_file=None):
         commit = ['commit']
         commit += self.commit_args()
+        if message_file: commit += ['--file',message_file]
         commit += paths
 
         if subm.is_clean():
@@ -141,7 +196,7 @@ class Commit(BaseCommand,CommitMessages):
         
     def add_submodule(self,subm,commit_before):
         add = ['add',subm.rel_path]
-        root = self.get_repo()
+        root = subm.parent_repo()
         stdout = root.do_git(add,capture=True,tty=True)
         self.added_submodules.append((subm,commit_before))
         
@@ -178,12 +233,7 @@ class Commit(BaseCommand,CommitMessages):
         # Special case:
         # If no commit message is given on the command line, use the commit message(s) from the
         # committed submodules
-        has_message = False
-        if self.options.message: has_message=True
-        if self.options.message_file: has_message=True
-        if self.options.reuse: has_message=True
-        if self.options.reedit: has_message=True
-        if not has_message:
+        if not self.has_message():
             self.generate_commit_message_for_root()
         
         commit = ['commit']
@@ -193,6 +243,14 @@ class Commit(BaseCommand,CommitMessages):
         root.do_git(commit,expected_returncode=[0,1])
 
 
+    def has_message(self):
+        """ Whether the commit message was given on the command line """
+        o = self.options
+        if o.message or o.message_file or o.reuse or o.reedit:
+            return True
+        return False
+
+
     def generate_commit_message_for_root(self):
         msg = []
         for s in self.added_submodules:
@@ -200,11 +258,6 @@ class Commit(BaseCommand,CommitMessages):
             msg.append(self.message_for_commit(subm,from_commit=commit_before,to_commit='HEAD'))
 
         if len(msg):
-            msg_tmp = NamedTemporaryFile(prefix="groot-",delete=False)
-            msg_tmp.write(''.join(msg))
-            msg_tmp.close()
-
-            self.options.message_file = msg_tmp.name
-            self.cleanup_files.append(msg_tmp.name)
+            self.options.message_file = self.message_file(msg)
         
                        
@@ -0,0 +1,85 @@
+
+import os
+import sys
+from optparse import OptionParser
+
+from groot.err import *
+import groot.daemon
+
+from base import *
+
+
+class Daemon(BaseCommand):
+    """ Run a groot daemon for the current superproject, which keeps it loaded
+        in memory and answers commands (such as status) for bin/groot over a
+        socket in .git/groot, instead of starting from scratch each time.
+
+        groot daemon [start] [--detach]   run the daemon
+        groot daemon stop                 stop the running daemon
+        groot daemon status               report whether one is running
+
+    """
+
+    def requires_repo(self):
+        return True
+
+
+    def parse_args(self,args):
+        op = OptionParser()
+        op.add_option("-d", "--detach", action="store_true", dest="detach",
+                      help="run in the background")
+
+        self.options, args = op.parse_args(args)
+        self.action = 'start'
+        if args:
+            self.action = args.pop(0)
+        if not self.action in ['start','stop','status']:
+            raise InvalidUsage("Unknown daemon action: %s" % (self.action))
+
+
+    def run(self):
+        root = self.get_repo()
+        path = groot.daemon.socket_path(root.git.git_dir)
+
+        if self.action == 'stop':
+            if not groot.daemon.stop_daemon(path):
+                self.groot.warning("-W- No groot daemon running for %s" % (root.path))
+
+        elif self.action == 'status':
+            if groot.daemon.connect(path):
+                self.groot.log("# groot daemon running: %s" % (path))
+            else:
+                self.groot.log("# groot daemon not running")
+
+        else:
+            self.serve(path)
+
+
+    def serve(self,path):
+        server = groot.daemon.Server(groot.daemon.DaemonGroot(),path)
+        try:
+            server.start()
+        except InvalidUsage, ex:
+            self.groot.fatal("-E- %s" % (ex))
+
+        self.groot.log("# groot daemon listening on %s" % (path))
+        if self.options.detach:
+            self.detach()
+        server.run()
+
+
+    def detach(self):
+        """ Carry on in a new background process, with the parent returning
+            to the shell straight away """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork():
+            os._exit(0)
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+
+        null = os.open(os.devnull,os.O_RDWR)
+        for fd in [0,1,2]:
+            os.dup2(null,fd)
+        os.close(null)
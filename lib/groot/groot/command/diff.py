@@ -7,8 +7,19 @@ class Diff(BaseCommand):
     """ Shortcut for running diff.
     """
 
+    # Most columns the --stat graph of +'s and -'s takes
+    STAT_GRAPH_WIDTH = 40
+
+    # The stat options only read numbers, so they're done this many at
+    # a time unless --jobs says otherwise
+    STAT_JOBS = 8
+
     def requires_repo(self):
         return True
+
+
+    def uses_pager(self):
+        return True
         
 
     def parse_args(self,args):
@@ -19,6 +30,9 @@ class Diff(BaseCommand):
 
         # TODO: Lots more diff options to support
         op.add_option("--cached", action="store_true", dest="cached")
+        op.add_option("--stat", action="store_const", const="stat", dest="stat")
+        op.add_option("--numstat", action="store_const", const="numstat", dest="stat")
+        op.add_option("--shortstat", action="store_const", const="shortstat", dest="stat")
 
         self.options, self.args = op.parse_args(args)
 
@@ -38,6 +52,10 @@ class Diff(BaseCommand):
         else:
             map = self.map_all_submodules()
 
+        if self.options.stat:
+            self.diff_stat(map)
+            return
+
         self.diff_root(map)
         self.diff_submodules(map)
         
@@ -63,19 +81,23 @@ class Diff(BaseCommand):
         """ Run diff in each submodule
         """
 
-        for subm in self.get_submodules():
-            self.groot.flush_log()
-            subm.banner(deferred=True)
-            
-            if not subm.rel_path in map:
-                self.groot.debug("# Skipping submodule: %s" % (subm.rel_path))
-                self.groot.clear_log()
-                continue
+        self.for_each_submodule(lambda subm: self.diff_mapped_submodule(subm,map))
+        self.groot.flush_log()
 
-            if not self.diff_submodule(subm,map[subm.rel_path]['paths']):
-                self.groot.clear_log()
 
+    def diff_mapped_submodule(self,subm,map):
         self.groot.flush_log()
+        subm.banner(deferred=True)
+
+        if not subm.tree_path in map:
+            self.groot.debug("# Skipping submodule: %s" % (subm.tree_path))
+            self.groot.clear_log()
+            return
+
+        if self.diff_submodule(subm,map[subm.tree_path]['paths']):
+            self.groot.flush_log()
+        else:
+            self.groot.clear_log()
             
 
     def diff_submodule(self,subm,paths):
@@ -83,7 +105,7 @@ class Diff(BaseCommand):
         diff += self.diff_args()
         diff += paths
         
-        stdout = subm.do_git(diff,capture=True,tty=True)
+        stdout = subm.do_git(diff,capture=True,tty=True,spool=True)
 
         if stdout and \
                (self.options.verbose or \
@@ -96,5 +118,111 @@ class Diff(BaseCommand):
             
         
     def submodule_is_clean(self,stdout):
-        return stdout.strip() == ''
+        return all(not line.strip() for line in stdout)
+
+
+    def diff_stat(self,map):
+        """ Diff statistics for the root and every mapped submodule, each
+            listed (after the repos before it) as soon as it's done, with a
+            subtotal. Then the total for them all """
+        repos = []
+        if '' in map or not self.args:
+            repos.append((self.get_repo(),map.get('',{}).get('paths',[])))
+        for subm in self.get_submodules():
+            if subm.tree_path in map:
+                repos.append((subm,map[subm.tree_path]['paths']))
 
+        jobs = self.default_jobs(Diff.STAT_JOBS)
+        results = Executor(self.groot,jobs).map(lambda item: self.stat_repo(*item),repos)
+
+        stats = [stat for result in results for stat in result]
+        if stats and self.options.stat != 'numstat':
+            self.groot.log(self.stat_summary(stats))
+
+
+    def stat_repo(self,repo,paths):
+        """ Show the statistics for one repo, and return them """
+        diff = ['diff','--numstat','-z']
+        diff += self.diff_args()
+        diff += paths
+        stdout = repo.do_git(diff,capture=True)
+
+        # Changed gitlinks are left to the submodules' own statistics
+        gitlinks = set(subm.rel_path for subm in repo.get_submodules())
+        stats = []
+        for added, deleted, path in self.parse_numstat(stdout):
+            if path in gitlinks: continue
+            if isinstance(path,tuple):
+                path = '%s => %s' % tuple(self.stat_path(repo,p) for p in path)
+            else:
+                path = self.stat_path(repo,path)
+            stats.append((added,deleted,path))
+
+        if self.options.stat == 'numstat':
+            for added, deleted, path in stats:
+                if added is None: added = deleted = '-'
+                self.groot.log('%s\t%s\t%s' % (added,deleted,path))
+        elif self.options.stat == 'stat' and stats:
+            for line in self.stat_graph(stats):
+                self.groot.log(line)
+            self.groot.log(' %s:%s' % (repo.banner_path(),self.stat_summary(stats)))
+        return stats
+
+
+    def parse_numstat(self,stdout):
+        """ (added,deleted,path) for each file in 'git diff --numstat -z' output,
+            where added and deleted are None for a binary file, and path is
+            (from,to) for a rename """
+        fields = iter(stdout.split('\0'))
+        for field in fields:
+            if not field: continue
+            added, deleted, path = field.split('\t',2)
+            if not path:
+                path = (fields.next(),fields.next())
+            if added == '-':
+                yield (None,None,path)
+            else:
+                yield (int(added),int(deleted),path)
+
+
+    def stat_path(self,repo,path):
+        if repo.tree_path:
+            return '%s/%s' % (repo.tree_path,path)
+        return path
+
+
+    def stat_graph(self,stats):
+        """ Lines of 'git diff --stat' style graph for the stats """
+        width = max(len(path) for added, deleted, path in stats)
+        most = max([added + deleted for added, deleted, path in stats if added is not None] or [0])
+        count_width = len(str(most))
+
+        scale = 1.0
+        if most > Diff.STAT_GRAPH_WIDTH:
+            scale = float(Diff.STAT_GRAPH_WIDTH) / most
+
+        lines = []
+        for added, deleted, path in stats:
+            if added is None:
+                lines.append(' %-*s | %*s' % (width,path,count_width,'Bin'))
+                continue
+            plus, minus = added, deleted
+            if scale < 1:
+                plus = added and max(1,int(added * scale + 0.5))
+                minus = deleted and max(1,int(deleted * scale + 0.5))
+            lines.append((' %-*s | %*d %s%s' % (width,path,count_width,added + deleted,'+' * plus,'-' * minus)).rstrip())
+        return lines
+
+
+    def stat_summary(self,stats):
+        """ ' N files changed, N insertions(+), N deletions(-)', as git has it """
+        files = len(stats)
+        added = sum(added for added, deleted, path in stats if added is not None)
+        deleted = sum(deleted for added, deleted, path in stats if added is not None)
+
+        summary = ' %d file%s changed' % (files,files != 1 and 's' or '')
+        if added or not deleted:
+            summary += ', %d insertion%s(+)' % (added,added != 1 and 's' or '')
+        if deleted or not added:
+            summary += ', %d deletion%s(-)' % (deleted,deleted != 1 and 's' or '')
+        return summary
@@ -8,6 +8,10 @@ class Log(BaseCommand):
 
     def requires_repo(self):
         True
+
+
+    def uses_pager(self):
+        return True
         
 
     def parse_args(self,args):
@@ -1,11 +1,15 @@
 
 import os
+import sys
+import threading
 from optparse import OptionParser
 from tempfile import NamedTemporaryFile
 
 from base import *
 from commit import *
 from groot.err import *
+from groot.remote import HostLimits, RemoteRefs
+from groot.util import url_host
 
 
 class Pull(BaseCommand,CommitMessages):
@@ -13,8 +17,16 @@ class Pull(BaseCommand,CommitMessages):
 
     """
 
+    # However many --jobs there are, no more than this many fetches are
+    # going at once (and see --max-per-host)
+    FETCH_JOBS = 16
+
     def requires_repo(self):
         return True
+
+
+    def uses_network(self):
+        return True
     
 
     def parse_args(self,args):
@@ -37,7 +49,13 @@ class Pull(BaseCommand,CommitMessages):
         op.add_option("--tags","-t", action="store_true", dest="tags", default=True)
         op.add_option("--no-tags", action="store_false", dest="tags")
 
+        op.add_option("--fetch-only", action="store_true", dest="fetch_only")
+        op.add_option("--max-per-host", type="int", dest="max_per_host", default=4,
+                      help="fetch from at most N repos on the same host at once")
+
         self.options, self.args = op.parse_args(args)
+        if self.options.max_per_host < 1:
+            raise InvalidUsage("Invalid --max-per-host: %d" % (self.options.max_per_host))
 
         self.remote = None
         self.refspecs = []
@@ -57,6 +75,7 @@ class Pull(BaseCommand,CommitMessages):
 
         if o.all: args += ['--all']
         if not o.tags: args += ['--no-tags']
+        args += ['--recurse-submodules=no']
 
         if not o.ff: args += ['--no-ff']
         if not o.log: args += ['--no-log']
@@ -71,6 +90,62 @@ class Pull(BaseCommand,CommitMessages):
 
         return args
 
+
+    def fetch_args(self):
+        """ The pull options that are for its fetch """
+        args = []
+        o = self.options
+
+        if o.quiet: args += ['--quiet']
+        if o.verbose: args += ['--verbose']
+        if o.progress: args += ['--progress']
+
+        if o.all: args += ['--all']
+        if not o.tags: args += ['--no-tags']
+
+        # Each submodule is fetched on its own, so git mustn't go into
+        # them as well
+        args += ['--recurse-submodules=no']
+
+        return args
+
+
+    def merge_command(self,subm):
+        """ The command to finish off a pull in the submodule once it has been
+            fetched: a merge of FETCH_HEAD, or a rebase, as set by the options
+            or by the branch.<name>.rebase / pull.rebase / pull.ff config the
+            way git pull would """
+        o = self.options
+        branch = subm.current_branch()
+
+        rebase = o.rebase
+        if rebase is None:
+            rebase = subm.git.get_config_bool('branch.%s.rebase' % (branch))
+        if rebase is None:
+            rebase = subm.git.get_config_bool('pull.rebase',False)
+
+        if rebase:
+            command = ['rebase']
+            if o.quiet: command += ['--quiet']
+            if o.verbose: command += ['--verbose']
+            return command
+
+        command = ['merge']
+        if o.quiet: command += ['--quiet']
+        if o.verbose: command += ['--verbose']
+        if o.progress: command += ['--progress']
+
+        pull_ff = subm.git.get_config('pull.ff')
+        if not o.ff: command += ['--no-ff']
+        elif pull_ff == 'only': command += ['--ff-only']
+        elif subm.git.get_config_bool('pull.ff') is False: command += ['--no-ff']
+
+        if not o.log: command += ['--no-log']
+        if o.commit: command += ['--commit']
+        else: command += ['--no-commit']
+
+        return command + ['FETCH_HEAD']
+
     
     def pull_submodule_args(self,subm):
         """ When pulling in a submodule, doesn't necessarily make sense to use the same
@@ -91,57 +166,147 @@ class Pull(BaseCommand,CommitMessages):
         if not branch:
             raise GitNotOnABranch()
         
-        cfg = ['config','branch.%s.remote' % (branch)]
-        stdout = subm.do_git(cfg,capture=True,expected_returncode=[0,1])
-        if subm.git.last_result[2] == 0:
-            remote = stdout.strip()
+        remote = subm.git.get_config('branch.%s.remote' % (branch))
+        if remote:
             self.groot.debug("# Got branch %s remote=%s" % (branch,remote))
+            merge = subm.git.get_config('branch.%s.merge' % (branch))
 
-        if remote:
-            cfg = ['config','branch.%s.merge' % (branch)]
-            stdout = subm.do_git(cfg,capture=True,expected_returncode=[0,1])
-            if subm.git.last_result[2] == 0:
-                merge = stdout.strip()
-            
 
         if not(remote and merge):
             self.groot.warning("-W- Upstream for local branch %s is not already defined." % (branch))
             remote_branch = subm.git.find_remote_branch(branch,remote)
             if not remote_branch:
-                self.groot.error("-E- Can't find remote branch %s" % (branch))
+                # Maybe it's just not been fetched yet
+                remote = remote or subm.preferred_remote()
+                if self.remote_refs.has_branch(subm,remote,branch):
+                    self.groot.log("# Setting upstream for local branch %s to %s/%s" % (branch,remote,branch))
+                    subm.do_git(['config','branch.%s.remote' % (branch),remote])
+                    subm.do_git(['config','branch.%s.merge' % (branch),'refs/heads/%s' % (branch)])
+                else:
+                    self.groot.error("-E- Can't find remote branch %s" % (branch))
             else:
                 remote = remote_branch.remote
                 remote_branch = remote_branch.name
             
                 self.groot.log("# Setting upstream for local branch %s to %s/%s" % (branch,remote,remote_branch))
-                subm.do_git(['branch','--set-upstream',branch,'%s/%s' % (remote,remote_branch)])
+                subm.do_git(['branch','--set-upstream-to=%s/%s' % (remote,remote_branch),branch])
             
         return []
         
             
 
     def run(self):
-        """ Run pull in each submodule, then at the root """
-        self.require_clean()
-        self.pull_submodules()
-        self.pull_root()
-        if self.options.commit: self.commit_submodules()
-        
+        """ Run pull in each submodule, then at the root. Nothing is merged until
+            all the repos are known to be clean, but the submodules are fetched
+            while that's being checked """
+        self.fetched = {}
+        self.root_fetched = None
+        self.host_limits = HostLimits(self.options.max_per_host,connect_first=self.ssh_master is not None)
+        self.fetch_slots = threading.Semaphore(Pull.FETCH_JOBS)
+        self.remote_refs = RemoteRefs(self.host_limits)
+        if self.options.fetch_only:
+            self.fetch_only()
+            return
 
+        self.groot.log("# Checking that repository is clean...")
+        self.skip_known_clean()
 
-    def require_clean(self):
-        """ Require that the repos are all 'clean' before pulling """
+        tasks = TaskGraph()
+        clean = [tasks.add(('clean',subm.tree_path),self.submodule_is_clean_before_pull,(subm,),
+                           label=subm.tree_path)
+                 for subm in self.get_submodules()]
+        tasks.add('clean',self.require_clean,(tasks,clean),after=clean)
 
-        self.groot.log("# Checking that repository is clean...")
-        clean = True
+        pulled = self.add_pull_tasks(tasks,self.get_repo())
+
+        # With a remote or refspecs given for the root, it's pulled just as
+        # asked. Otherwise it's fetched along with everything else
+        root = self.get_repo()
+        if not self.args and root.current_branch():
+            tasks.add(('fetch',''),self.fetch_root)
+            tasks.add('pull root',self.pull_root,after=['clean',('fetch','')] + pulled)
+        else:
+            tasks.add('pull root',self.pull_root,after=['clean'] + pulled)
+
+        if self.options.commit:
+            messages = [tasks.add(('message',name[1]),self.pull_message,(tasks,name),after=[name])
+                        for name in pulled]
+            tasks.add('commit',self.commit_submodules,(tasks,pulled,messages),
+                      after=pulled + messages + ['pull root'])
+
+        self.run_tasks(tasks)
+
+
+    def fetch_only(self):
+        """ Just fetch, in the root and every submodule, leaving all the branches
+            and working trees as they are """
+        tasks = TaskGraph()
         for subm in self.get_submodules():
-            subm.banner(deferred=True,tick=True)
-            if not subm.is_clean():
-                self.groot.error("-E- There are uncommitted changes.")
-                clean = False
+            tasks.add(('fetch',subm.tree_path),self.fetch_repo,(subm,),label=subm.tree_path)
+        tasks.add(('fetch',''),self.fetch_repo,(self.get_repo(),self.args))
+        self.run_tasks(tasks)
+
+
+    def fetch_repo(self,repo,args=[]):
+        repo.banner(deferred=True,tick=True)
+        stdout, stderr = self.fetch(repo,args)
+        if stderr: self.groot.warning(stderr.rstrip('\n'))
+        if stdout: self.groot.log(stdout)
+
+
+    def fetch(self,repo,args=[]):
+        """ Run git fetch in the repo, once there's room for another fetch from
+            the hosts of the remotes it fetches from, and for another fetch at all. Fetching is the slow part,
+            so when streaming its output isn't captured, and goes out as it comes.
+            Returns the stdout and stderr left to show, if it wasn't streamed """
+        streaming = self.groot.streaming()
+        with self.host_limits.hold(self.fetch_hosts(repo,args)):
+            with self.fetch_slots:
+                stdout = repo.do_git(['fetch'] + self.fetch_args() + args,capture_all=not streaming)
+        if streaming:
+            return '', ''
+        return stdout, repo.git.last_result[1] or ''
+
+
+    def fetch_hosts(self,repo,args=[]):
+        """ The hosts of the remotes fetched from, or None for local ones """
+        if args:
+            remotes = [args[0]]
+        elif self.options.all:
+            remotes = repo.git.remotes()
+        else:
+            branch = repo.current_branch()
+            remotes = [repo.git.get_config('branch.%s.remote' % (branch),'origin')]
+
+        hosts = set()
+        for remote in remotes:
+            urls = repo.git.get_config_all('remote.%s.url' % (remote)) or [remote]
+            hosts.update(url_host(url) for url in urls)
+        return hosts
+
+
+    def add_pull_tasks(self,tasks,parent):
+        """ Add the tasks to fetch and pull each of parent's submodules, after
+            those nested in it. Returns the names of the pull tasks """
+        pulled = []
+        for subm in parent.get_submodules():
+            nested = self.add_pull_tasks(tasks,subm)
+            fetch = tasks.add(('fetch',subm.tree_path),self.fetch_submodule,(subm,),
+                              label=subm.tree_path)
+            pulled.append(tasks.add(('pull',subm.tree_path),self.merge_submodule,(tasks,subm,nested),
+                                    after=['clean',fetch] + nested,label=subm.tree_path))
+        return pulled
+
+
+    def require_clean(self,tasks,clean):
+        """ Require that the repos are all 'clean' before pulling """
+        clean = all(tasks.result(name) for name in clean)
+
+        # The banners left deferred by the checks (and any fetches done by
+        # now) that found nothing to say
+        self.groot.clear_log()
 
         if clean:
-            self.groot.clear_log()
             root = self.get_repo()
             if not root.is_clean(ignore_submodules=True):
                 self.groot.error("-E- There are uncommitted changes.")
@@ -150,50 +315,97 @@ class Pull(BaseCommand,CommitMessages):
         if not clean:
             self.groot.fatal("-E- The repo must be clean before pulling")
 
-            
-    def pull_submodules(self):
-        """ Run pull in each submodule
-        
-
-        """
         self.groot.log("# Starting pull")
-        
-        self.added_submodules = []
-        
-        for subm in self.get_submodules():
-            subm.banner(deferred=True,tick=True)
-            
-            at_head_before = subm.is_at_head()
-            self.groot.debug("# At head of '%s' before pull? %s" %
-                             (subm.preferred_branch(),at_head_before))
-            commit_before = subm.get_current_commit()
-
-            try:
-                self.pull_submodule(subm)
-            except GitNotOnABranch, ex:
-                self.groot.warning("-W- Not on a branch, skipping pull")
-                continue
-                
-            at_head_after = subm.is_at_head()
-            self.groot.debug("# At head of '%s' after pull? %s" %
-                             (subm.preferred_branch(),at_head_before))
-            
-            if at_head_before: #and not at_head_after:
-                self.added_submodules.append((subm,commit_before))
-                
 
-    def pull_submodule(self,subm):
-        pull = ['pull']
-        pull += self.pull_args(subm)
-        
-        stdout = subm.do_git(pull,capture_all=True)
+
+    def submodule_is_clean_before_pull(self,subm):
+        subm.banner(deferred=True,tick=True)
+        if not subm.is_clean():
+            self.groot.error("-E- There are uncommitted changes.")
+            return False
+        return True
+
+
+    def fetch_submodule(self,subm):
+        """ The first half of the pull in a submodule: just the fetch, which
+            changes nothing but remote-tracking refs, so can be done before
+            it's known to be clean. Anything that sets up the branch waits
+            for merge_submodule """
+        subm.banner(deferred=True,tick=True)
+
+        branch = subm.current_branch()
+        if not branch:
+            self.groot.warning("-W- Not on a branch, skipping pull")
+            return
+
+        # A branch without an upstream yet will get one from the preferred
+        # remote (see pull_submodule_args), so that's what is fetched
+        args = []
+        if not self.options.all and not subm.git.get_config('branch.%s.remote' % (branch)):
+            args = [subm.preferred_remote()]
+
+        self.fetched[subm.tree_path] = self.fetch(subm,args)[1]
+
+
+    def fetch_root(self):
+        root = self.get_repo()
+        self.root_fetched = self.fetch(root)[1]
+
+
+    def merge_submodule(self,tasks,subm,nested):
+        """ The rest of the pull in a submodule, then a commit of the pulled-in
+            changes of the submodules nested in it. Returns (subm,commit_before)
+            if the submodule should be added to the root afterwards """
+        if not subm.tree_path in self.fetched:
+            return None
+        fetch_stderr = self.fetched[subm.tree_path]
+
+        at_head_before = subm.is_at_head()
+        self.groot.debug("# At head of '%s' before pull? %s" %
+                         (subm.preferred_branch(),at_head_before))
+        commit_before = subm.get_current_commit()
+
+        branch = subm.current_branch()
+        had_upstream = subm.git.get_config('branch.%s.merge' % (branch)) is not None
+        self.pull_submodule_args(subm)
+
+        # FETCH_HEAD only says what to merge if the upstream was already
+        # set when the fetch was done. If it's only just been set, merge
+        # the remote-tracking branch the fetch updated
+        merge = self.merge_command(subm)
+        upstream = self.upstream_ref(subm,branch)
+        if not had_upstream and upstream and merge[-1] == 'FETCH_HEAD':
+            merge[-1] = upstream
+
+        stdout = subm.do_git(merge,capture_all=True)
+        stderr = fetch_stderr + subm.git.last_result[1]
 
         if stdout and \
            (self.options.verbose or \
             not self.submodule_is_clean(stdout)):
-            if subm.git.last_result[1]: self.groot.error(subm.git.last_result[1])
+            if stderr: self.groot.error(stderr)
             self.groot.log(stdout)
 
+        at_head_after = subm.is_at_head()
+        self.groot.debug("# At head of '%s' after pull? %s" %
+                         (subm.preferred_branch(),at_head_before))
+
+        nested = [tasks.result(name) for name in nested]
+        nested = [n for n in nested if n]
+        if nested and self.options.commit:
+            self.commit_pulled(subm,nested)
+
+        if at_head_before: #and not at_head_after:
+            return (subm,commit_before)
+
+
+    def upstream_ref(self,subm,branch):
+        """ The remote-tracking ref for the branch's upstream, or None """
+        remote = subm.git.get_config('branch.%s.remote' % (branch))
+        merge = subm.git.get_config('branch.%s.merge' % (branch))
+        if remote and merge:
+            return subm.git.remote_branch(subm.git.simple_branch(merge),remote)
+
 
     def submodule_is_clean(self,stdout):
         m = re.search("Current branch .+ is up to date.",stdout)
@@ -202,7 +414,7 @@ class Pull(BaseCommand,CommitMessages):
         
     def add_submodule(self,subm):
         add = ['add',subm.rel_path]
-        root = self.get_repo()
+        root = subm.parent_repo()
         stdout = root.do_git(add,capture=True,tty=True)
 
         self.groot.log(stdout,deferred=True)
@@ -212,25 +424,47 @@ class Pull(BaseCommand,CommitMessages):
         root = self.get_repo()
         root.banner()
 
-        pull = ['pull']
-        pull += self.pull_args(None)
+        if self.root_fetched is None:
+            pull = ['pull']
+            pull += self.pull_args(None)
+            root.do_git(pull)
+            return
+
+        self.groot.write(self.root_fetched,sys.stderr)
+        root.do_git(self.merge_command(root))
+
 
-        root.do_git(pull)
+    def pull_message(self,tasks,name):
+        """ The commit message for a pulled submodule's changes, if it's to be
+            added to the root """
+        pulled = tasks.result(name)
+        if pulled:
+            subm, commit_before = pulled
+            return self.message_for_commit(subm,from_commit=commit_before,to_commit='HEAD')
 
 
-    def commit_submodules(self):
+    def commit_submodules(self,tasks,pulled,messages):
         """ Make a new commit with the pulled-in changes for each submodule.
             Attempts to duplicate the commit messages from the submodules as well,
             so the commits in the root get meaningful commits.
         """
-        root = self.get_repo()
-        if not self.added_submodules:
+        added = [tasks.result(name) for name in pulled]
+        messages = [tasks.result(name) for name in messages]
+        self.commit_pulled(self.get_repo(),[a for a in added if a],[m for m in messages if m is not None])
+
+
+    def commit_pulled(self,root,added_submodules,messages=None):
+        """ Commit the pulled-in changes of the given submodules in root: the
+            superproject, or the submodule they're nested in """
+        if not added_submodules:
             return
 
-        msg = ["groot pull:\n"]
-        for s in self.added_submodules:
-            subm, commit_before = s
-            msg.append(self.message_for_commit(subm,from_commit=commit_before,to_commit='HEAD'))
+        if messages is None:
+            messages = [self.message_for_commit(subm,from_commit=commit_before,to_commit='HEAD')
+                        for subm, commit_before in added_submodules]
+
+        msg = ["groot pull:\n"] + messages
+        for subm, commit_before in added_submodules:
             self.add_submodule(subm)
 
         if root.is_index_clean():
@@ -246,4 +480,3 @@ class Pull(BaseCommand,CommitMessages):
         self.groot.log(stdout,deferred=True)
 
         self.cleanup_files.append(msg_tmp.name)
-
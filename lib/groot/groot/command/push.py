@@ -2,6 +2,8 @@
 from optparse import OptionParser
 
 from base import *
+from groot.remote import HostLimits
+from groot.util import url_host
 
 import re
 
@@ -13,6 +15,10 @@ class Push(BaseCommand):
 
     def requires_repo(self):
         True
+
+
+    def uses_network(self):
+        return True
         
 
     def parse_args(self,args):
@@ -72,25 +78,81 @@ class Push(BaseCommand):
         
 
     def run(self):
+        # Pushes aren't limited per host, but with shared ssh connections,
+        # the first to each host opens the connection for the rest
+        self.host_limits = HostLimits(None,connect_first=self.ssh_master is not None)
         self.push_submodules()
         self.push_root()
 
 
     def push_submodules(self):
-        for subm in self.get_submodules():
-            subm.banner(deferred=True,tick=True)
+        # Nested submodules are pushed before the submodules they're in,
+        # so the commits those refer to are already there. Any that fails
+        # stops the walk, so the root is only pushed if they all went
+        results = self.walk_submodules(self.push_subtree)
+        skipped = sum(results,[])
+        if skipped:
+            count = len(skipped)
+            self.groot.log("# %d submodule%s already up to date, not pushed" %
+                           (count,count != 1 and 's' or ''))
+
+
+    def push_subtree(self,subm,nested):
+        """ Push subm, once the submodules under it are done. Returns the
+            submodules in the subtree that were skipped as up to date """
+        skipped = sum(nested,[])
+        if self.is_up_to_date(subm):
+            if self.options.verbose:
+                subm.banner()
+                self.groot.log("# Up to date with %s/%s, not pushed" % (subm.preferred_remote(),subm.current_branch()))
+            return skipped + [subm]
+        self.push_submodule(subm)
+        return skipped
+
+
+    def is_up_to_date(self,subm):
+        """ Whether pushing subm's branch would have nothing to send, because
+            it's at the same commit as the remote-tracking ref for it. This
+            is read from the refs, without going to the remote -- only the
+            pushes of a single branch can be told apart like this """
+        o = self.options
+        if o.all or o.mirror or o.delete or o.tags or o.force:
+            # Options that change what's sent, or (--force) that are
+            # there because the remote may have moved since the last fetch
+            return False
+
+        remote = subm.preferred_remote()
+        branch = subm.current_branch()
+        if not remote or not branch:
+            return False
+
+        git = subm.git
+        local = git.ref_store.resolve(git.canonical_branch(branch))
+        return local is not None and \
+               local == git.ref_store.resolve(git.remote_branch(branch,remote))
+
 
-            push = ['push']
-            push += self.push_args(subm)
+    def push_submodule(self,subm):
+        subm.banner(deferred=True,tick=True)
 
+        push = ['push']
+        push += self.push_args(subm)
+
+        with self.host_limits.hold([self.remote_host(subm,subm.preferred_remote())]):
             subm.do_git(push,capture_all=True)
-            stdout, stderr, returncode = subm.last_git_result()
-            
-            if (stdout or stderr) and \
-               (self.options.verbose or \
-                not self.submodule_is_clean(stdout,stderr)):
-                self.groot.log(stdout)
-                self.groot.warning(stderr)
+        stdout, stderr, returncode = subm.last_git_result()
+
+        if (stdout or stderr) and \
+           (self.options.verbose or \
+            not self.submodule_is_clean(stdout,stderr)):
+            self.groot.log(stdout)
+            self.groot.warning(stderr)
+
+
+    def remote_host(self,repo,remote):
+        url = repo.git.get_config('remote.%s.pushurl' % (remote)) or \
+              repo.git.get_config('remote.%s.url' % (remote)) or remote
+        return url_host(url)
 
 
     def submodule_is_clean(self,stdout,stderr):
@@ -62,20 +62,23 @@ class Stash(BaseCommand):
     def find_dirty(self):
         """ Check if there's anything to stash before starting """
         self.groot.log("# Finding changes to stash...")
-        dirty_submodules = []
-        for subm in self.get_submodules():
-            subm.banner(deferred=True,tick=True)
-            if not subm.is_clean():
-                dirty_submodules.append(subm)
+        self.skip_known_clean()
+        submodules = self.get_submodules()
+        dirty = self.for_each_submodule(self.submodule_is_dirty,submodules)
+        dirty_submodules = [subm for subm, is_dirty in zip(submodules,dirty) if is_dirty]
 
         self.groot.clear_log()
         root = self.get_repo()
         dirty_root = not root.is_clean(ignore_submodules=True)
 
         return (dirty_submodules,dirty_root)
-            
 
 
+    def submodule_is_dirty(self,subm):
+        subm.banner(deferred=True,tick=True)
+        return not subm.is_clean()
+            
+
         
     def save_root(self):
         """ Run stash save in the root, and return the tag.
@@ -91,11 +94,7 @@ class Stash(BaseCommand):
         # The tag needs to go into the message. If no message is
         # given already, have to manually generate one to include
         # the tag, instead of leaving it to git to generate.
-        message = ' '.join(self.args)
-        if not message:
-            log = root.do_git(['log','--pretty=oneline','-1','HEAD'],capture=True)
-            sha1, rest = log.strip().split(' ',1)
-            message = "%s %s" % (sha1[0:7],rest)
+        message = ' '.join(self.args) or self.head_message(root)
 
 
         # If nothing is changed in the root (a common scenario), have to force
@@ -120,6 +119,14 @@ class Stash(BaseCommand):
         return tag
 
 
+    def head_message(self,repo):
+        """ Default stash message: the abbreviated HEAD commit and its subject """
+        head = repo.git.read_commit('HEAD')
+        if not head:
+            raise GitOutputError("Can't read HEAD commit in %s" % (repo.path))
+        return "%s %s" % (head.sha1[0:7],head.subject())
+
+
     def save_submodules(self,tag,dirty_submodules):
         """ Run stash save in each submodule, using the given tag
             in the stash message """
@@ -130,11 +137,7 @@ class Stash(BaseCommand):
             # The tag needs to go into the message. If no message is
             # given already, have to manually generate one to
             # include the tag
-            message = ' '.join(self.args)
-            if not message:
-                log = subm.do_git(['log','--pretty=oneline','-1','HEAD'],capture=True)
-                sha1, rest = log.strip().split(' ',1)
-                message = "%s %s" % (sha1[0:7],rest)
+            message = ' '.join(self.args) or self.head_message(subm)
             
             # Do the stash
             save = ['stash','save']
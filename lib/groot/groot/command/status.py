@@ -9,11 +9,13 @@ class Status(BaseCommand):
 
     """
 
-    __aliases__ = ['status','st','stat']
-
 
     def requires_repo(self):
         return True
+
+
+    def served_by_daemon(self):
+        return True
         
 
     def parse_args(self,args):
@@ -25,9 +27,9 @@ class Status(BaseCommand):
         
 
     def run(self):
+        self.skip_known_clean()
         self.root_status()
-        for subm in self.get_submodules():
-            self.submodule_status(subm)
+        self.for_each_submodule(self.submodule_status)
         
     def root_status(self):
         root = self.get_repo()
@@ -37,7 +39,7 @@ class Status(BaseCommand):
         if self.options.short: status.append('--short')
         status.extend(self.args)
 
-        stdout = root.do_git(status,capture=True,tty=True)
+        stdout = root.cached_git(status,tty=True)
         print stdout
 
 
@@ -50,15 +52,15 @@ class Status(BaseCommand):
         subm.banner(deferred=True,tick=True)
         
         if not subm.exists():
-            self.groot.warning("-W- Missing submodule: %s" % (subm.rel_path))
+            self.groot.warning("-W- Missing submodule: %s" % (subm.tree_path))
             return
 
-        args = self.args
+        args = list(self.args)
         if self.options.short: args.append('--short')
 
         cmd = ['status']
         cmd.extend(args)
-        stdout = subm.do_git(cmd,capture=True,tty=True)
+        stdout = subm.cached_git(cmd,tty=True,spool=True)
 
         if stdout and \
                (self.options.verbose or \
@@ -67,11 +69,14 @@ class Status(BaseCommand):
 
 
     def submodule_is_clean(self,stdout):
-        m = re.search("Not currently on any branch",stdout)
-        if m: return False
-        
-        m = re.search("nothing to commit \(working directory clean\)",stdout)
-        if m: return True
+        clean = None
+        for line in stdout:
+            m = re.search("Not currently on any branch",line)
+            if m: return False
+
+            m = re.search("nothing to commit \(working directory clean\)",line)
+            if m: clean = True
+        return clean
 
 
 
@@ -1,5 +1,3 @@
 
-import xml.dom.minidom
-
 class GrootConfig(object):
     pass
@@ -0,0 +1,356 @@
+# Long-running groot server, answering commands from bin/groot (through
+# groot.client) over a UNIX socket in the superproject's .git/groot dir
+#
+
+import errno
+import os
+import signal
+import socket
+import sys
+import traceback
+
+from groot.boot import Groot
+from groot.client import SOCKET_PATH, send_frame, recv_frame, connect
+from groot.err import *
+from groot.watch import Watcher, WatchError
+
+
+def socket_path(git_dir):
+    return os.path.join(git_dir,SOCKET_PATH)
+
+
+class DaemonGroot(Groot):
+    """ A Groot that stays loaded, and runs one command after another for
+        clients. The Repo models (and everything they've read and cached)
+        are kept from one command to the next, and refreshed before each """
+
+    def __init__(self):
+        super(DaemonGroot,self).__init__()
+        self.repos = {}
+        self.tokens = {}
+        self.last_changes = None
+        self.answered_clean = {}
+        try:
+            self.watcher = Watcher()
+        except WatchError, ex:
+            self.debug("# Not watching for changes: %s" % (ex))
+            self.watcher = None
+
+
+    def captures_output(self):
+        # Nothing may go to the daemon's own stdout/stderr
+        return True
+
+
+    def open_repo(self,path):
+        repo = self.repos.get(path)
+        if repo:
+            self.last_changes = self.changes(repo)
+            repo.refresh(self.last_changes)
+        else:
+            self.last_changes = None
+            repo = self.repos[path] = super(DaemonGroot,self).open_repo(path)
+        self.watch(repo)
+        return repo
+
+
+    def close_repo(self,repo):
+        if repo.state:
+            repo.state.save()
+
+
+    def known_clean(self,repo):
+        # Everything the daemon knows is already in its own Repo
+        return []
+
+
+    def clean_submodules(self,path):
+        """ For a client's known_clean(): the tree paths of the clean submodules
+            of the superproject at path. A submodule that was clean the last
+            time this was asked is taken to still be, without looking at it,
+            if the watcher has seen nothing written to it or to any submodule
+            nested in it since. The rest are checked with stat_clean() """
+        repo = self.open_repo(path)
+        changed = self.last_changes
+        before = self.answered_clean.get(path,set())
+        try:
+            clean = [subm.tree_path for subm in repo.all_submodules()
+                     if (subm.tree_path in before and self.unchanged(subm,changed)) or \
+                        (subm.exists() and subm.git.stat_clean())]
+            self.answered_clean[path] = set(clean)
+            return clean
+        finally:
+            self.close_repo(repo)
+
+
+    def unchanged(self,subm,changed):
+        """ Whether the watcher has seen nothing written to subm, or to the
+            submodules under it, since the repo was last opened """
+        if changed is None:
+            return False
+        prefix = subm.path + os.sep
+        return not any(path == subm.path or path.startswith(prefix) for path in changed)
+
+
+    def watch(self,repo):
+        """ Start watching the repo and any of its submodules that aren't
+            being watched yet, e.g. because they've just been checked out """
+        if not self.watcher:
+            return
+        for each in [repo] + repo.all_submodules():
+            if not each.path in self.watcher.repo_wds and each.git.initialized():
+                self.watcher.watch_repo(each.path,each.git.git_dir,each.git.common_dir)
+        if not repo.path in self.tokens:
+            self.tokens[repo.path] = self.watcher.poll()
+
+
+    def changes(self,repo):
+        """ The paths of the repos (the superproject or its submodules) that
+            may have changed since the last command for it, or None if that
+            isn't known. Submodules that aren't being watched may have """
+        if not self.watcher or not repo.path in self.tokens:
+            return None
+        token = self.watcher.poll()
+        changed = self.watcher.changed_since(self.tokens[repo.path])
+        self.tokens[repo.path] = token
+        for each in [repo] + repo.all_submodules():
+            if not each.path in self.watcher.repo_wds:
+                changed.add(each.path)
+        return changed
+
+
+    def close(self):
+        for repo in self.repos.values():
+            repo.close()
+        self.repos = {}
+        if self.watcher:
+            self.watcher.close()
+
+
+    def serve(self,request,output):
+        """ Run one command for a client, as bin/groot would have in the
+            client's directory and environment, with the output going to the
+            given ClientOutput. Returns the exit code, or None if the client
+            should run the command itself """
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        saved_streams = (sys.stdout,sys.stderr)
+        self.reset()
+        try:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.stdout, sys.stderr = output.stdout, output.stderr
+            return self.run_command(request['argv'],output)
+        finally:
+            sys.stdout, sys.stderr = saved_streams
+            os.environ.clear()
+            os.environ.update(saved_env)
+            os.chdir(saved_cwd)
+
+
+    def run_command(self,argv,output):
+        """ Same as main(), except that output is held back until the command
+            is known to be one the daemon may run """
+        try:
+            try:
+                self.parse_args(argv)
+            except BaseException:
+                output.release()
+                raise
+
+            if not self.command.served_by_daemon():
+                output.discard()
+                return None
+            output.release()
+
+            self.do_cmd()
+            self.stop_ticking()
+            return 0
+
+        except SystemExit, ex:
+            if ex.code is None:
+                return 0
+            if isinstance(ex.code,int):
+                return ex.code
+            print >> sys.stderr, ex.code
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+
+
+class ClientOutput(object):
+    """ The output going back to a client, in the order it was written to
+        its stdout and stderr. It's sent in batches, when flushed or when
+        enough has built up, but not at all until release() is called """
+
+    BATCH_SIZE = 65536
+
+    def __init__(self,sock,tty):
+        self.sock = sock
+        self.stdout = ClientStream(self,'out',tty[0])
+        self.stderr = ClientStream(self,'err',tty[1])
+        self.frames = []
+        self.size = 0
+        self.holding = True
+
+
+    def write(self,kind,data):
+        if self.frames and self.frames[-1][0] == kind:
+            self.frames[-1][1].append(data)
+        else:
+            self.frames.append((kind,[data]))
+        self.size += len(data)
+        if self.size >= ClientOutput.BATCH_SIZE:
+            self.flush()
+
+
+    def flush(self):
+        if self.holding:
+            return
+        for kind, chunks in self.frames:
+            send_frame(self.sock,(kind,''.join(chunks)))
+        self.frames = []
+        self.size = 0
+
+
+    def release(self):
+        """ Stop holding output back, and send what there is so far """
+        self.holding = False
+        self.flush()
+
+
+    def discard(self):
+        self.frames = []
+        self.size = 0
+
+
+
+class ClientStream(object):
+    """ File-like object for the client's stdout or stderr """
+
+    def __init__(self,output,kind,tty):
+        self.output = output
+        self.kind = kind
+        self.tty = tty
+        self.softspace = 0
+
+
+    def write(self,data):
+        if not data:
+            return
+        if isinstance(data,unicode):
+            data = data.encode('utf-8')
+        self.output.write(self.kind,data)
+
+
+    def writelines(self,lines):
+        for line in lines:
+            self.write(line)
+
+
+    def flush(self):
+        self.output.flush()
+
+
+    def isatty(self):
+        return self.tty
+
+
+
+class Server(object):
+    """ Accepts connections on the socket, one command at a time """
+
+    def __init__(self,groot,path):
+        self.groot = groot
+        self.path = path
+        self.sock = None
+        self.running = False
+
+
+    def start(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        if os.path.exists(self.path):
+            sock = connect(self.path)
+            if sock:
+                sock.close()
+                raise InvalidUsage("groot daemon is already running: %s" % (self.path))
+            os.unlink(self.path)
+
+        self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(16)
+
+
+    def run(self):
+        """ Serve until asked to stop (or killed) """
+        signal.signal(signal.SIGTERM,self.terminate)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    conn, address = self.sock.accept()
+                except socket.error, ex:
+                    if ex.args[0] == errno.EINTR: continue
+                    raise
+                try:
+                    self.handle(conn)
+                except socket.error:
+                    # The client went away before getting all its output
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            self.stop()
+
+
+    def handle(self,conn):
+        request = recv_frame(conn)
+        if not request:
+            return
+        if 'stop' in request:
+            self.running = False
+            send_frame(conn,('exit',0))
+            return
+        if 'clean' in request:
+            send_frame(conn,('answer',self.groot.clean_submodules(request['clean'])))
+            return
+
+        output = ClientOutput(conn,request['tty'])
+        code = self.groot.serve(request,output)
+        output.flush()
+        if code is None:
+            send_frame(conn,('fallback',))
+        else:
+            send_frame(conn,('exit',code))
+
+
+    def terminate(self,signum,frame):
+        self.running = False
+        raise SystemExit(0)
+
+
+    def stop(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        self.groot.close()
+
+
+def stop_daemon(path):
+    """ Ask the daemon listening at path to exit. Returns False if there isn't one """
+    sock = connect(path)
+    if not sock:
+        return False
+    try:
+        send_frame(sock,{ 'stop': True })
+        recv_frame(sock)
+    finally:
+        sock.close()
+    return True
@@ -2,41 +2,96 @@
 # Utilities for accessing git
 #
 
-import inspect
+import errno
+import fcntl
+import heapq
+import itertools
 import os
 import pty
 import re
 import select
-import signal
 import subprocess
 import sys
 import threading
-import tty
+import time
 
 from groot.boot import Groot
 from groot.err import *
-from groot.util import safe_chdir
+from groot.index import Index
+from groot.objects import ObjectStore
+from groot.spool import Spool
 
 
 
 class Git(object):
+
+    PTY_READ_SIZE = 65536
+
+    # How much of a streamed command's stderr is kept for its result
+    STDERR_TAIL = 4096
+
+    # Commands that never change the repository, so they don't
+    # need to invalidate anything cached about it
+    READ_ONLY_COMMANDS = set(['status','diff','diff-index','diff-files','diff-tree',
+                              'log','show','show-ref','rev-parse','rev-list','cat-file',
+                              'ls-files','ls-tree','ls-remote','merge-base','for-each-ref'])
+    READ_ONLY_SUBCOMMANDS = { 'submodule': ['status'],
+                              'stash': ['list','show'] }
+
+    # Outputs that depend on more untracked directories than this aren't
+    # kept between runs (see work_tree_state_paths)
+    MAX_UNTRACKED_DIRS = 1000
+
     def  __init__(self,path):
         self.groot = Groot.instance
         self.find_git_dir(path)
-        self.refs = None
-        self.config = None
+        self.results = threading.local()
+        self.cat_file_batch = None
+        self.cat_file_check = None
+        self.cached_status = None
+        self.cached_gitlinks = None
+        self.cached_index = None
+        self.cached_stat_clean = None
+        self.object_store = None
+        self.submodule_gits = {}
+        self.state_cache = None
+        self.state_name = None
+        self.cached_outputs = {}
+
+
+    # The result of the last command is kept per thread, so that the same
+    # Git instance can be used from several worker threads at once
+    @property
+    def last_result(self):
+        return getattr(self.results,'last_result',None)
+
+    @last_result.setter
+    def last_result(self,value):
+        self.results.last_result = value
+
+    @property
+    def last_command(self):
+        return getattr(self.results,'last_command',None)
+
+    @last_command.setter
+    def last_command(self,value):
+        self.results.last_command = value
         
 
     def find_git_dir(self,path,bare=False):
         """ Find the .git dir for the given git repo path """
         if not path:
-            self.path = self.git_dir = None
+            self.path = self.git_dir = self.common_dir = self.ref_store = None
             return
         
         if bare: git_dir = path
         else: git_dir = os.path.join(path,'.git')
         
-        if os.path.exists(git_dir):
+        if os.path.isfile(git_dir):
+            # A 'gitdir: <path>' pointer, as used for submodules and worktrees
+            self.path = path
+            self.git_dir = self.read_gitdir_file(git_dir)
+        elif os.path.exists(git_dir):
             self.path = path
             self.git_dir = git_dir
         elif os.path.exists(os.path.join(path,'HEAD')):
@@ -46,6 +101,23 @@ class Git(object):
             self.path = path
             self.git_dir = git_dir
 
+        # Linked worktrees share refs, config, etc with the main repo
+        self.common_dir = self.git_dir
+        commondir_path = os.path.join(self.git_dir,'commondir')
+        if os.path.exists(commondir_path):
+            common_dir = open(commondir_path).read().strip()
+            self.common_dir = os.path.normpath(os.path.join(self.git_dir,common_dir))
+
+        self.ref_store = RefStore.for_repo(self.git_dir,self.common_dir)
+
+
+    def read_gitdir_file(self,path):
+        line = open(path).readline().strip()
+        if not line.startswith('gitdir:'):
+            raise GitStructureError("unrecognized .git file: %s" % (path))
+        git_dir = line[len('gitdir:'):].strip()
+        return os.path.normpath(os.path.join(os.path.dirname(path),git_dir))
+
 
     def initialized(self):
         return self.git_dir and os.path.exists(self.git_dir)
@@ -54,10 +126,6 @@ class Git(object):
     def do_command(self,git_command,**kwargs):
         self.groot.debug("# In %s: %s (%s)" % (self.path,' '.join(git_command),kwargs))
 
-        # Run the command in the root directory of the git repo
-        if self.path:
-            cd = safe_chdir(self.path)
-
         # Set up the command line and args for creating the subprocess
         call_args = {}
         if 'capture' in kwargs and kwargs['capture']:
@@ -66,11 +134,39 @@ class Git(object):
             call_args['stdout'] = subprocess.PIPE
             call_args['stderr'] = subprocess.PIPE
 
-        # Execute the command as a subprocess
-        if 'tty' in kwargs and kwargs['tty']:
-            stdout, stderr, returncode = self.do_command_with_tty(git_command,**call_args)
+        # When running as a parallel task (or in the daemon), output can't go
+        # straight to the terminal -- capture it and pass it on instead
+        echo = False
+        if self.groot.captures_output() and not 'stdout' in call_args:
+            call_args['stdout'] = subprocess.PIPE
+            call_args['stderr'] = subprocess.PIPE
+            echo = True
+
+        # Captured output can be spooled (see groot.spool) rather than held in
+        # memory. Output that's only being passed on always is
+        spool = 'stdout' in call_args and (echo or kwargs.get('spool'))
+
+        # Execute the command as a subprocess.
+        # A pty is only used when explicitly asked for. For tty=True, git is
+        # just told to color its output as it would for a terminal. Nothing
+        # in groot asks for a pty any more: the pty runner is only kept as
+        # the baseline that testing/bench_capture.py measures the others by
+        if 'pty' in kwargs and kwargs['pty']:
+            stdout, stderr, returncode = self.do_command_with_tty(git_command,spool,**call_args)
         else:
-            stdout, stderr, returncode = self.do_command_with_pipes(git_command,**call_args)
+            if 'tty' in kwargs and kwargs['tty'] and 'stdout' in call_args and self.isa_tty():
+                call_args['env'] = self.color_env()
+            if echo and self.groot.streaming():
+                stdout, stderr, returncode = self.do_command_streamed(git_command,**call_args)
+                echo = False    # Already passed on
+            else:
+                stdout, stderr, returncode = self.do_command_with_pipes(git_command,spool,**call_args)
+        if not Git.is_read_only(git_command):
+            self.invalidate()
+        if echo:
+            self.groot.write(stdout,sys.stdout)
+            self.groot.write(stderr,sys.stderr)
+            stdout = stderr = None
         self.last_result = (stdout,stderr,returncode)
         self.last_command = (git_command,kwargs)
 
@@ -80,8 +176,10 @@ class Git(object):
                 for line in stderr.rstrip().split('\n'):
                     self.groot.debug("EE> %s" % line)
             if stdout:
-                for line in stdout.rstrip().split('\n'):
-                    self.groot.debug("--> %s" % line)
+                lines = stdout
+                if not isinstance(stdout,Spool): lines = stdout.rstrip().split('\n')
+                for line in lines:
+                    self.groot.debug("--> %s" % line.rstrip('\n'))
 
         # Check the result of the command
         expected_returncode=[0]
@@ -95,78 +193,197 @@ class Git(object):
         return stdout
 
 
-    def do_command_with_tty(self,git_command,**call_args):
+    @staticmethod
+    def is_read_only(git_command):
+        """ Whether the git command is known not to change the repository """
+        args = git_command[1:]
+        while args and args[0].startswith('-'):
+            if args[0] in ['-c','-C']: args = args[1:]
+            args = args[1:]
+        if not args:
+            return True
+
+        if args[0] in Git.READ_ONLY_COMMANDS:
+            return True
+        if args[0] in Git.READ_ONLY_SUBCOMMANDS:
+            return len(args) > 1 and args[1] in Git.READ_ONLY_SUBCOMMANDS[args[0]]
+        return False
+
+
+    def invalidate(self):
+        """ Forget anything cached about the state of the repo, after
+            running a command that may have changed it """
+        self.invalidate_status()
+        self.cached_gitlinks = None
+
+
+    def invalidate_status(self):
+        """ Forget the cached status only, e.g. after a change in a submodule,
+            which changes the working tree of the root but not its index """
+        self.cached_status = None
+        self.cached_stat_clean = None
+        self.cached_outputs = {}
+
+
+    def do_command_with_tty(self,git_command,spool=False,**call_args):
         """ Run the command as a subprocess using a pseudo-tty, so that it
              behaves as though it were running directly on an (interactive) tty.
-             This means it will output default color codes, etc """
-        # Adapted from subprocess.communicate and
-        # http://code.google.com/p/lilykde/source/browse/trunk/runpty.py?r=314
+             Only needed for commands that really have to see a terminal --
+             for colored output, capturing with color_env() is much cheaper """
 
         # If not running on an interactive terminal already, no reason
         # to fake it for git command subprocesses...
         if not self.isa_tty():
-            return self.do_command_with_pipes(git_command,**call_args)
+            return self.do_command_with_pipes(git_command,spool,**call_args)
 
         self.groot.debug("# With TTY: %s" % (' '.join(git_command)))
 
-        echo = False
-        if 'echo' in call_args: echo=call_args['echo']
-        
+        # If the caller isn't capturing the output, it gets passed
+        # straight through as it's read
+        echo = not 'stdout' in call_args
+
         master, slave = pty.openpty()
         call_args['stdout'] = slave
-        master_fh = os.fdopen(master)
-        
-        #if 'capture_all' in call_args and call_args['capture_all']:
-        #    call_args['stderr'] = subprocess.PIPE
         call_args['close_fds'] = True
 
         # Don't inherit the PAGER env var for the git subprocess.
         # That causes problems for things like multi-page output from git diff
         env = dict(os.environ)
-        #if 'PAGER' in env: del env['PAGER']
         env['PAGER'] = ''
         call_args['env'] = env
-        
-        # Execute the command with a helper script that ensures we can detect
-        # the end of output so it doesn't try to read (and block) forever:
-        wrapper = os.path.join(os.path.dirname(inspect.getfile(inspect.currentframe())),'git-wrapper.sh')
-        marker = '___EOF:%s___' % (os.getpid())
-        re_marker = re.compile(r'%s:([0-9]+)' % (marker))
-        
-        p = subprocess.Popen([wrapper,marker]+git_command,**call_args)
 
-        stdout = ''
-        stderr = ''
+        try:
+            p = self.spawn(git_command,**call_args)
+        finally:
+            # Only the child holds the slave side now, so reading the master
+            # gets EIO once the child (and anything it started) is done with it
+            os.close(slave)
+
+        output = None
+        if spool: output = Spool()
+        try:
+            stdout, stderr = self.read_pty(p,master,echo,output)
+        finally:
+            os.close(master)
+
+        if echo: stdout = None
+        return (stdout, stderr, p.returncode)
 
+
+    def read_pty(self,p,master,echo=False,spool=None):
+        """ Read everything from the pty master (and stderr pipe, if any) until
+            the process exits. Reads are done in large chunks and joined at the
+            end, rather than line by line -- or written to the spool, if given """
+        fcntl.fcntl(master,fcntl.F_SETFL,fcntl.fcntl(master,fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        chunks = { master: [] }
         monitor = [master]
-        nop = []
-        returncode = None
-        
+        if p.stderr:
+            chunks[p.stderr.fileno()] = []
+            monitor.append(p.stderr.fileno())
+
         while monitor:
-            fds = select.select(monitor,nop,nop)[0]
-            if master in fds:
-                line = master_fh.readline()
-                m = re_marker.search(line)
-                if m:
-                    monitor.remove(master)
-                    returncode = int(m.group(1))
-                    os.kill(p.pid,signal.SIGKILL)
+            ready = select.select(monitor,[],[],0.1)[0]
+            if not ready and p.poll() is not None:
+                # The child is gone but something it started may still
+                # hold the pty open -- take whatever is left and stop
+                ready = monitor[:]
+                monitor = []
+
+            for fd in ready:
+                try:
+                    data = os.read(fd,Git.PTY_READ_SIZE)
+                except OSError, ex:
+                    if ex.errno == errno.EAGAIN: continue
+                    if ex.errno != errno.EIO: raise
+                    data = ''  # EIO is how the pty reports EOF
+
+                if not data:
+                    if fd in monitor: monitor.remove(fd)
+                    continue
+
+                if spool is not None and fd == master:
+                    spool.write(data)
                 else:
-                    stdout += line
-                    if echo: print(line)
+                    chunks[fd].append(data)
+                if echo and fd == master:
+                    sys.stdout.write(data)
+                    sys.stdout.flush()
 
         p.wait()
-        return (stdout, stderr, returncode)
+
+        if spool is not None:
+            stdout = spool
+        else:
+            stdout = ''.join(chunks[master])
+        stderr = None
+        if p.stderr:
+            stderr = ''.join(chunks[p.stderr.fileno()])
+            p.stderr.close()
+        return (stdout, stderr)
     
 
-    def do_command_with_pipes(self,git_command,**call_args):
+    def do_command_with_pipes(self,git_command,spool=False,**call_args):
         """ Run the command as a subprocess using normal pipes. The command
             will therefore not consider itself to be running on a tty/interative mode """
         self.groot.debug("# With pipes: %s" % (' '.join(git_command)))
         
-        p = subprocess.Popen(git_command,**call_args)
-        stdout, stderr = p.communicate()
-        return (stdout, stderr, p.returncode)
+        call_args['close_fds'] = True
+        p = self.spawn(git_command,**call_args)
+        if not spool:
+            stdout, stderr = p.communicate()
+            return (stdout, stderr, p.returncode)
+
+        stdout = Spool()
+        stderr = []
+        sinks = { p.stdout: stdout.write }
+        if p.stderr: sinks[p.stderr] = stderr.append
+        self.read_pipes(p,sinks)
+        return (stdout, p.stderr and ''.join(stderr), p.returncode)
+
+
+    def do_command_streamed(self,git_command,**call_args):
+        """ Run the command with pipes, passing its output on to groot.write()
+            as it's read rather than all at once when it's done (groot --stream).
+            The last STDERR_TAIL bytes of stderr are kept, and returned as its
+            stderr, so a failure can still say what went wrong """
+        call_args['close_fds'] = True
+        p = self.spawn(git_command,**call_args)
+        tail = ['']
+
+        def write_stderr(data):
+            self.groot.write(data,sys.stderr)
+            tail[0] = (tail[0] + data)[-Git.STDERR_TAIL:]
+
+        self.read_pipes(p,{ p.stdout: lambda data: self.groot.write(data,sys.stdout),
+                            p.stderr: write_stderr })
+        return (None, tail[0], p.returncode)
+
+
+    def read_pipes(self,p,sinks):
+        """ Read the process's pipes until they're closed, passing each chunk
+            read to the sink function for its pipe, then wait for it to exit """
+        fds = dict((pipe.fileno(),sink) for pipe, sink in sinks.items())
+        while fds:
+            for fd in select.select(fds.keys(),[],[])[0]:
+                data = os.read(fd,Git.PTY_READ_SIZE)
+                if data:
+                    fds[fd](data)
+                else:
+                    del fds[fd]
+
+        for pipe in sinks:
+            pipe.close()
+        p.wait()
+
+
+    def spawn(self,command,**call_args):
+        """ Start the subprocess in the root directory of the git repo.
+            The directory is passed to the child only, so the process-wide
+            cwd is never changed """
+        if self.path:
+            call_args['cwd'] = self.path
+        return subprocess.Popen(command,**call_args)
 
 
     def isa_tty(self):
@@ -175,35 +392,332 @@ class Git(object):
         return sys.stdout.isatty()
 
 
+    def color_env(self):
+        """ Environment for a captured git command that should color its output
+            the same as if it were writing to the terminal. Telling git that its
+            output goes to a pager turns on every color.* setting that is 'auto',
+            while still respecting any that are explicitly turned off """
+        env = dict(os.environ)
+        env['GIT_PAGER_IN_USE'] = 'true'
+        return env
+
+
+    def status(self):
+        """ Returns a RepoStatus for the repo, from a single 'git status' call.
+            The result is cached until a command that changes the repo is run.
+            Untracked files don't count for anything it's used for, so they
+            aren't looked for """
+        status = self.cached_status
+        if not status:
+            cmd = ['git','status','--porcelain=v2','--branch','--untracked-files=no','-z']
+            status = RepoStatus(self.do_command(cmd,capture=True))
+            self.cached_status = status
+        return status
+
+
+    def index(self):
+        """ Returns an Index for reading the repo's index file in-process.
+            It's re-opened whenever the file has been rewritten. The old one
+            isn't closed, since another thread may still be reading it; its
+            mapping goes when the last reference to it does """
+        path = os.path.join(self.git_dir,'index')
+        key = RefStore.file_key(path)
+        cached = self.cached_index
+        if not cached or cached[0] != key or not RefStore.settled(key):
+            cached = self.cached_index = (key,Index(path))
+        return cached[1]
+
+
+    def gitlinks(self):
+        """ Returns a dict of path -> SHA-1 for every submodule commit recorded
+            in the index. Read directly from the index file where possible, or
+            else with a single 'git ls-files' call. The result is cached until
+            a command that changes the repo is run """
+        gitlinks = self.cached_gitlinks
+        if gitlinks is None:
+            index_path = os.path.join(self.git_dir,'index')
+            gitlinks = self.state_entry('gitlinks',lambda: [index_path],self.read_gitlinks)
+            self.cached_gitlinks = gitlinks
+        return gitlinks
+
+
+    def read_gitlinks(self):
+        try:
+            return self.index().gitlinks()
+        except GitStructureError, ex:
+            self.groot.debug("# Can't read index directly (%s), using ls-files" % (ex))
+            return self.gitlinks_from_ls_files()
+
+
+    def gitlinks_from_ls_files(self):
+        gitlinks = {}
+        stdout = self.do_command(['git','ls-files','--stage','-z'],capture=True)
+        for entry in stdout.split('\0'):
+            if not entry.startswith('160000 '): continue
+            info, path = entry.split('\t',1)
+            mode, sha1, stage = info.split(' ')
+            if stage == '0' or not path in gitlinks:
+                gitlinks[path] = sha1
+        return gitlinks
+
+
     def is_clean(self,**kwargs):
         """ Returns true if both the index and working tree are clean """
-        return self.is_index_clean(**kwargs) and self.is_working_tree_clean(**kwargs)
+        if not self.cached_status and self.stat_clean():
+            return True
+        return self.status().is_clean(**kwargs)
 
 
     def is_index_clean(self,**kwargs):
-        cmd = ['git','diff-index','--cached','--quiet']
-        if 'ignore_submodules' in kwargs and kwargs['ignore_submodules']:
-            cmd += ['--ignore-submodules']
-        cmd += ['HEAD']
-        self.do_command(cmd,expected_returncode=[0,1])
-        return self.last_result[2] == 0
+        return self.status().is_index_clean(**kwargs)
 
 
     def is_working_tree_clean(self,**kwargs):
-        cmd = ['git','status','-uno','--short']
-        # TODO: Should use -z for more machine-friendly output for parsing?
-        #if 'ignore_submodules' in kwargs and kwargs['ignore_submodules']:
-        #    cmd += ['--ignore-submodules']
-        stdout = self.do_command(cmd,capture=True)
-        return stdout.strip() == ''
+        if not self.cached_status and self.stat_clean():
+            return True
+        return self.status().is_working_tree_clean(**kwargs)
+
+
+    def stat_clean(self):
+        """ Quick check that the repo is clean without running git: the index
+            must match HEAD's tree, and the stat data recorded in the index must
+            match the files in the working tree. True means clean; False only
+            means that git has to be asked (something differs, or can't be
+            told apart from stat data alone) """
+        clean = self.cached_stat_clean
+        if clean is None:
+            try:
+                clean = self.index_matches_head() and self.work_tree_matches_index()
+            except (GitStructureError,EnvironmentError), ex:
+                self.groot.debug("# Can't check %s from stat data: %s" % (self.path,ex))
+                clean = False
+            self.cached_stat_clean = clean
+        return clean
+
+
+    def assume_clean(self):
+        """ Take stat_clean() as true without checking, e.g. when a groot
+            daemon watching the repo already knows it is """
+        self.cached_stat_clean = True
+
+
+    def index_matches_head(self):
+        tree = self.index().cache_tree()
+        head = self.ref_store.resolve('HEAD')
+        if not tree or not head:
+            return False
+        commit = self.read_commit(head)
+        return commit is not None and commit.tree == tree
+
+
+    def work_tree_matches_index(self):
+        index = self.index()
+        index_mtime = index.mtime()
+        for entry in index.entries():
+            if entry.stage() or entry.extended_flags & Index.INTENT_TO_ADD:
+                return False
+            if entry.flags & Index.ASSUME_VALID or entry.extended_flags & Index.SKIP_WORKTREE:
+                continue
+
+            if entry.mode == Index.GITLINK_MODE:
+                if not self.submodule_stat_clean(entry.path,entry.sha1):
+                    return False
+                continue
+
+            try:
+                st = os.lstat(os.path.join(self.path,entry.path))
+            except OSError:
+                return False
+            if not entry.matches(st):
+                return False
+
+            # "Racy git": a file written in the same second as the index could
+            # have changed again without its stat data changing. Only git
+            # (comparing contents) can tell whether it's really clean
+            if entry.mtime >= index_mtime:
+                return False
+        return True
+
+
+    def submodule_stat_clean(self,path,sha1):
+        """ A submodule is clean if it has the commit from the index checked
+            out, and is clean itself. One that isn't checked out at all doesn't
+            count as a change, but a missing directory does """
+        full_path = os.path.join(self.path,path)
+        if not os.path.isdir(full_path):
+            return False
+        if not os.path.exists(os.path.join(full_path,'.git')):
+            return True
+        git = self.submodule_git(path)
+        return git.ref_store.resolve('HEAD') == sha1 and git.stat_clean()
+
+
+    def use_state_cache(self,cache,name):
+        """ Keep things learned about this repo in the given StateCache, under
+            entries named for it """
+        self.state_cache = cache
+        self.state_name = name
+
+
+    def state_entry(self,name,paths,compute):
+        """ The value compute() returns, reused from the state cache (from
+            an earlier groot run) for as long as none of the files or
+            directories listed by paths() has changed. If paths() gives None,
+            there are too many to check, and the value isn't kept """
+        cache = self.state_cache
+        if not cache:
+            return compute()
+
+        name = '%s:%s' % (self.state_name,name)
+        value = cache.get(name)
+        if value is None:
+            value = compute()
+            # Spooled to disk means too big to keep
+            if not isinstance(value,Spool):
+                state_paths = paths()
+                if state_paths is not None:
+                    cache.put(name,state_paths,value)
+        return value
+
+
+    def cached_output(self,git_command,spool=False,**kwargs):
+        """ Captured output of a read-only command. It's remembered until the
+            status is invalidated, and for a clean repo (see stat_clean()) it
+            can also come from an earlier groot run, if nothing it could depend
+            on has changed since.
+
+            With spool=True, it's returned as a Spool, and output too big to
+            keep in memory isn't remembered """
+        if not self.is_read_only(git_command):
+            return self.do_command(git_command,capture=True,spool=spool,**kwargs)
+
+        name = 'output:%s' % (' '.join(git_command))
+        if 'tty' in kwargs and kwargs['tty'] and self.isa_tty():
+            name += ' (color)'
+
+        def compute():
+            stdout = self.do_command(git_command,capture=True,spool=spool,**kwargs)
+            if spool and not stdout.spilled():
+                return stdout.getvalue()
+            return stdout
+
+        stdout = self.cached_outputs.get(name)
+        if stdout is None:
+            if self.stat_clean():
+                stdout = self.state_entry(name,self.work_tree_state_paths,compute)
+            else:
+                stdout = compute()
+            if isinstance(stdout,Spool):
+                return stdout
+            self.cached_outputs[name] = stdout
+
+        if spool:
+            return Spool.of(stdout)
+        return stdout
+
+
+    def repo_state_paths(self):
+        """ Files whose keys change whenever HEAD, the index, refs, config
+            (including the global and system config, and any files they
+            include) or the exclude files do. Any change to a loose ref also
+            changes the mtime of the directory it's in """
+        paths = [os.path.join(self.git_dir,'HEAD'),
+                 os.path.join(self.git_dir,'index'),
+                 os.path.join(self.common_dir,'packed-refs'),
+                 os.path.join(self.common_dir,'info','exclude'),
+                 self.excludes_file()]
+        for path in self.config_paths():
+            paths.extend(GitConfig.load(path,git_dir=self.git_dir).paths)
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.common_dir,'refs')):
+            paths.append(dirpath)
+        return paths
+
+
+    def excludes_file(self):
+        """ The global exclude file: core.excludesFile, or git's default """
+        path = self.get_config('core.excludesFile')
+        if path:
+            return os.path.expanduser(path)
+        xdg_home = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+        return os.path.join(xdg_home,'git','ignore')
+
+
+    def work_tree_state_paths(self):
+        """ repo_state_paths(), plus the working tree directories: every
+            directory with tracked files in it, and every untracked one, with
+            the .gitignore each may have. Adding or removing a file changes
+            its directory's mtime, which is how new untracked files show up.
+            The same goes for each submodule that's checked out, since e.g.
+            untracked files in one show up in the status of this repo.
+
+            None if there are more than MAX_UNTRACKED_DIRS untracked
+            directories, as there could be under e.g. an ignored build
+            directory, rather than walk them all """
+        index = self.index()
+        tracked = set([''])
+        for path in index.paths():
+            path = os.path.dirname(path)
+            while not path in tracked:
+                tracked.add(path)
+                path = os.path.dirname(path)
+
+        untracked = []
+        for path in tracked:
+            try:
+                names = os.listdir(os.path.join(self.path,path))
+            except OSError:
+                continue
+            for name in names:
+                child = os.path.join(path,name)
+                if name != '.git' and not child in tracked and os.path.isdir(os.path.join(self.path,child)):
+                    untracked.append(child)
+
+        # Everything under an untracked directory, except in submodules
+        # (see below) and other nested repos, which git doesn't look into
+        gitlinks = self.gitlinks()
+        dirs = set(tracked)
+        for top in untracked:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(self.path,top)):
+                dirs.add(os.path.relpath(dirpath,self.path))
+                if len(dirs) - len(tracked) > Git.MAX_UNTRACKED_DIRS:
+                    return None
+                if top in gitlinks or '.git' in dirnames or '.git' in filenames:
+                    del dirnames[:]
+
+        paths = self.repo_state_paths()
+        for path in sorted(dirs):
+            paths.append(os.path.normpath(os.path.join(self.path,path)))
+            paths.append(os.path.join(self.path,path,'.gitignore'))
+        for path in sorted(gitlinks):
+            if os.path.exists(os.path.join(self.path,path,'.git')):
+                submodule_paths = self.submodule_git(path).work_tree_state_paths()
+                if submodule_paths is None:
+                    return None
+                paths += submodule_paths
+        return paths
+
+
+    def submodule_git(self,path):
+        """ The Git for the submodule at path, shared with its Submodule object
+            when there is one, so that what's known about it is shared too """
+        git = self.submodule_gits.get(path)
+        if not git:
+            git = self.submodule_gits[path] = Git(os.path.join(self.path,path))
+        return git
         
         
     def is_detached(self):
+        # Reading HEAD directly is cheaper than asking for the status,
+        # but if the status is already known, use that
+        if self.cached_status:
+            return self.cached_status.is_detached()
         head = self.get_head()
         if not head.is_ref():
             return True
 
     def current_branch(self):
+        if self.cached_status:
+            return self.cached_status.branch
         head = self.get_head()
         if head.branch:
             return self.simple_branch(head.name)
@@ -212,23 +726,17 @@ class Git(object):
 
 
     def get_head(self):
-        head_path = os.path.join(self.git_dir,'HEAD')
-        if not os.path.exists(head_path):
-            raise GitStructureError("missing %s" % (head_path))
-
-        fp = open(head_path,'r')
-        line = fp.readline()
-        return Git.ID(self,line)
+        head = self.ref_store.read_ref('HEAD')
+        if head is None:
+            raise GitStructureError("missing %s" % (os.path.join(self.git_dir,'HEAD')))
+        return Git.ID(self,head)
 
 
     def get_head_of_branch(self,branch):
-        branch_head_path = os.path.join(self.git_dir,self.canonical_branch(branch))
-        if not os.path.exists(branch_head_path):
+        sha1 = self.ref_store.resolve(self.canonical_branch(branch))
+        if not sha1:
             raise GitBranchNotFound(branch)
-        
-        fp = open(branch_head_path,'r')
-        line = fp.readline()
-        return Git.ID(self,line)
+        return Git.ID(self,sha1)
 
 
     def canonical_branch(self,branch):
@@ -244,16 +752,11 @@ class Git(object):
 
     def remote_branch(self,branch,remote='origin'):
         if re.match('refs/remotes/[^/]+/',branch): return branch
-        return 'refs/heads/%s/%s' % (remote,branch)
+        return 'refs/remotes/%s/%s' % (remote,branch)
 
 
     def branch_exists(self,branch):
-        canonical = self.canonical_branch(branch)
-        branch_head_path = os.path.join(self.git_dir,canonical)
-        if os.path.exists(branch_head_path):
-            return True # Fast check
-        refs = self.read_refs()
-        if canonical in refs:
+        if self.ref_store.resolve(self.canonical_branch(branch)):
             return True
         
         
@@ -265,42 +768,182 @@ class Git(object):
     def find_remote_branch(self,branch,remote=None):
         if remote:
             remote_path = self.remote_branch(branch,remote)
-            branch_head_path = os.path.join(self.git_dir,remote_path)
-            if os.path.exists(branch_head_path):
-                return self.ID(remote_path)
-            refs = self.read_refs()
-            if remote_path in refs.keys():
-                return self.ID(remote_path)
+            if self.ref_store.resolve(remote_path):
+                return Git.ID(self,remote_path)
         else:
-            ref_re = re.compile(r'refs/remotes/([^/]+)/%s' % (branch))
-            refs = self.read_refs()
-            for ref in refs.keys():
+            ref_re = re.compile(r'refs/remotes/([^/]+)/%s$' % (re.escape(branch)))
+            for ref in sorted(self.read_refs().keys()):
                 if ref_re.match(ref):
-                    return self.ID(self,ref)
+                    return Git.ID(self,ref)
             
 
     def read_refs(self):
-        if self.refs:
-            return self.refs
+        """ Returns a dict of all refs (name -> SHA-1) in the repo """
+        return self.ref_store.refs()
+        
 
-        self.refs = {}
-        stdout = self.do_command(['git','show-ref'],capture=True)
-        for line in stdout.split("\n"):
-            try:
-                sha1, ref = line.strip().split(' ')
-                self.refs[ref] = sha1
-            except ValueError: pass
+    def rev_parse(self,rev):
+        """ Returns the SHA-1 of the object named by rev, or None if it
+            doesn't exist. Uses the repo's cat-file --batch-check process """
+        if not self.cat_file_check:
+            self.cat_file_check = CatFile(self,check=True)
+        info = self.cat_file_check.lookup(rev)
+        if info:
+            return info[0]
+
+
+    def cat_file(self,rev):
+        """ Returns (sha1,type,content) for the object named by rev, or None
+            if it doesn't exist. Uses the repo's cat-file --batch process """
+        if not self.cat_file_batch:
+            self.cat_file_batch = CatFile(self)
+        return self.cat_file_batch.lookup(rev)
+
+
+    def read_object(self,sha1):
+        """ Returns (type,content) for an object read straight from the object
+            database, or None if it has to be read by git instead """
+        if not self.object_store:
+            self.object_store = ObjectStore(os.path.join(self.common_dir,'objects'))
+        return self.object_store.read(sha1)
+
+
+    def read_commit(self,rev):
+        """ Returns a Git.Commit for the commit named by rev, or None """
+        if len(rev) == 40 and Git.ID.sha1_re.match(rev):
+            obj = self.read_object(rev)
+            if obj and obj[0] == 'commit':
+                return Git.Commit(rev,obj[1])
+        obj = self.cat_file(rev)
+        if obj and obj[1] == 'commit':
+            return Git.Commit(obj[0],obj[2])
+
+
+    def commits_between(self,exclude,include):
+        """ Returns the commits reachable from include but not from exclude,
+            newest first -- the same commits as 'git log exclude..include'.
+            With no exclude, returns just the include commit.
+
+            Commits are walked newest first from both ends, and the walk stops
+            once everything left to visit is reachable from exclude """
+        interesting = self.read_commit(include)
+        if not interesting:
+            raise GitOutputError("Unknown commit: %s" % (include))
+        if not exclude:
+            return [interesting]
+
+        excluded = self.read_commit(exclude)
+        if not excluded:
+            raise GitOutputError("Unknown commit: %s" % (exclude))
+
+        # Queued by date, then in the order they were found
+        order = itertools.count()
+        commits = { interesting.sha1: interesting, excluded.sha1: excluded }
+        uninteresting = set([excluded.sha1])
+        queue = [(-interesting.time,order.next(),interesting.sha1),
+                 (-excluded.time,order.next(),excluded.sha1)]
+        heapq.heapify(queue)
+        walked = []
+
+        # Allow for a few commits with skewed dates before stopping, like git does
+        slop = 5
+        while queue:
+            if all(sha1 in uninteresting for t, n, sha1 in queue):
+                slop -= 1
+                if slop <= 0: break
+
+            t, n, sha1 = heapq.heappop(queue)
+            commit = commits[sha1]
+            walked.append(commit)
+            if sha1 in uninteresting:
+                self.mark_uninteresting(list(commit.parents),commits,uninteresting)
+
+            for parent_sha1 in commit.parents:
+                if parent_sha1 in commits: continue
+                parent = self.read_commit(parent_sha1)
+                commits[parent_sha1] = parent
+                heapq.heappush(queue,(-parent.time,order.next(),parent_sha1))
+
+        return [c for c in walked if not c.sha1 in uninteresting]
+
+
+    def mark_uninteresting(self,sha1s,commits,uninteresting):
+        """ Mark commits (and, for those already read, their ancestors) as
+            reachable from the excluded side of a range """
+        while sha1s:
+            sha1 = sha1s.pop()
+            if sha1 in uninteresting: continue
+            uninteresting.add(sha1)
+            if sha1 in commits:
+                sha1s.extend(commits[sha1].parents)
+
+
+    def close(self):
+        """ Stop any long-running helper processes for this repo """
+        for cat_file in [self.cat_file_batch,self.cat_file_check]:
+            if cat_file: cat_file.close()
+        self.cat_file_batch = self.cat_file_check = None
+        if self.cached_index:
+            self.cached_index[1].close()
+            self.cached_index = None
+        if self.object_store:
+            self.object_store.close()
+        for git in self.submodule_gits.values():
+            git.close()
+
+
+    def config_paths(self):
+        """ The config files git reads for the repo, lowest priority first """
+        paths = []
+        if not os.environ.get('GIT_CONFIG_NOSYSTEM'):
+            paths.append(os.environ.get('GIT_CONFIG_SYSTEM','/etc/gitconfig'))
+        if 'GIT_CONFIG_GLOBAL' in os.environ:
+            paths.append(os.environ['GIT_CONFIG_GLOBAL'])
+        else:
+            xdg_home = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+            paths.append(os.path.join(xdg_home,'git','config'))
+            paths.append(os.path.expanduser('~/.gitconfig'))
+        if self.common_dir:
+            paths.append(os.path.join(self.common_dir,'config'))
+        return paths
 
-        return self.refs
-        
 
-    def get_config(self,key,default=None):
-        if not self.config:
-            self.config = GitConfig()
-            self.config.parse(os.path.join(self.git_dir,'config'))
+    def get_config_all(self,key):
+        """ All the values for key in the repo's config (and the global and
+            system config), as 'git config --get-all' would give them """
+        values = []
+        for path in self.config_paths():
+            values.extend(GitConfig.load(path,git_dir=self.git_dir).get_all(key))
+        return values
 
-        if key in self.config: return self.config[key] or default
-        return default
+
+    def remotes(self):
+        """ The names of the remotes configured for the repo """
+        names = set()
+        for path in self.config_paths():
+            names.update(GitConfig.load(path,git_dir=self.git_dir).subsections('remote'))
+        return sorted(names)
+
+
+    def get_config(self,key,default=None):
+        """ The value for key ('section.name' or 'section.subsection.name'),
+            as 'git config' would give it, but without running git """
+        values = self.get_config_all(key)
+        if not values:
+            return default
+        return values[-1]
+
+
+    def get_config_bool(self,key,default=None):
+        """ The value for key as a boolean, the way git reads one. Values that
+            aren't booleans (e.g. rebase = merges) count as true """
+        values = self.get_config_all(key)
+        if not values:
+            return default
+        value = values[-1]
+        if value is None:
+            return True
+        return not value.lower() in ['false','no','off','0','']
 
 
     class ID(object):
@@ -384,52 +1027,710 @@ class Git(object):
             else: return self.name[0:8]
         
 
-class GitConfig(dict):
-    """ Class to parse git config files """
-    # TODO: would it be more reliable to use "git config -l -f <path>" to get simplified parsing?
+    class Commit(object):
+        """ A commit object, as read by cat-file """
+
+        def __init__(self,sha1,raw):
+            self.sha1 = sha1
+            self.tree = None
+            self.parents = []
+            self.time = 0
+
+            headers, self.message = (raw.split('\n\n',1) + [''])[0:2]
+            for line in headers.split('\n'):
+                name, value = (line.split(' ',1) + [''])[0:2]
+                if name == 'tree':
+                    self.tree = value
+                elif name == 'parent':
+                    self.parents.append(value)
+                elif name == 'committer':
+                    self.time = int(value.rsplit(' ',2)[1])
 
-    def parse(self,path):
-        fh = open(path,'r')
-        section = []
+        def __repr__(self):
+            return '<Commit: %s>' % (self.sha1)
+
+        def subject(self):
+            """ The first paragraph of the message on one line, as in --pretty=oneline """
+            paragraph = self.message.lstrip('\n').split('\n\n',1)[0]
+            return ' '.join(line.strip() for line in paragraph.strip().split('\n'))
+
+        def oneline(self):
+            return '%s %s' % (self.sha1,self.subject())
+
+
+
+class RefStore(object):
+    """ Reads refs directly from a repo's loose ref files and packed-refs,
+        without running git. Results are cached, and reused for as long as
+        the mtimes of the files they came from don't change.
+
+        There is one RefStore per repo, shared by all the Git instances for it """
+
+    stores = {}
+    stores_lock = threading.Lock()
+
+    # Files modified this recently (in seconds) may still be changing within
+    # the resolution of their mtime, so a cache based on them isn't trusted
+    RACY_SECONDS = 2
+
+    @classmethod
+    def for_repo(cls,git_dir,common_dir):
+        with cls.stores_lock:
+            key = (git_dir,common_dir)
+            if not key in cls.stores:
+                cls.stores[key] = RefStore(git_dir,common_dir)
+            return cls.stores[key]
+
+
+    def __init__(self,git_dir,common_dir):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.packed = {}
+        self.peeled = {}
+        self.packed_key = None
+        self.loose = {}
+        self.loose_key = None
+        self.objects = None
+
+
+    def ref_dir(self,name):
+        """ HEAD and other pseudo-refs are per worktree, everything under refs/ is shared """
+        if name.startswith('refs/'):
+            return self.common_dir
+        return self.git_dir
+
+
+    def read_ref(self,name):
+        """ The raw value of a ref -- a SHA-1 or 'ref: <target>' -- or None """
+        try:
+            fh = open(os.path.join(self.ref_dir(name),name),'r')
+            try: return fh.readline().strip()
+            finally: fh.close()
+        except IOError:
+            pass
+        return self.packed_refs().get(name)
+
+
+    def resolve(self,name,depth=5):
+        """ Follow symbolic refs to the SHA-1 that name points to, or None """
+        value = self.read_ref(name)
+        while value and value.startswith('ref:') and depth > 0:
+            value = self.read_ref(value[4:].strip())
+            depth -= 1
+        if value and not value.startswith('ref:'):
+            return value
+
+
+    def peel(self,name):
+        """ For an annotated tag, the SHA-1 of the object it points to (past
+            any tags of tags), otherwise the same as resolve(). None if a tag
+            object can't be read without git """
+        self.packed_refs()
+        if name in self.peeled:
+            return self.peeled[name]
+        sha1 = self.resolve(name)
+
+        # Loose tags (and packed ones git didn't peel) are read from the
+        # object database
+        for depth in range(5):
+            if sha1 is None:
+                break
+            if not self.objects:
+                self.objects = ObjectStore(os.path.join(self.common_dir,'objects'))
+            obj = self.objects.read(sha1)
+            if obj is None:
+                return None
+            if obj[0] != 'tag':
+                break
+            sha1 = obj[1].split('\n',1)[0].split(' ')[1]
+        return sha1
+
+
+    def refs(self):
+        """ All refs under refs/ as a dict of name -> SHA-1, like 'git show-ref' """
+        refs = dict(self.packed_refs())
+        refs.update(self.loose_refs())
+        return refs
+
+
+    def packed_refs(self):
+        path = os.path.join(self.common_dir,'packed-refs')
+        key = self.file_key(path)
+        if key != self.packed_key or not self.settled(key):
+            self.packed, self.peeled = self.read_packed_refs(path)
+            self.packed_key = key
+        return self.packed
+
+
+    def read_packed_refs(self,path):
+        packed = {}
+        peeled = {}
+        try:
+            fh = open(path,'r')
+        except IOError:
+            return (packed,peeled)
+
+        last = None
+        for line in fh:
+            if line.startswith('#'):
+                continue
+            if line.startswith('^'):
+                # Peeled value of the tag on the line before
+                if last: peeled[last] = line[1:].strip()
+                continue
+            parts = line.split()
+            if len(parts) == 2:
+                last = parts[1]
+                packed[last] = parts[0]
+        fh.close()
+        return (packed,peeled)
+
+
+    def loose_refs(self):
+        """ All loose refs, re-read whenever any of the directories
+            under refs/ has changed """
+        if self.loose_key is None or not self.loose_unchanged():
+            self.loose, self.loose_key = self.read_loose_refs()
+        return self.loose
+
+
+    def loose_unchanged(self):
+        for path, key in self.loose_key.items():
+            current = self.file_key(path)
+            if current != key or not self.settled(current):
+                return False
+        return True
+
+
+    def read_loose_refs(self):
+        loose = {}
+        dir_keys = {}
+        refs_dir = os.path.join(self.common_dir,'refs')
+        for dirpath, dirnames, filenames in os.walk(refs_dir):
+            dir_keys[dirpath] = self.file_key(dirpath)
+            for filename in filenames:
+                if filename.endswith('.lock'): continue
+                path = os.path.join(dirpath,filename)
+                name = os.path.relpath(path,self.common_dir).replace(os.sep,'/')
+                value = self.read_ref(name)
+                if value and value.startswith('ref:'):
+                    value = self.resolve(name)
+                if value:
+                    loose[name] = value
+        return (loose,dir_keys)
+
+
+    @staticmethod
+    def file_key(path):
+        """ Identifies the current version of a file, or None if it doesn't exist """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime,st.st_size,st.st_ino)
+
+
+    @staticmethod
+    def settled(key):
+        """ Whether the file is old enough that its key can be trusted """
+        return key is None or key[0] < time.time() - RefStore.RACY_SECONDS
+
+
+
+class RepoStatus(object):
+    """ The state of a repo's branch, index and working tree, parsed from
+        'git status --porcelain=v2 --branch -z'. Untracked files are only
+        listed if the status was asked for with them """
+
+    def __init__(self,output):
+        self.oid = None
+        self.branch = None
+        self.upstream = None
+        self.ahead = 0
+        self.behind = 0
+        self.staged = []
+        self.unstaged = []
+        self.unmerged = []
+        self.untracked = []
+        self.submodules = {}
+        self.parse(output)
+
+
+    def __repr__(self):
+        return '<RepoStatus: %s staged=%d unstaged=%d untracked=%d>' % \
+               (self.branch or '(detached)',len(self.staged),len(self.unstaged),len(self.untracked))
+
+
+    def parse(self,output):
+        fields = iter(output.split('\0'))
+        for field in fields:
+            if not field: continue
+            kind = field[0]
+
+            if kind == '#':
+                self.parse_header(field)
+            elif kind == '?':
+                self.untracked.append(field[2:])
+            elif kind in '12u':
+                # Ordinary, renamed/copied and unmerged entries: the path is the last
+                # field (renames are followed by an extra field with the original path)
+                parts = field.split(' ',{'1':8,'2':9,'u':10}[kind])
+                xy, sub, path = parts[1], parts[2], parts[-1]
+                if kind == '2': next(fields,None)
+                self.add_entry(kind,xy,sub,path)
+
+
+    def parse_header(self,field):
+        parts = field.split(' ',2)
+        if len(parts) < 3: return
+        name, value = parts[1], parts[2]
+        if name == 'branch.oid':
+            if value != '(initial)': self.oid = value
+        elif name == 'branch.head':
+            if value != '(detached)': self.branch = value
+        elif name == 'branch.upstream':
+            self.upstream = value
+        elif name == 'branch.ab':
+            ahead, behind = value.split()
+            self.ahead = int(ahead)
+            self.behind = -int(behind)
+
+
+    def add_entry(self,kind,xy,sub,path):
+        if sub.startswith('S'):
+            # Submodule flags: new commits, modified content, untracked content
+            self.submodules[path] = { 'commit': sub[1] == 'C',
+                                      'modified': sub[2] == 'M',
+                                      'untracked': sub[3] == 'U' }
+        if kind == 'u':
+            self.unmerged.append(path)
+            return
+        if xy[0] != '.':
+            self.staged.append(path)
+        if xy[1] != '.':
+            # Only untracked files within a submodule don't count as a change
+            if not (sub.startswith('S') and sub[1:3] == '..'):
+                self.unstaged.append(path)
 
-        re_section = re.compile(r'^\[(.+)\]')
-        re_value = re.compile(r'^(.+)\s*=\s*(.+)$')
 
-        for line in fh.readlines():
-            if '#' in line:
-                line, comment = line.split('#',1)
-            line = line.strip()
+    def is_detached(self):
+        return self.branch is None
 
-            m = re_section.match(line)
-            if m:
-                section = self.section_name(m.group(1))
-                continue
 
-            m = re_value.match(line)
-            if m:
-                name = m.group(1).strip()
-                value = m.group(2).strip()
-                self.add(section,name,value)
-                
+    def is_index_clean(self,**kwargs):
+        """ True if nothing is staged (compared to HEAD) """
+        staged = self.staged
+        if 'ignore_submodules' in kwargs and kwargs['ignore_submodules']:
+            staged = [path for path in staged if not path in self.submodules]
+        return not staged and not self.unmerged
+
+
+    def is_working_tree_clean(self,**kwargs):
+        """ True if there are no changes to tracked files, staged or not.
+            Untracked files don't count """
+        return not self.staged and not self.unstaged and not self.unmerged
+
+
+    def is_clean(self,**kwargs):
+        return self.is_index_clean(**kwargs) and self.is_working_tree_clean(**kwargs)
+
+
+
+class CatFile(object):
+    """ A long-running 'git cat-file --batch' (or --batch-check) process for
+        a repo, so that looking up objects doesn't need a new git process each time """
+
+    def __init__(self,git,check=False):
+        self.git = git
+        self.check = check
+        self.lock = threading.Lock()
+        self.process = None
+
+
+    def start(self):
+        mode = '--batch'
+        if self.check: mode = '--batch-check'
+        self.git.groot.debug("# In %s: git cat-file %s (coprocess)" % (self.git.path,mode))
+        self.process = self.git.spawn(['git','cat-file',mode],bufsize=-1,close_fds=True,
+                                      stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+
 
+    def lookup(self,rev):
+        """ Returns (sha1,type,content) -- or (sha1,type,size) for --batch-check --
+            or None if there is no such object """
+        with self.lock:
+            if not self.process:
+                self.start()
 
-    def section_name(self,s):
-        m = re.match(r'(.+) \"(.+)\"',s)
-        if m:
-            return [m.group(1),re.sub(' ','_',m.group(2))]
+            self.process.stdin.write(rev + '\n')
+            self.process.stdin.flush()
+
+            header = self.process.stdout.readline()
+            if not header:
+                raise GitOutputError("git cat-file exited unexpectedly in %s" % (self.git.path))
+
+            fields = header.split()
+            if len(fields) != 3:
+                return None # '<rev> missing' or '<rev> ambiguous'
+
+            sha1, type, size = fields[0], fields[1], int(fields[2])
+            if self.check:
+                return (sha1,type,size)
+
+            content = self.process.stdout.read(size)
+            self.process.stdout.read(1) # Trailing newline
+            return (sha1,type,content)
+
+
+    def close(self):
+        with self.lock:
+            if self.process:
+                self.process.stdin.close()
+                self.process.wait()
+                self.process = None
+
+
+
+class GitConfig(object):
+    """ A parsed git config file, read the way git reads it: quoting and
+        escapes in values, case-insensitive section and key names, keys
+        with more than one value, and include.path / includeIf.
+
+        Keys are given as 'section.name' or 'section.subsection.name'.
+        load() keeps each file's parse, for as long as none of the files it
+        was read from have changed """
+
+    # Same as git's limit, to catch include loops
+    MAX_INCLUDE_DEPTH = 10
+
+    ESCAPES = { 'n': '\n', 't': '\t', 'b': '\b', '"': '"', '\\': '\\' }
+
+    cache = {}
+    cache_lock = threading.Lock()
+
+    @classmethod
+    def load(cls,path,git_dir=None,includes=True):
+        """ The GitConfig for the file at path (empty if it doesn't exist).
+            git_dir is the repo it's for, used by includeIf conditions """
+        cache_key = (path,git_dir,includes)
+        with cls.cache_lock:
+            cached = cls.cache.get(cache_key)
+        if cached:
+            fingerprint, config = cached
+            if all(RefStore.file_key(each) == key for each, key in fingerprint):
+                return config
+
+        config = cls(git_dir,includes)
+        config.parse(path)
+        fingerprint = tuple((each,RefStore.file_key(each)) for each in config.paths)
+        if all(RefStore.settled(key) for each, key in fingerprint):
+            with cls.cache_lock:
+                cls.cache[cache_key] = (fingerprint,config)
+        return config
+
+
+    def __init__(self,git_dir=None,includes=True):
+        self.git_dir = git_dir
+        self.includes = includes
+        self.entries = []
+        self.values = {}
+        self.paths = []
+
+
+    def __repr__(self):
+        return '<GitConfig: %s>' % (self.paths and self.paths[0])
+
+
+    def get(self,key,default=None):
+        """ The last value set for key. A key given without any value (which
+            git takes as true) has the value None """
+        values = self.values.get(self.normalize_key(key))
+        if not values:
+            return default
+        return values[-1]
+
+
+    def get_all(self,key):
+        """ All the values set for key, in order """
+        return list(self.values.get(self.normalize_key(key),[]))
+
+
+    def subsections(self,section):
+        """ Dict of subsection -> { name: value } for the given section, e.g.
+            the submodules in .gitmodules. The last value set for a name wins """
+        section = section.lower()
+        found = {}
+        for entry_section, subsection, name, value in self.entries:
+            if entry_section == section and subsection is not None:
+                found.setdefault(subsection,{})[name] = value
+        return found
+
+
+    def normalize_key(self,key):
+        """ Section and name are case-insensitive, the subsection isn't """
+        if not '.' in key:
+            return key.lower()
+        section, rest = key.split('.',1)
+        if '.' in rest:
+            subsection, name = rest.rsplit('.',1)
+            return '%s.%s.%s' % (section.lower(),subsection,name.lower())
+        return '%s.%s' % (section.lower(),rest.lower())
+
+
+    def add(self,section,subsection,name,value):
+        self.entries.append((section,subsection,name,value))
+        if subsection is None:
+            key = '%s.%s' % (section,name)
         else:
-            return [re.sub(' ','_',s)]
+            key = '%s.%s.%s' % (section,subsection,name)
+        self.values.setdefault(key,[]).append(value)
 
 
-    def add(self,section,name,value):
-        #print "%s '%s' = '%s'" % (section,name,value)
-        d = self
-        for s in section:
-            if not s in d: d[s] = {}
-            d = d[s]
+    def parse(self,path,depth=0):
+        self.paths.append(path)
+        try:
+            fh = open(path,'r')
+        except IOError:
+            return
+        try:
+            data = fh.read()
+        finally:
+            fh.close()
+        GitConfig.Parser(self,path,data,depth).parse()
+
+
+    def include(self,path,including_path,depth):
+        if depth >= GitConfig.MAX_INCLUDE_DEPTH:
+            raise GitStructureError("config includes nested too deeply in %s" % (including_path))
+        path = os.path.expanduser(path)
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(including_path),path)
+        self.parse(path,depth + 1)
+
+
+    def include_condition(self,condition,including_path):
+        """ Whether an includeIf condition holds for this repo. Conditions
+            groot doesn't know how to check are taken as false """
+        if not self.git_dir or not ':' in condition:
+            return False
+        kind, pattern = condition.split(':',1)
+
+        if kind in ['gitdir','gitdir/i']:
+            if pattern.startswith('./'):
+                pattern = os.path.join(os.path.dirname(including_path),pattern[2:])
+            pattern = os.path.expanduser(pattern)
+            if not pattern.startswith('/'):
+                pattern = '**/' + pattern
+            if pattern.endswith('/'):
+                pattern += '**'
+            flags = re.I if kind == 'gitdir/i' else 0
+            regex = re.compile(self.glob_regex(pattern) + '$',flags)
+            git_dir = os.path.abspath(self.git_dir)
+            return bool(regex.match(git_dir) or regex.match(os.path.realpath(git_dir)))
+
+        if kind == 'onbranch':
+            head_path = os.path.join(self.git_dir,'HEAD')
+            self.paths.append(head_path)
+            try:
+                head = open(head_path).read().strip()
+            except IOError:
+                return False
+            if not head.startswith('ref: refs/heads/'):
+                return False
+            if pattern.endswith('/'):
+                pattern += '**'
+            return bool(re.match(self.glob_regex(pattern) + '$',head[len('ref: refs/heads/'):]))
+
+        return False
+
+
+    def glob_regex(self,pattern):
+        """ Regex for a wildmatch pattern, where only '**' matches across '/' """
+        regex = []
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith('**/',i):
+                regex.append('(?:.*/)?')
+                i += 3
+            elif pattern.startswith('**',i):
+                regex.append('.*')
+                i += 2
+            elif pattern[i] == '*':
+                regex.append('[^/]*')
+                i += 1
+            elif pattern[i] == '?':
+                regex.append('[^/]')
+                i += 1
+            else:
+                regex.append(re.escape(pattern[i]))
+                i += 1
+        return ''.join(regex)
 
-        d[name.strip()] = value.strip()
 
+    class Parser(object):
+        """ Reads one config file into a GitConfig, following git's config.c:
+            a value runs to the end of the line (or a comment outside quotes),
+            whitespace around it is dropped and any inside it is kept, and a
+            backslash at the end of a line continues it """
 
-            
-        
+        def __init__(self,config,path,data,depth):
+            self.config = config
+            self.path = path
+            self.data = data
+            self.depth = depth
+            self.pos = 0
+            self.line = 1
+
+
+        def error(self,msg):
+            raise GitStructureError("bad config line %d in %s: %s" % (self.line,self.path,msg))
+
+
+        def getc(self):
+            """ The next character, or '' at the end """
+            if self.pos >= len(self.data):
+                return ''
+            c = self.data[self.pos]
+            self.pos += 1
+            if c == '\n':
+                self.line += 1
+            return c
+
+
+        def peek(self):
+            return self.data[self.pos:self.pos + 1]
+
+
+        def skip_line(self):
+            while True:
+                c = self.getc()
+                if c == '\n' or c == '':
+                    return
+
+
+        def parse(self):
+            section = subsection = None
+            while True:
+                c = self.getc()
+                if c == '':
+                    return
+                if c.isspace():
+                    continue
+                if c in '#;':
+                    self.skip_line()
+                elif c == '[':
+                    section, subsection = self.parse_section()
+                elif c.isalpha():
+                    if section is None:
+                        self.error("key outside any section")
+                    name, value = self.parse_entry(c)
+                    self.config.add(section,subsection,name,value)
+                    self.check_include(section,subsection,name,value)
+                else:
+                    self.error("unexpected %r" % (c))
+
+
+        def parse_section(self):
+            name = []
+            while True:
+                c = self.getc()
+                if c == ']':
+                    break
+                if c.isspace():
+                    return (''.join(name).lower(),self.parse_subsection())
+                if not (c.isalnum() or c in '-.'):
+                    self.error("bad section name")
+                name.append(c)
+
+            # The old [section.subsection] form, where the subsection
+            # is case-insensitive too
+            name = ''.join(name).lower()
+            if '.' in name:
+                return tuple(name.split('.',1))
+            return (name,None)
+
+
+        def parse_subsection(self):
+            while self.peek().isspace() and self.peek() != '\n':
+                self.getc()
+            if self.getc() != '"':
+                self.error("bad section header")
+            subsection = []
+            while True:
+                c = self.getc()
+                if c == '' or c == '\n':
+                    self.error("unterminated subsection name")
+                if c == '"':
+                    break
+                if c == '\\':
+                    c = self.getc()
+                    if c == '' or c == '\n':
+                        self.error("unterminated subsection name")
+                subsection.append(c)
+            if self.getc() != ']':
+                self.error("bad section header")
+            return ''.join(subsection)
+
+
+        def parse_entry(self,first):
+            name = [first]
+            while self.peek().isalnum() or self.peek() == '-':
+                name.append(self.getc())
+            name = ''.join(name).lower()
+
+            while self.peek() in [' ','\t','\r']:
+                self.getc()
+            c = self.peek()
+            if c == '=':
+                self.getc()
+                return (name,self.parse_value())
+            if c in ['','\n']:
+                self.getc()
+                return (name,None)
+            if c in '#;':
+                self.skip_line()
+                return (name,None)
+            self.error("bad key %s" % (name))
+
+
+        def parse_value(self):
+            value = []
+            spaces = 0
+            quoted = False
+            while True:
+                c = self.getc()
+                if c == '' or c == '\n':
+                    if quoted:
+                        self.error("unterminated quote")
+                    break
+                if not quoted:
+                    if c in '#;':
+                        self.skip_line()
+                        break
+                    if c.isspace():
+                        if value: spaces += 1
+                        continue
+                value.extend(' ' * spaces)
+                spaces = 0
+                if c == '\\':
+                    c = self.getc()
+                    if c == '\n':
+                        continue
+                    if not c in GitConfig.ESCAPES:
+                        self.error("bad escape")
+                    value.append(GitConfig.ESCAPES[c])
+                elif c == '"':
+                    quoted = not quoted
+                else:
+                    value.append(c)
+            return ''.join(value)
+
+
+        def check_include(self,section,subsection,name,value):
+            if not self.config.includes or name != 'path' or value is None:
+                return
+            if section == 'include' and subsection is None:
+                self.config.include(value,self.path,self.depth)
+            elif section == 'includeif' and subsection is not None and \
+                     self.config.include_condition(subsection,self.path):
+                self.config.include(value,self.path,self.depth)
@@ -0,0 +1,348 @@
+# Read-only access to a git index (.git/index) file, without running git
+#
+
+import array
+import mmap
+import os
+import stat
+import struct
+import threading
+
+from groot.err import *
+
+
+class Index(object):
+    """ A git index file (versions 2 to 4), memory-mapped rather than read in.
+
+        Parsing only walks the entries once to record where each one starts
+        and where its path is (in arrays); the path, stat data, mode and SHA-1
+        of an entry are read from the mapped file only when asked for """
+
+    SIGNATURE = 'DIRC'
+    GITLINK_MODE = 0160000
+    SYMLINK_MODE = 0120000
+
+    # Entry flags, and the extra flags that follow them in version 3 and up
+    ASSUME_VALID = 0x8000
+    EXTENDED = 0x4000
+    SKIP_WORKTREE = 0x4000
+    INTENT_TO_ADD = 0x2000
+
+    header = struct.Struct('>4sII')
+    mode_and_flags = struct.Struct('>I32xH')
+    entry_data = struct.Struct('>10I20sH')
+
+    # In version 4, every this many paths is kept whole (see path_at)
+    CHECKPOINT = 64
+
+    def __init__(self,path):
+        self.path = path
+        self.version = None
+        self.data = None
+        self.offsets = array.array('I')
+        self.name_starts = array.array('I')
+        self.name_lengths = array.array('I')
+        self.prefix_lengths = None
+        self.checkpoints = []
+        self.checkpoints_lock = threading.Lock()
+        self.gitlink_positions = array.array('I')
+        self.extensions = {}
+        self.open()
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self,path):
+        return self.find(path) is not None
+
+    def __repr__(self):
+        return '<Index: %s v%s, %d entries>' % (self.path,self.version,len(self))
+
+
+    def open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            # No index yet (e.g. a fresh repo) is the same as an empty one
+            return
+
+        fh = open(self.path,'rb')
+        try:
+            self.data = mmap.mmap(fh.fileno(),0,access=mmap.ACCESS_READ)
+        finally:
+            fh.close()
+
+        signature, self.version, count = Index.header.unpack_from(self.data,0)
+        if signature != Index.SIGNATURE:
+            raise GitStructureError("not a git index file: %s" % (self.path))
+        if not self.version in [2,3,4]:
+            raise GitStructureError("unsupported index version %d: %s" % (self.version,self.path))
+
+        if self.version == 4:
+            end = self.parse_entries_v4(count)
+        else:
+            end = self.parse_entries(count)
+        self.parse_extensions(end)
+
+
+    def close(self):
+        if self.data:
+            self.data.close()
+            self.data = None
+
+
+    def parse_entries(self,count):
+        """ Versions 2 and 3: each path is stored in full, NUL-padded to a
+            multiple of 8 bytes. The length is in the flags, unless it's too long """
+        data = self.data
+        unpack = Index.mode_and_flags.unpack_from
+        offsets = self.offsets.append
+        starts = self.name_starts.append
+        lengths = self.name_lengths.append
+        gitlinks = self.gitlink_positions.append
+        extended = self.version >= 3
+
+        offset = 12
+        for i in xrange(count):
+            mode, flags = unpack(data,offset + 24)
+            start = offset + 62
+            if extended and flags & 0x4000: start += 2
+            length = flags & 0xfff
+            if length == 0xfff:
+                length = data.find('\0',start) - start
+
+            offsets(offset)
+            starts(start)
+            lengths(length)
+            if mode == Index.GITLINK_MODE: gitlinks(i)
+
+            # Padded to a multiple of 8 bytes from the start of the entry
+            offset += (start - offset + length + 8) & ~7
+
+        return offset
+
+
+    def parse_entries_v4(self,count):
+        """ Version 4: each path is stored as the number of bytes to drop from
+            the end of the previous path, then the bytes to append to it. The
+            arrays record where those bytes are, how much of the previous path
+            is kept, and how long the whole path is """
+        data = self.data
+        find = data.find
+        offsets = self.offsets.append
+        starts = self.name_starts.append
+        lengths = self.name_lengths.append
+        self.prefix_lengths = array.array('I')
+        kept_lengths = self.prefix_lengths.append
+        gitlinks = self.gitlink_positions.append
+
+        # Single bytes are read straight from the file, which is quicker
+        # than unpacking them: the type bits of the mode, and the flag for
+        # the extended flags
+        length = 0
+        offset = 12
+        for i in xrange(count):
+            if ord(data[offset + 26]) >> 4 == 0xe: gitlinks(i)
+            pos = offset + 62
+            if ord(data[offset + 60]) & 0x40: pos += 2
+
+            # Variable-length integer, as in git's varint.c
+            c = ord(data[pos])
+            pos += 1
+            strip = c & 0x7f
+            while c & 0x80:
+                c = ord(data[pos])
+                pos += 1
+                strip = ((strip + 1) << 7) | (c & 0x7f)
+
+            end = find('\0',pos)
+            kept = length - strip
+            length = kept + end - pos
+
+            offsets(offset)
+            starts(pos)
+            lengths(length)
+            kept_lengths(kept)
+
+            offset = end + 1
+
+        return offset
+
+
+    def parse_extensions(self,offset):
+        """ Note where each extension is. The last 20 bytes are the checksum """
+        end = len(self.data) - 20
+        while offset + 8 <= end:
+            signature = self.data[offset:offset + 4]
+            size = struct.unpack_from('>I',self.data,offset + 4)[0]
+            self.extensions[signature] = (offset + 8,size)
+            offset += 8 + size
+
+        if 'link' in self.extensions:
+            # Split index: most entries live in a separate shared index file
+            raise GitStructureError("split index not supported: %s" % (self.path))
+
+
+    def path_at(self,pos):
+        start = self.name_starts[pos]
+        if self.prefix_lengths is None:
+            return self.data[start:start + self.name_lengths[pos]]
+
+        # Every CHECKPOINT-th version 4 path is kept whole, found the first
+        # time one at or after it is asked for
+        if len(self.checkpoints) <= pos // Index.CHECKPOINT:
+            with self.checkpoints_lock:
+                while len(self.checkpoints) <= pos // Index.CHECKPOINT:
+                    self.checkpoints.append(self.join_path(len(self.checkpoints) * Index.CHECKPOINT))
+        return self.join_path(pos)
+
+
+    def join_path(self,pos):
+        """ Put a version 4 path together going back through the entries
+            before it, each giving the part of it that it added, until the
+            start of it or a path that was kept whole """
+        pieces = []
+        need = self.name_lengths[pos]
+        while need:
+            if pos % Index.CHECKPOINT == 0 and pos // Index.CHECKPOINT < len(self.checkpoints):
+                pieces.append(self.checkpoints[pos // Index.CHECKPOINT][:need])
+                break
+            kept = self.prefix_lengths[pos]
+            if need > kept:
+                start = self.name_starts[pos]
+                pieces.append(self.data[start:start + need - kept])
+                need = kept
+            pos -= 1
+        pieces.reverse()
+        return ''.join(pieces)
+
+
+    def paths(self):
+        """ All the paths in order, which for version 4 is quicker than
+            path_at() for each of them """
+        if self.prefix_lengths is None:
+            for pos in xrange(len(self.offsets)):
+                yield self.path_at(pos)
+            return
+
+        data = self.data
+        path = ''
+        for pos in xrange(len(self.offsets)):
+            start = self.name_starts[pos]
+            kept = self.prefix_lengths[pos]
+            path = path[:kept] + data[start:start + self.name_lengths[pos] - kept]
+            yield path
+
+
+    def find(self,path):
+        """ Position of the (first) entry for path, or None. Entries are sorted
+            by path, so this is a binary search """
+        lo, hi = 0, len(self.offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path_at(mid) < path: lo = mid + 1
+            else: hi = mid
+        if lo < len(self.offsets) and self.path_at(lo) == path:
+            return lo
+        return None
+
+
+    def entry(self,pos,path=None):
+        offset = self.offsets[pos]
+        if path is None: path = self.path_at(pos)
+        entry = Index.Entry(path,*Index.entry_data.unpack_from(self.data,offset))
+        if entry.flags & Index.EXTENDED and self.version >= 3:
+            entry.extended_flags = struct.unpack_from('>H',self.data,offset + 62)[0]
+        return entry
+
+
+    def stat(self,path):
+        """ The Index.Entry (stat data, mode, SHA-1) staged for path, or None """
+        pos = self.find(path)
+        if pos is not None:
+            return self.entry(pos)
+
+
+    def entries(self):
+        for pos, path in enumerate(self.paths()):
+            yield self.entry(pos,path)
+
+
+    def gitlink(self,path):
+        """ SHA-1 of the submodule commit staged at path, or None """
+        entry = self.stat(path)
+        if entry and entry.mode == Index.GITLINK_MODE:
+            return entry.sha1
+
+
+    def mtime(self):
+        """ Modification time of the index file, in whole seconds as git compares it """
+        return int(os.stat(self.path).st_mtime)
+
+
+    def cache_tree(self):
+        """ The tree SHA-1 that the whole index would be written as, from the
+            cached tree extension, or None if that isn't known (no extension,
+            or it was invalidated by a change to the index) """
+        if not 'TREE' in self.extensions: return None
+        offset, size = self.extensions['TREE']
+
+        # The root comes first: an empty path, its entry count (-1 if it's
+        # invalid) and subtree count, then its SHA-1
+        end = self.data.find('\n',offset,offset + size)
+        if end < 0: return None
+        path, counts = self.data[offset:end].split('\0',1)
+        if path or counts.split(' ')[0] == '-1': return None
+        return self.data[end + 1:end + 21].encode('hex')
+
+
+    def gitlinks(self):
+        """ Dict of path -> SHA-1 for all the submodule entries """
+        gitlinks = {}
+        for pos in self.gitlink_positions:
+            entry = self.entry(pos)
+            if not entry.path in gitlinks or entry.stage() == 0:
+                gitlinks[entry.path] = entry.sha1
+        return gitlinks
+
+
+    class Entry(object):
+        __slots__ = ['path','ctime','ctime_ns','mtime','mtime_ns','dev','ino',
+                     'mode','uid','gid','size','sha1','flags','extended_flags']
+
+        def __init__(self,path,ctime,ctime_ns,mtime,mtime_ns,dev,ino,mode,uid,gid,size,sha1,flags):
+            self.path = path
+            self.ctime = ctime
+            self.ctime_ns = ctime_ns
+            self.mtime = mtime
+            self.mtime_ns = mtime_ns
+            self.dev = dev
+            self.ino = ino
+            self.mode = mode
+            self.uid = uid
+            self.gid = gid
+            self.size = size
+            self.sha1 = sha1.encode('hex')
+            self.flags = flags
+            self.extended_flags = 0
+
+        def __repr__(self):
+            return '<Index.Entry: %s %o %s>' % (self.path,self.mode,self.sha1)
+
+        def stage(self):
+            return (self.flags >> 12) & 0x3
+
+        def matches(self,st):
+            """ Whether os.lstat() data still matches what was recorded when the
+                file was staged, comparing the same fields git does by default.
+                Times are compared to the second, and sizes and inode numbers
+                are truncated to 32 bits, as they are in the index """
+            if self.mode == Index.SYMLINK_MODE:
+                if not stat.S_ISLNK(st.st_mode): return False
+            elif not stat.S_ISREG(st.st_mode) or (st.st_mode & 0100) != (self.mode & 0100):
+                return False
+            return (int(st.st_mtime) == self.mtime and
+                    int(st.st_ctime) == self.ctime and
+                    st.st_size & 0xffffffff == self.size and
+                    st.st_ino & 0xffffffff == self.ino and
+                    st.st_uid == self.uid and
+                    st.st_gid == self.gid)
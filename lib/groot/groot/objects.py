@@ -0,0 +1,162 @@
+# Read-only access to a git object database, without running git
+#
+
+import glob
+import mmap
+import os
+import struct
+import zlib
+
+from groot.err import *
+
+
+class ObjectStore(object):
+    """ Reads objects straight from a repo's objects directory: loose objects,
+        and objects stored whole (not as deltas) in pack files.
+
+        This is meant for the odd small lookup (a commit, say) where starting
+        git would cost far more than the read. Anything it can't read comes
+        back as None, and the caller should ask git instead """
+
+    IDX_SIGNATURE = '\377tOc'
+    PACK_TYPES = { 1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag' }
+
+    def __init__(self,objects_dir):
+        self.objects_dir = objects_dir
+        self.pack_dir = os.path.join(objects_dir,'pack')
+        self.packs = []
+        self.packs_key = None
+
+
+    def read(self,sha1):
+        """ Returns (type,data) for the object, or None """
+        obj = self.read_loose(sha1)
+        if obj is None:
+            obj = self.read_packed(sha1)
+        return obj
+
+
+    def read_loose(self,sha1):
+        path = os.path.join(self.objects_dir,sha1[0:2],sha1[2:])
+        try:
+            fh = open(path,'rb')
+        except IOError:
+            return None
+        try:
+            raw = zlib.decompress(fh.read())
+        except zlib.error, ex:
+            raise GitStructureError("bad loose object %s: %s" % (sha1,ex))
+        finally:
+            fh.close()
+
+        header, data = raw.split('\0',1)
+        return (header.split(' ',1)[0],data)
+
+
+    def read_packed(self,sha1):
+        binary = sha1.decode('hex')
+        for pack in self.open_packs():
+            offset = pack.find(binary)
+            if offset is not None:
+                return pack.read(offset)
+
+
+    def open_packs(self):
+        """ The packs in the repo, re-listed whenever the pack dir changes """
+        try:
+            key = os.stat(self.pack_dir).st_mtime
+        except OSError:
+            return []
+
+        if key != self.packs_key:
+            for pack in self.packs: pack.close()
+            self.packs = [ObjectStore.Pack(path) for path in sorted(glob.glob(os.path.join(self.pack_dir,'*.idx')))]
+            self.packs_key = key
+        return self.packs
+
+
+    def close(self):
+        for pack in self.packs: pack.close()
+        self.packs = []
+        self.packs_key = None
+
+
+    class Pack(object):
+        """ A pack file and its (version 2) .idx file, both memory-mapped """
+
+        def __init__(self,idx_path):
+            self.idx = self.map(idx_path)
+            self.pack = self.map(idx_path[:-len('.idx')] + '.pack')
+            if self.idx[0:8] != ObjectStore.IDX_SIGNATURE + struct.pack('>I',2):
+                raise GitStructureError("unsupported pack index: %s" % (idx_path))
+            self.count = struct.unpack_from('>I',self.idx,8 + 255 * 4)[0]
+
+
+        def map(self,path):
+            fh = open(path,'rb')
+            try:
+                return mmap.mmap(fh.fileno(),0,access=mmap.ACCESS_READ)
+            finally:
+                fh.close()
+
+
+        def close(self):
+            self.idx.close()
+            self.pack.close()
+
+
+        def find(self,binary):
+            """ Offset of the object in the pack file, or None """
+            idx = self.idx
+            first = ord(binary[0])
+            lo = first and struct.unpack_from('>I',idx,8 + (first - 1) * 4)[0]
+            hi = struct.unpack_from('>I',idx,8 + first * 4)[0]
+
+            names = 8 + 256 * 4
+            while lo < hi:
+                mid = (lo + hi) // 2
+                name = idx[names + mid * 20:names + mid * 20 + 20]
+                if name < binary: lo = mid + 1
+                elif name > binary: hi = mid
+                else: return self.offset_at(mid)
+            return None
+
+
+        def offset_at(self,pos):
+            offsets = 8 + 256 * 4 + self.count * 24
+            offset = struct.unpack_from('>I',self.idx,offsets + pos * 4)[0]
+            if offset & 0x80000000:
+                large = offsets + self.count * 4 + (offset & 0x7fffffff) * 8
+                offset = struct.unpack_from('>Q',self.idx,large)[0]
+            return offset
+
+
+        def read(self,offset):
+            """ (type,data) for the object at offset, or None if it's a delta """
+            c = ord(self.pack[offset])
+            kind = (c >> 4) & 0x7
+            size = c & 0x0f
+            shift = 4
+            while c & 0x80:
+                offset += 1
+                c = ord(self.pack[offset])
+                size |= (c & 0x7f) << shift
+                shift += 7
+
+            if not kind in ObjectStore.PACK_TYPES:
+                return None
+
+            # The compressed size isn't recorded, so inflate until the stream ends
+            stream = zlib.decompressobj()
+            chunks = []
+            pos = offset + 1
+            try:
+                while not stream.unused_data and pos < len(self.pack):
+                    chunks.append(stream.decompress(self.pack[pos:pos + 65536]))
+                    pos += 65536
+            except zlib.error, ex:
+                raise GitStructureError("bad object at offset %d in pack: %s" % (offset,ex))
+            data = ''.join(chunks)
+            if len(data) != size:
+                raise GitStructureError("bad object at offset %d in pack" % (offset))
+            return (ObjectStore.PACK_TYPES[kind],data)
@@ -0,0 +1,95 @@
+# One pager for all of a command's output, across every repo, set up
+# the way git sets up its own
+#
+
+import os
+import subprocess
+import sys
+
+
+class Pager(object):
+    """ A pager process with groot's stdout (and stderr, if that's the same
+        terminal) going into it, for as long as the command runs. The git
+        commands run meanwhile write into it too -- they see a pipe, so don't
+        start pagers of their own, and GIT_PAGER_IN_USE has them color their
+        output as they would for the terminal.
+
+        If the pager is quit before the end, the git command writing to it
+        gets EPIPE, as does groot, and the command stops there """
+
+    def __init__(self,command):
+        self.command = command
+        self.process = None
+        self.quit = False
+
+
+    @staticmethod
+    def command_for(git,cmd_name):
+        """ The pager git would use for the command: GIT_PAGER, core.pager,
+            PAGER, or less -- or None for no pager """
+        if not sys.stdout.isatty():
+            return None
+        if git.get_config_bool('pager.%s' % (cmd_name)) is False:
+            return None
+
+        pager = os.environ.get('GIT_PAGER')
+        if pager is None: pager = git.get_config('core.pager')
+        if pager is None: pager = os.environ.get('PAGER')
+        if pager is None: pager = 'less'
+        if pager in ['','cat']:
+            return None
+        return pager
+
+
+    def start(self):
+        env = dict(os.environ)
+        env.setdefault('LESS','FRX')
+        env.setdefault('LV','-c')
+        self.process = subprocess.Popen(self.command,shell=True,stdin=subprocess.PIPE,
+                                        env=env,close_fds=True)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved_fds = [(fd,os.dup(fd)) for fd in [1,2] if fd == 1 or os.isatty(fd)]
+        for fd, saved in self.saved_fds:
+            os.dup2(self.process.stdin.fileno(),fd)
+        self.process.stdin.close()
+
+        # A fresh, line-buffered stdout, so the output goes into the pager
+        # as it's written rather than in blocks
+        self.stdout = sys.stdout
+        sys.stdout = os.fdopen(os.dup(1),'w',1)
+
+        self.pager_in_use = os.environ.get('GIT_PAGER_IN_USE')
+        os.environ['GIT_PAGER_IN_USE'] = 'true'
+
+
+    def stop(self):
+        """ Close the pager's input and wait for it to finish. Safe to call twice """
+        process = self.process
+        if not process:
+            return
+        self.process = None
+        self.quit = process.poll() is not None
+
+        try:
+            sys.stdout.close()
+        except IOError:
+            pass
+        sys.stdout = self.stdout
+        for fd, saved in self.saved_fds:
+            os.dup2(saved,fd)
+            os.close(saved)
+
+        if self.pager_in_use is None:
+            del os.environ['GIT_PAGER_IN_USE']
+        else:
+            os.environ['GIT_PAGER_IN_USE'] = self.pager_in_use
+
+        # The pager has the terminal until it's done, Ctrl-C included
+        while True:
+            try:
+                process.wait()
+                break
+            except KeyboardInterrupt:
+                pass
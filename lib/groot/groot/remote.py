@@ -0,0 +1,200 @@
+# Talking to remotes: one ssh connection per host shared by every git
+# command in the run, a bound on how many run against a host at once,
+# and the refs each remote advertises, asked for once
+#
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from groot.err import GitCommandError
+from groot.util import url_host
+
+
+class SshMaster(object):
+    """ An ssh ControlMaster for each host, with its socket in a directory
+        of groot's own, which git's ssh connections go through for as long
+        as the command runs (GIT_SSH_COMMAND). The first connection to a host
+        does the handshake, and the rest reuse it. The masters are stopped,
+        and the directory removed, when the command is done; ControlPersist
+        is only there so a groot that's killed doesn't leave them forever.
+
+        Nothing is done if ssh has already been set up some other way:
+        GIT_SSH_COMMAND, GIT_SSH or core.sshCommand """
+
+    PERSIST = 60
+
+    def __init__(self):
+        self.dir = None
+
+
+    @staticmethod
+    def wanted(git):
+        if os.name != 'posix':
+            return False
+        if os.environ.get('GIT_SSH_COMMAND') is not None or \
+           os.environ.get('GIT_SSH') is not None:
+            return False
+        return git.get_config('core.sshCommand') is None
+
+
+    def start(self):
+        # Unix socket paths are short (104 bytes on some systems), so not
+        # under a TMPDIR that may be long already
+        parent = os.path.isdir('/tmp') and '/tmp' or None
+        self.dir = tempfile.mkdtemp(prefix='groot-ssh-',dir=parent)
+
+        self.ssh_command = os.environ.get('GIT_SSH_COMMAND')
+        os.environ['GIT_SSH_COMMAND'] = "ssh -o ControlMaster=auto -o 'ControlPath=%s/%%C' -o ControlPersist=%d" % \
+                                        (self.dir,SshMaster.PERSIST)
+
+
+    def stop(self):
+        """ Stop the masters and remove their sockets. Safe to call twice """
+        if not self.dir:
+            return
+        if self.ssh_command is None:
+            del os.environ['GIT_SSH_COMMAND']
+        else:
+            os.environ['GIT_SSH_COMMAND'] = self.ssh_command
+
+        devnull = open(os.devnull,'w')
+        try:
+            for name in os.listdir(self.dir):
+                # With the socket given, the host is only there because
+                # ssh insists on one
+                subprocess.call(['ssh','-o','ControlPath=%s' % (os.path.join(self.dir,name)),
+                                 '-O','exit','groot'],
+                                stdin=devnull,stdout=devnull,stderr=devnull)
+        finally:
+            devnull.close()
+        shutil.rmtree(self.dir,ignore_errors=True)
+        self.dir = None
+
+
+
+class HostLimits(object):
+    """ Bounds the number of git commands going to each host at once, so
+        a pull across hundreds of submodules doesn't open hundreds of
+        connections to the same server. No limit if limit is None.
+
+        With connect_first, the first command for a host runs on its own,
+        so the connection it opens is there for the rest to share (see
+        SshMaster) instead of all of them racing to open their own """
+
+    def __init__(self,limit,connect_first=False):
+        self.limit = limit
+        self.connect_first = connect_first
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.connected = {}
+
+
+    def semaphore(self,host):
+        with self.lock:
+            if not host in self.semaphores:
+                self.semaphores[host] = threading.Semaphore(self.limit)
+            return self.semaphores[host]
+
+
+    def first_use(self,hosts):
+        """ Claim the hosts not used yet, all at once so that nobody waits on
+            anybody who is waiting on them. Returns the events for the hosts
+            claimed, and those to wait for """
+        claimed = []
+        waiting = []
+        with self.lock:
+            for host in hosts:
+                if host in self.connected:
+                    waiting.append(self.connected[host])
+                else:
+                    self.connected[host] = threading.Event()
+                    claimed.append(self.connected[host])
+        return claimed, waiting
+
+
+    @contextmanager
+    def hold(self,hosts):
+        """ Wait for a turn on each of the hosts (None being a local repo, which
+            isn't limited), and keep them while in the with block """
+        hosts = sorted(set(host for host in hosts if host))
+
+        claimed = []
+        if self.connect_first:
+            claimed, waiting = self.first_use(hosts)
+            for event in waiting:
+                event.wait()
+
+        semaphores = []
+        if self.limit is not None:
+            semaphores = [self.semaphore(host) for host in hosts]
+        for semaphore in semaphores:
+            semaphore.acquire()
+        try:
+            yield
+        finally:
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+            for event in claimed:
+                event.set()
+
+
+
+class RemoteRefs(object):
+    """ The refs that remotes advertise (git ls-remote), asked for at most
+        once per remote URL in the run, however many submodules want them,
+        and going through the HostLimits like any other command for the host """
+
+    def __init__(self,host_limits):
+        self.host_limits = host_limits
+        self.lock = threading.Lock()
+        self.cache = {}
+
+
+    def url(self,repo,remote):
+        url = repo.git.get_config('remote.%s.url' % (remote)) or remote
+        if url_host(url) is None and not '://' in url:
+            # A local path, which may be relative to the repo
+            url = os.path.normpath(os.path.join(repo.path,url))
+        return url
+
+
+    def refs(self,repo,remote):
+        """ A dict of ref name -> SHA-1 for what the remote has, or None if it
+            couldn't be asked """
+        url = self.url(repo,remote)
+        with self.lock:
+            if not url in self.cache:
+                self.cache[url] = [threading.Lock(),None,False]
+            entry = self.cache[url]
+
+        # Anyone else after the same URL waits for the one asking
+        with entry[0]:
+            if not entry[2]:
+                entry[1] = self.ls_remote(repo,remote,url)
+                entry[2] = True
+            return entry[1]
+
+
+    def ls_remote(self,repo,remote,url):
+        with self.host_limits.hold([url_host(url)]):
+            try:
+                stdout = repo.do_git(['ls-remote',remote],capture_all=True)
+            except GitCommandError, ex:
+                repo.groot.debug("# Can't list refs for %s: %s" % (url,(ex.stderr or '').strip()))
+                return None
+
+        refs = {}
+        for line in stdout.splitlines():
+            sha1, tab, name = line.partition('\t')
+            if name:
+                refs[name] = sha1
+        return refs
+
+
+    def has_branch(self,repo,remote,branch):
+        refs = self.refs(repo,remote)
+        return refs is not None and ('refs/heads/%s' % (branch)) in refs
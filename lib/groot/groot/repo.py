@@ -2,70 +2,173 @@ import os
 import subprocess
 
 from groot.git import *
+from groot.state import StateCache
+from groot.util import PathTrie
 
 class Repo(object):
     """ Interface for working with a git repository """
 
-    def __init__(self,groot,path):
+    def __init__(self,groot,path,state=None):
         self.groot = groot
         self.path = path
         self.git = Git(self.path)
         self.submodules = None
+        self.submodule_paths = None
+        self.modules_key = None
+        self.tree_path = ''
+
+        # The superproject keeps a cache of what's known about it and its
+        # submodules between runs, which the submodules share
+        if state is None and self.git.initialized():
+            state = StateCache(os.path.join(self.git.git_dir,'groot','state.cache'))
+        self.state = state
+        if state:
+            self.git.use_state_cache(state,self.path)
 
     
     def get_submodules(self):
+        """ The repo's own submodules """
         self.parse_modules()
         return self.submodules
 
 
-    def get_submodule(self,rel_path):
-        if rel_path.endswith('/'):
-            rel_path = rel_path[:-1]
+    def all_submodules(self):
+        """ Every submodule in the tree under the repo, parents before their
+            own submodules. Only checked-out submodules can have any """
+        found = []
         for subm in self.get_submodules():
-            if subm.rel_path == rel_path:
-                return subm
-            
+            found.append(subm)
+            found.extend(subm.all_submodules())
+        return found
+
+
+    def parent_repo(self):
+        """ The repo this is a submodule of, or None """
+        return None
+
+
+    def get_submodule(self,path):
+        """ The submodule (at any depth) at exactly this path, or None """
+        subm, sub_path = self.which_submodule(path)
+        if not sub_path:
+            return subm
+
+
+    def which_submodule(self,path):
+        """ Returns (submodule,sub_path) for the deepest submodule that path
+            (relative to the repo) is in, and the path relative to it. If it
+            isn't in a submodule, returns (None,path) """
+        self.parse_modules()
+        subm, sub_path = self.submodule_paths.find(path)
+        if subm and sub_path:
+            nested, nested_path = subm.which_submodule(sub_path)
+            if nested:
+                return (nested,nested_path)
+        return (subm,sub_path)
+
 
     def parse_modules(self):
         if self.submodules:
             return
 
         self.submodules = []
+        self.submodule_paths = PathTrie()
 
         modules_path = os.path.join(self.path,'.gitmodules')
+        self.modules_key = RefStore.file_key(modules_path)
         if not os.path.exists(modules_path):
-            self.groot.log("# No submodules file: %s" % (modules_path))
+            if not self.parent_repo():
+                self.groot.log("# No submodules file: %s" % (modules_path))
             return
 
         self.groot.debug("# Reading %s" % (modules_path))
-        cfg = GitConfig()
-        cfg.parse(modules_path)
+        cfg_submodules = self.git.state_entry('modules',lambda: [modules_path],
+                                              lambda: self.read_modules(modules_path))
         
-        if 'submodule' in cfg:
-            cfg_submodules = cfg['submodule']
+        if cfg_submodules:
             for subm in sorted(cfg_submodules.keys()):
                 subm = cfg_submodules[subm]
                 submodule_path = os.path.join(self.path,subm['path'])
-                self.submodules.append(Submodule(self,submodule_path,**subm))
+                submodule = Submodule(self,submodule_path,**subm)
+                self.submodules.append(submodule)
+                self.submodule_paths.add(submodule.rel_path,submodule)
+                self.git.submodule_gits[submodule.rel_path] = submodule.git
                 
 
+    def read_modules(self,path):
+        return GitConfig.load(path,includes=False).subsections('submodule')
+
+
     def do_git(self,command,**kwargs):
         git_command = ['git']
         git_command.extend(command)
         return self.git.do_command(git_command,**kwargs)
 
 
+    def cached_git(self,command,**kwargs):
+        """ Captured output of a read-only git command, possibly remembered
+            from an earlier run (see Git.cached_output) """
+        git_command = ['git']
+        git_command.extend(command)
+        return self.git.cached_output(git_command,**kwargs)
+
+
     def last_git_result(self):
         return self.git.last_result
+
+
+    def close(self):
+        """ Stop any helper processes for this repo and its submodules """
+        self.git.close()
+        for subm in self.submodules or []:
+            subm.close()
+        if self.state:
+            self.state.save()
     
 
+    def refresh(self,changed=None):
+        """ Forget anything about the repo that may have changed since it was
+            last used, for a Repo kept between commands (by the daemon).
+            Caches that check their own files' mtimes are kept.
+
+            changed is the set of repo paths known to have been written to
+            since (see groot.watch), or None to refresh everything. A repo is
+            refreshed if it or any of its submodules changed. Returns whether
+            it was """
+        own_change = changed is None or self.path in changed
+        if own_change and self.submodules is not None and \
+               RefStore.file_key(os.path.join(self.path,'.gitmodules')) != self.modules_key:
+            for subm in self.submodules:
+                subm.close()
+            self.submodules = None
+
+        submodule_change = False
+        for subm in self.submodules or []:
+            if subm.refresh(changed):
+                submodule_change = True
+
+        if own_change or submodule_change:
+            self.git.invalidate()
+            return True
+        return False
+
+
+    def mark_clean(self,tree_paths):
+        """ Take it as known that the given submodules are clean """
+        for subm in self.all_submodules():
+            if subm.tree_path in tree_paths:
+                subm.git.assume_clean()
+
+
     def exists(self):
         return os.path.exists(self.path)
 
 
     def banner(self,msg=None,deferred=False,tick=False):
         self.groot.clear_log()
-        self.groot.log("\n# ---[ %s ]---" % (self.banner_path()),deferred=deferred,tick=tick)
+        # Streamed lines are already prefixed with where they're from
+        if not self.groot.stream_prefix():
+            self.groot.log("\n# ---[ %s ]---" % (self.banner_path()),deferred=deferred,tick=tick)
         if msg:
             self.groot.log(msg,deferred=deferred)
 
@@ -110,6 +213,10 @@ class Repo(object):
     def current_branch(self):
         return self.git.current_branch()
 
+    def get_gitlink(self,rel_path):
+        """ Returns the SHA-1 recorded in this repo's index for the submodule at rel_path """
+        return self.git.gitlinks().get(rel_path)
+
     def get_head_commit(self):
         return self.git.get_head_of_branch(self.git.current_branch())
 
@@ -120,7 +227,7 @@ class Repo(object):
 class Submodule(Repo):
     """ Subclass of Repo representing a submodule """
     def __init__(self,root,full_path,**kwargs):
-        super(Submodule,self).__init__(root.groot,full_path)
+        super(Submodule,self).__init__(root.groot,full_path,state=root.state)
         self.root = root
         
         if 'url' in kwargs:
@@ -143,6 +250,11 @@ class Submodule(Repo):
         else:
             self.remote = 'origin'
 
+        # The path from the top of the superproject, for a nested submodule
+        self.tree_path = self.rel_path
+        if root.tree_path and self.rel_path:
+            self.tree_path = '%s/%s' % (root.tree_path,self.rel_path)
+
 
 
     def __repr__(self):
@@ -150,11 +262,28 @@ class Submodule(Repo):
 
 
     def banner_path(self):
-        return self.rel_path
+        return self.tree_path
+
+
+    def parent_repo(self):
+        return self.root
     
 
     def branch_exists(self,branch):
         return self.git.branch_exists(branch)
+
+
+    def do_git(self,command,**kwargs):
+        try:
+            return super(Submodule,self).do_git(command,**kwargs)
+        finally:
+            # Changes in the submodule also show up in the status of the
+            # repos above it
+            if not Git.is_read_only(['git'] + command):
+                parent = self.root
+                while parent:
+                    parent.git.invalidate_status()
+                    parent = parent.parent_repo()
     
         
     def preferred_branch(self):
@@ -198,13 +327,9 @@ class Submodule(Repo):
     def get_current_commit(self):
         """ Returns the SHA-1 ID of the submodule's current commit (what's specified in the
             root's index, not what's currently checked-out in the submodule) """
-        output = self.root.do_git(['submodule','status','--cached',self.rel_path],capture=True)
-
-        m = re.match('([ +\-])([a-z0-9]{40}) (.+)(| \((.+)\))',output)
-        if not m:
-            raise GitOutputError("Didn't recognized output of 'git submodule status --cached")
-
-        sha1 = m.group(2)
+        sha1 = self.root.get_gitlink(self.rel_path)
+        if not sha1:
+            raise GitOutputError("No submodule commit in the index for %s" % (self.rel_path))
         return sha1
     
     
@@ -0,0 +1,88 @@
+# Bounded-memory capture of git output: held in memory up to a threshold,
+# then spilled to a temporary file, so a huge diff or log isn't held in
+# memory (several times over) just to be passed on
+#
+
+import os
+from tempfile import SpooledTemporaryFile
+
+
+class Spool(object):
+    """ Output captured from a command, to be read back as a stream: by line,
+        iterating over it, or in chunks(). len() is the size in bytes, so an
+        empty Spool is false, just like empty output captured as a string.
+
+        The threshold is GROOT_SPOOL_SIZE bytes (with an optional k, m or g
+        suffix), or THRESHOLD if that isn't set """
+
+    THRESHOLD = 1024 * 1024
+    CHUNK_SIZE = 65536
+
+    def __init__(self,threshold=None):
+        if threshold is None: threshold = Spool.threshold()
+        self.max_size = threshold
+        self.file = SpooledTemporaryFile(max_size=threshold)
+        self.size = 0
+
+
+    @staticmethod
+    def threshold():
+        value = os.environ.get('GROOT_SPOOL_SIZE','').strip().lower()
+        if not value:
+            return Spool.THRESHOLD
+        scale = 1
+        if value[-1] in 'kmg':
+            scale = 1024 ** ('kmg'.index(value[-1]) + 1)
+            value = value[:-1]
+        try:
+            return int(value) * scale
+        except ValueError:
+            return Spool.THRESHOLD
+
+
+    @classmethod
+    def of(cls,text):
+        spool = cls()
+        spool.write(text)
+        return spool
+
+
+    def __repr__(self):
+        return '<Spool: %d bytes%s>' % (self.size,self.spilled() and ', on disk' or '')
+
+
+    def __len__(self):
+        return self.size
+
+
+    def write(self,data):
+        self.file.write(data)
+        self.size += len(data)
+
+
+    def spilled(self):
+        """ Whether it's grown too big to be kept in memory """
+        return self.size > self.max_size
+
+
+    def __iter__(self):
+        self.file.seek(0)
+        return iter(self.file)
+
+
+    def chunks(self):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(Spool.CHUNK_SIZE)
+            if not chunk: break
+            yield chunk
+
+
+    def getvalue(self):
+        """ The whole output as a string, for when it's known to be small """
+        self.file.seek(0)
+        return self.file.read()
+
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,112 @@
+# Cache of what's known about a superproject, kept between groot runs
+#
+
+import marshal
+import os
+import threading
+
+from groot.boot import Groot
+from groot.git import RefStore
+
+
+class StateCache(object):
+    """ Remembers things learned about the superproject and its submodules
+        from one groot run to the next, in .git/groot/state.cache.
+
+        Each entry is stored with a fingerprint: the keys (mtime, size, inode)
+        of the files and directories it was worked out from. An entry is only
+        used while all of those are unchanged, and is only stored if none of
+        them was modified too recently for its mtime to be trusted """
+
+    VERSION = 1
+
+    # Entries not used in a run are dropped once there are more than this
+    MAX_ENTRIES = 4096
+
+    def __init__(self,path):
+        self.groot = Groot.instance
+        self.path = path
+        self.entries = None
+        self.used = set()
+        self.changed = False
+        self.lock = threading.Lock()
+
+
+    def __repr__(self):
+        return '<StateCache: %s>' % (self.path)
+
+
+    def load(self):
+        self.entries = {}
+        try:
+            fh = open(self.path,'rb')
+        except IOError:
+            return
+        try:
+            data = marshal.load(fh)
+            if data.get('version') == StateCache.VERSION:
+                entries = data['entries']
+                if not isinstance(entries,dict):
+                    raise ValueError("entries aren't a dict")
+                self.entries = entries
+        except (EOFError,ValueError,TypeError,AttributeError,KeyError), ex:
+            self.groot.debug("# Ignoring unreadable state cache %s: %s" % (self.path,ex))
+        finally:
+            fh.close()
+
+
+    def get(self,name):
+        """ The value stored for name, or None if there isn't one or anything
+            in its fingerprint has changed since """
+        with self.lock:
+            if self.entries is None: self.load()
+            entry = self.entries.get(name)
+        if not entry:
+            return None
+
+        try:
+            fingerprint, value = entry
+            for path, key in fingerprint:
+                if RefStore.file_key(path) != key:
+                    return None
+        except (ValueError,TypeError), ex:
+            self.groot.debug("# Ignoring unreadable state cache entry %s: %s" % (name,ex))
+            return None
+        with self.lock:
+            self.used.add(name)
+        return value
+
+
+    def put(self,name,paths,value):
+        """ Store value under name, fingerprinted by the given paths """
+        fingerprint = tuple((path,RefStore.file_key(path)) for path in paths)
+        if not all(RefStore.settled(key) for path, key in fingerprint):
+            return
+        with self.lock:
+            if self.entries is None: self.load()
+            self.entries[name] = (fingerprint,value)
+            self.used.add(name)
+            self.changed = True
+
+
+    def save(self):
+        """ Write the cache out if anything was added. Failing to write it
+            (e.g. a read-only repo) isn't an error """
+        with self.lock:
+            if not self.changed: return
+            if len(self.entries) > StateCache.MAX_ENTRIES:
+                self.entries = dict((name,entry) for name, entry in self.entries.items() if name in self.used)
+
+            tmp_path = '%s.%d' % (self.path,os.getpid())
+            try:
+                if not os.path.isdir(os.path.dirname(self.path)):
+                    os.makedirs(os.path.dirname(self.path))
+                fh = open(tmp_path,'wb')
+                try:
+                    marshal.dump({ 'version': StateCache.VERSION, 'entries': self.entries },fh)
+                finally:
+                    fh.close()
+                os.rename(tmp_path,self.path)
+                self.changed = False
+            except EnvironmentError, ex:
+                self.groot.debug("# Can't save state cache %s: %s" % (self.path,ex))
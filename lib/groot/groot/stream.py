@@ -0,0 +1,158 @@
+# Live output for fan-out commands (groot --stream): each task's output
+# is written as it comes, a line at a time, prefixed with the submodule
+# it's for, instead of being held back and replayed in order
+#
+
+import sys
+import threading
+import time
+
+
+class LineStream(object):
+    """ Where the streamed lines from all the running tasks go. Lines are
+        collected and written out in batches: once enough has built up,
+        once FLUSH_INTERVAL has passed, or when flush() is called -- so a
+        chatty git command doesn't mean a write per line """
+
+    BATCH_SIZE = 16384
+    FLUSH_INTERVAL = 0.1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.partial = {}
+        self.frames = []
+        self.size = 0
+        self.flushed_at = time.time()
+
+
+    def write(self,prefix,data,fh):
+        """ Add data written to fh for prefix. A line without its end yet is
+            kept until the rest of it comes. Progress lines ending in \\r are
+            lines too, so they still overwrite each other on a terminal """
+        with self.lock:
+            key = (prefix,fh)
+            lines = (self.partial.pop(key,'') + data).splitlines(True)
+            if lines and not lines[-1].endswith(('\n','\r')):
+                self.partial[key] = lines.pop()
+            for line in lines:
+                self.add(fh,self.prefixed(prefix,line))
+
+            if self.size >= LineStream.BATCH_SIZE or \
+               time.time() - self.flushed_at >= LineStream.FLUSH_INTERVAL:
+                self.write_frames()
+
+
+    def finish(self,prefix):
+        """ End any lines left unfinished for prefix """
+        with self.lock:
+            for key in [key for key in self.partial if key[0] == prefix]:
+                self.add(key[1],self.prefixed(prefix,self.partial.pop(key) + '\n'))
+            self.write_frames()
+
+
+    def flush(self):
+        with self.lock:
+            self.write_frames()
+
+
+    def prefixed(self,prefix,line):
+        if prefix:
+            return '[%s] %s' % (prefix,line)
+        return line
+
+
+    def add(self,fh,text):
+        if self.frames and self.frames[-1][0] is fh:
+            self.frames[-1][1].append(text)
+        else:
+            self.frames.append((fh,[text]))
+        self.size += len(text)
+
+
+    def write_frames(self):
+        for fh, chunks in self.frames:
+            fh.write(''.join(chunks))
+            fh.flush()
+        self.frames = []
+        self.size = 0
+        self.flushed_at = time.time()
+
+
+
+class StreamedOutput(object):
+    """ Takes the place of a task's list of recorded output calls (see
+        Groot.record) when streaming: instead of keeping each call to replay
+        later, it's done straight away, with the output going to the LineStream
+        prefixed with the task's label.
+
+        Deferred messages are kept per task, and shown or dropped just as
+        Groot would, so output that's normally suppressed still is """
+
+    def __init__(self,groot,stream,prefix):
+        self.groot = groot
+        self.stream = stream
+        self.prefix = prefix
+        self.deferred = []
+
+
+    def append(self,op):
+        name, args, kwargs = op
+        getattr(self,name)(*args,**kwargs)
+
+
+    def finish(self):
+        self.stream.finish(self.prefix)
+
+
+    def output(self,fh,msg,deferred):
+        if deferred:
+            self.deferred.append((fh,msg))
+        else:
+            self.flush_log()
+            self.send(fh,msg)
+
+
+    def send(self,fh,msg):
+        self.write(msg,fh)
+        self.stream.write(self.prefix,'\n',fh)
+
+
+    def log(self,msg,deferred=False,tick=False):
+        if not self.groot.quiet:
+            self.output(sys.stdout,msg,deferred)
+
+    def debug(self,msg,deferred=False):
+        if self.groot.debug_mode:
+            self.output(sys.stdout,msg,deferred)
+
+    def warning(self,msg,deferred=False):
+        self.output(sys.stderr,msg,deferred)
+
+    def error(self,msg,deferred=False):
+        with self.stream.lock:
+            self.groot.errors += 1
+        self.output(sys.stderr,msg,deferred)
+
+
+    def write(self,data,fh=None):
+        if not data:
+            return
+        fh = fh or sys.stdout
+        if hasattr(data,'chunks'):
+            # Captured output in a Spool
+            for chunk in data.chunks():
+                self.stream.write(self.prefix,chunk,fh)
+        else:
+            self.stream.write(self.prefix,'%s' % (data),fh)
+
+
+    def tick(self):
+        pass
+
+    def clear_log(self):
+        self.deferred = []
+
+    def flush_log(self):
+        for fh, msg in self.deferred:
+            self.send(fh,msg)
+        self.deferred = []
@@ -0,0 +1,84 @@
+#
+# Benchmark for capturing git output: builds a scratch repo with a ~50MB
+# diff, then times how long it takes to capture 'git diff' through the
+# pseudo-tty runner, through pipes with terminal colors, and plain pipes.
+#
+# It's captured to a Spool first, which should leave the peak RSS about
+# where it started, then as a string, which takes it up by the diff size.
+#
+# Usage: bench_capture.py [size_mb]
+#
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import groot.boot
+import groot.git
+
+
+class TtyGit(groot.git.Git):
+    """ Acts as though output goes to a terminal, even when the
+        benchmark isn't being run from one """
+    def isa_tty(self):
+        return True
+
+
+class CaptureBenchmark(object):
+
+    def __init__(self,argv):
+        self.size_mb = 50
+        if argv: self.size_mb = int(argv[0])
+
+
+    def run(self):
+        groot.boot.Groot()
+        self.path = tempfile.mkdtemp(prefix='groot-bench-')
+        try:
+            self.make_repo()
+            self.time_capture('spool',spool=True)
+            self.time_capture('pty',pty=True)
+            self.time_capture('color',tty=True)
+            self.time_capture('pipes')
+        finally:
+            shutil.rmtree(self.path)
+
+
+    def make_repo(self):
+        """ Commit a file, then rewrite every line of it. The diff shows each line
+            twice (removed and added), so the file is half the diff size """
+        def git(*args):
+            subprocess.check_call(['git'] + list(args),cwd=self.path,stdout=open(os.devnull,'w'))
+
+        line = 'x' * 63 + '\n'
+        lines = self.size_mb * 1024 * 1024 / len(line) / 2
+        git('init','-q')
+        self.write_file(line,lines)
+        git('add','big.txt')
+        git('-c','user.name=bench','-c','user.email=bench@localhost','commit','-q','-m','big')
+        self.write_file(line.replace('x','y'),lines)
+
+
+    def write_file(self,line,count):
+        fh = open(os.path.join(self.path,'big.txt'),'w')
+        fh.write(line * count)
+        fh.close()
+
+
+    def time_capture(self,name,**kwargs):
+        git = TtyGit(self.path)
+        start = time.time()
+        stdout = git.do_command(['git','diff'],capture=True,**kwargs)
+        elapsed = time.time() - start
+
+        mb = len(stdout) / (1024.0 * 1024.0)
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        print("%-6s %7.1f MB in %6.2fs  %7.1f MB/s  peak RSS %6.1f MB" % (name,mb,elapsed,mb / elapsed,rss_mb))
+
+
+if __name__ == '__main__':
+    CaptureBenchmark(sys.argv[1:]).run()
@@ -0,0 +1,81 @@
+#
+# Startup benchmark: times how long bin/groot takes to get as far as
+# running a command, less the interpreter's own startup, and fails if
+# that's over budget. Also fails if starting a command imports modules
+# it doesn't need: other commands' modules, or anything in BANNED.
+#
+# The command run is 'help', which needs no repo and does next to
+# nothing, so the time is all startup.
+#
+# Usage: bench_startup.py path/to/bin/groot [budget_ms]
+#
+
+import os
+import subprocess
+import sys
+import time
+
+# Modules no command should need just to start
+BANNED = ['xml']
+
+
+class StartupBenchmark(object):
+
+    RUNS = 20
+
+    def __init__(self,argv):
+        self.path_to_groot = argv[0]
+        self.budget_ms = 40.0
+        if len(argv) > 1: self.budget_ms = float(argv[1])
+        self.env = dict(os.environ)
+        self.env['GROOT_NO_DAEMON'] = '1'
+
+
+    def run(self):
+        failures = self.check_imports()
+
+        python_ms = self.best_time([sys.executable,'-E','-c','pass'])
+        groot_ms = self.best_time([sys.executable,'-E',self.path_to_groot,'help'])
+        startup_ms = groot_ms - python_ms
+        print("python %6.1f ms" % (python_ms))
+        print("groot  %6.1f ms  (startup %.1f ms, budget %.1f ms)" % (groot_ms,startup_ms,self.budget_ms))
+        if startup_ms > self.budget_ms:
+            failures.append("startup took %.1f ms, over the budget of %.1f ms" % (startup_ms,self.budget_ms))
+
+        for failure in failures:
+            print("FAIL: %s" % (failure))
+        return not failures
+
+
+    def best_time(self,cmd):
+        best = None
+        devnull = open(os.devnull,'w')
+        for i in range(StartupBenchmark.RUNS):
+            start = time.time()
+            subprocess.check_call(cmd,stdout=devnull,env=self.env)
+            elapsed = time.time() - start
+            if best is None or elapsed < best: best = elapsed
+        devnull.close()
+        return best * 1000.0
+
+
+    def check_imports(self):
+        """ Run the command with python -v, which logs each import """
+        proc = subprocess.Popen([sys.executable,'-E','-v',self.path_to_groot,'help'],
+                                stdout=subprocess.PIPE,stderr=subprocess.PIPE,env=self.env)
+        stdout, stderr = proc.communicate()
+        modules = [line.split()[1] for line in stderr.splitlines() if line.startswith('import ')]
+        print("%d modules imported" % (len(modules)))
+
+        failures = []
+        for module in modules:
+            if module.startswith('groot.command.') and not module in ['groot.command.base','groot.command.help']:
+                failures.append("imported another command's module: %s" % (module))
+            if module.split('.')[0] in BANNED:
+                failures.append("imported %s" % (module))
+        return failures
+
+
+if __name__ == '__main__':
+    if not StartupBenchmark(sys.argv[1:]).run():
+        sys.exit(1)
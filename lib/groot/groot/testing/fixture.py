@@ -0,0 +1,105 @@
+#
+# Scratch git repos for the unit tests of groot's in-process readers
+# (refs, index, config), which are checked against what git itself says,
+# and a Groot whose output the tests can look at
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import groot.boot
+
+
+class GitFixture(object):
+    """ A scratch directory to build git repos in, with git run in it """
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='groot-test-')
+
+        # Only the config the test writes counts
+        self.env = dict(os.environ)
+        self.env['HOME'] = self.path
+        self.env['XDG_CONFIG_HOME'] = os.path.join(self.path,'.config')
+        self.env['GIT_CONFIG_NOSYSTEM'] = '1'
+        for name in ['GIT_DIR','GIT_WORK_TREE','GIT_INDEX_FILE','GIT_CONFIG_GLOBAL',
+                     'GIT_CONFIG_SYSTEM','GIT_CONFIG_PARAMETERS']:
+            self.env.pop(name,None)
+        self.env.update({ 'GIT_AUTHOR_NAME': 'groot', 'GIT_AUTHOR_EMAIL': 'groot@example.com',
+                          'GIT_COMMITTER_NAME': 'groot', 'GIT_COMMITTER_EMAIL': 'groot@example.com' })
+
+
+    def cleanup(self):
+        shutil.rmtree(self.path,ignore_errors=True)
+
+
+    def join(self,*parts):
+        return os.path.join(self.path,*parts)
+
+
+    def git(self,*args,**kwargs):
+        """ Run git in the fixture (or in cwd under it), and return its stdout """
+        cwd = self.join(kwargs.get('cwd',''))
+        p = subprocess.Popen(['git'] + list(args),cwd=cwd,env=self.env,
+                             stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate(kwargs.get('input'))
+        if p.returncode != 0:
+            raise AssertionError("git %s failed in %s:\n%s" % (' '.join(args),cwd,stderr))
+        return stdout
+
+
+    def write(self,path,data):
+        path = self.join(path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fh = open(path,'w')
+        try: fh.write(data)
+        finally: fh.close()
+
+
+    def init(self,path='repo'):
+        """ A new repo with one commit, returning its path """
+        self.git('init','-q',path)
+        self.write(os.path.join(path,'README'),'readme\n')
+        self.git('add','README',cwd=path)
+        self.git('commit','-q','-m','initial',cwd=path)
+        return self.join(path)
+
+
+
+class GitTestCase(unittest.TestCase):
+    """ Runs each test with a fresh GitFixture, and the environment it sets
+        up for git also set for groot """
+
+    def setUp(self):
+        self.fixture = GitFixture()
+        self.saved_env = dict(os.environ)
+        os.environ.clear()
+        os.environ.update(self.fixture.env)
+        self.groot = groot.boot.Groot()
+
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        self.fixture.cleanup()
+
+
+
+class GrootTestCase(unittest.TestCase):
+    """ Runs each test with a fresh Groot, and what it writes to stdout and
+        stderr kept in self.stdout and self.stderr """
+
+    def setUp(self):
+        self.groot = groot.boot.Groot()
+        self.saved_output = (sys.stdout,sys.stderr)
+        sys.stdout = self.stdout = StringIO()
+        sys.stderr = self.stderr = StringIO()
+
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.saved_output
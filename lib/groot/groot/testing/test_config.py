@@ -0,0 +1,189 @@
+#
+# GitConfig (groot.git) against 'git config --list' and 'git config --get'
+#
+
+import os
+import unittest
+
+from groot.git import Git, GitConfig
+from groot.testing.fixture import GitTestCase
+
+
+SYNTAX = r'''
+[Core]
+	FileMode = false
+	bare-bool
+	empty =
+[user]
+	name = "  quoted  spaces  "   # comment after the value
+	email = inner   spaces kept  ; another comment
+	motto = "a # and a ; in quotes"
+	escapes = tab\there\nnewline \"quoted\" back\\slash
+	half = un"quoted ";"" kept
+	long = first \
+second \
+	third
+[Remote "Origin"]
+	url = /srv/origin.git
+	fetch = +refs/heads/*:refs/remotes/Origin/*
+	fetch = +refs/tags/*:refs/tags/*
+[remote "origin"]
+	url = /srv/lower.git
+[branch "with \"quotes\" and \\"]
+	merge = refs/heads/master
+[Old.Style]
+	key = value
+  # indented comment
+; and the other kind
+[multi]
+	value = 1
+	value = 2
+[multi]
+	VALUE = 3
+[bools]
+	yes = yes
+	no = off
+	number = 0
+	bare
+'''
+
+
+class GitConfigTest(GitTestCase):
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+        self.repo = self.fixture.init()
+
+
+    def git(self,*args,**kwargs):
+        return self.fixture.git(cwd='repo',*args,**kwargs)
+
+
+    def append_config(self,data,path='repo/.git/config'):
+        path = self.fixture.join(path)
+        old = os.path.exists(path) and open(path).read() or ''
+        self.fixture.write(path,old + data)
+
+
+    def set_env(self,name,value):
+        os.environ[name] = value
+        self.fixture.env[name] = value
+
+
+    def git_list(self):
+        """ (key, value) for each entry, as git lists them. value is None
+            for a key given without '=' """
+        entries = []
+        for item in self.git('config','--list','-z').split('\0'):
+            if not item: continue
+            key, nl, value = item.partition('\n')
+            entries.append((key,value if nl else None))
+        return entries
+
+
+    def groot_list(self):
+        git = Git(self.repo)
+        entries = []
+        for path in git.config_paths():
+            for section, subsection, name, value in GitConfig.load(path,git_dir=git.git_dir).entries:
+                if subsection is None:
+                    entries.append(('%s.%s' % (section,name),value))
+                else:
+                    entries.append(('%s.%s.%s' % (section,subsection,name),value))
+        return entries
+
+
+    def assert_matches_git(self):
+        self.assertEqual(self.groot_list(),self.git_list())
+
+
+    def test_syntax(self):
+        self.append_config(SYNTAX)
+        self.assert_matches_git()
+
+
+    def test_get(self):
+        """ Lookups with keys in any case, except for the subsection """
+        self.append_config(SYNTAX)
+        git = Git(self.repo)
+        for key in ['core.filemode','CORE.FILEMODE','user.name','user.long','remote.Origin.url',
+                    'remote.origin.url','REMOTE.Origin.URL','branch.with "quotes" and \\.merge',
+                    'old.style.key','multi.value']:
+            self.assertEqual(git.get_config(key),self.git('config','--get',key).rstrip('\n'))
+        self.assertEqual(git.get_config_all('multi.value'),
+                         self.git('config','--get-all','multi.value').splitlines())
+        self.assertEqual(git.get_config_all('remote.Origin.fetch'),
+                         self.git('config','--get-all','remote.Origin.fetch').splitlines())
+        self.assertEqual(git.get_config('no.such.key','default'),'default')
+
+        for key in ['bools.yes','bools.no','bools.number','bools.bare','core.bare-bool']:
+            self.assertEqual(git.get_config_bool(key),
+                             self.git('config','--bool','--get',key).strip() == 'true')
+        self.assertEqual(git.remotes(),['Origin','origin'])
+
+
+    def test_includes(self):
+        self.fixture.write('included','[included]\n\tkey = relative\n[include]\n\tpath = nested\n')
+        self.fixture.write('nested','[nested]\n\tkey = nested\n')
+        self.fixture.write('home','[included]\n\tkey = from home\n')
+        self.fixture.write('yes','[cond]\n\tkey = yes\n')
+        self.fixture.write('no','[cond]\n\tkey = no\n')
+        self.append_config('\n'.join([
+            '[include]',
+            '\tpath = ../../included',
+            '\tpath = ~/home',
+            '\tpath = missing',
+            '[includeIf "gitdir:%s/"]' % (self.repo),
+            '\tpath = %s' % (self.fixture.join('yes')),
+            '[includeIf "gitdir/i:%s/"]' % (self.repo.upper()),
+            '\tpath = %s' % (self.fixture.join('yes')),
+            '[includeIf "gitdir:repo/"]',
+            '\tpath = %s' % (self.fixture.join('yes')),
+            '[includeIf "gitdir:other/"]',
+            '\tpath = %s' % (self.fixture.join('no')),
+            '[includeIf "gitdir:%s/"]' % (self.repo.upper()),
+            '\tpath = %s' % (self.fixture.join('no')),
+            '[includeIf "onbranch:master"]',
+            '\tpath = %s' % (self.fixture.join('yes')),
+            '[includeIf "onbranch:feature/"]',
+            '\tpath = %s' % (self.fixture.join('no')),
+            '[includeIf "unknown:condition"]',
+            '\tpath = %s' % (self.fixture.join('no')),
+            '']))
+        self.assert_matches_git()
+
+        # Following HEAD to another branch
+        self.git('checkout','-q','-b','feature/x')
+        self.assert_matches_git()
+
+
+    def test_global(self):
+        """ The XDG and ~/.gitconfig files, in that order, before the repo's """
+        self.append_config('[user]\n\tname = xdg\n',path='.config/git/config')
+        self.append_config('[user]\n\tname = home\n',path='.gitconfig')
+        self.append_config('[user]\n\tname = repo\n')
+        self.assert_matches_git()
+        self.assertEqual(Git(self.repo).get_config_all('user.name'),['xdg','home','repo'])
+
+
+    def test_config_global_env(self):
+        """ GIT_CONFIG_GLOBAL in place of both global files """
+        self.append_config('[user]\n\tname = home\n',path='.gitconfig')
+        self.append_config('[user]\n\tname = elsewhere\n',path='elsewhere')
+        self.set_env('GIT_CONFIG_GLOBAL',self.fixture.join('elsewhere'))
+        self.assert_matches_git()
+        self.assertEqual(Git(self.repo).get_config('user.name'),'elsewhere')
+
+
+    def test_system(self):
+        self.append_config('[user]\n\tname = system\n',path='system')
+        del os.environ['GIT_CONFIG_NOSYSTEM']
+        del self.fixture.env['GIT_CONFIG_NOSYSTEM']
+        self.set_env('GIT_CONFIG_SYSTEM',self.fixture.join('system'))
+        self.assert_matches_git()
+        self.assertEqual(Git(self.repo).get_config('user.name'),'system')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
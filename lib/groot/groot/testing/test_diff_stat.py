@@ -0,0 +1,129 @@
+#
+# The diff --stat options' reading of 'git diff --numstat -z' (groot.command.diff),
+# against git's own --numstat, --name-status and --shortstat
+#
+
+import os
+import unittest
+
+from groot.command.diff import Diff
+from groot.testing.fixture import GitTestCase
+
+
+class DiffStatTest(GitTestCase):
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+        self.repo = self.fixture.init()
+        self.fixture.write('repo/lines','\n'.join(str(i) for i in range(40)) + '\n')
+        self.fixture.write('repo/to rename','\n'.join('rename %d' % (i) for i in range(20)) + '\n')
+        self.fixture.write('repo/binary','\0\1\2' * 100)
+        self.fixture.write('repo/going','1\n2\n3\n')
+        self.git('add','.')
+        self.git('commit','-q','-m','files')
+        self.diff = Diff(self.groot,'diff')
+
+
+    def git(self,*args,**kwargs):
+        return self.fixture.git(cwd='repo',*args,**kwargs)
+
+
+    def numstat(self,*args):
+        return list(self.diff.parse_numstat(self.git('diff','--numstat','-z',*args)))
+
+
+    def git_numstat(self,*args):
+        """ (added,deleted) for each file, from the numstat without -z """
+        counts = []
+        for line in self.git('diff','--numstat',*args).splitlines():
+            added, deleted, path = line.split('\t',2)
+            if added == '-':
+                counts.append((None,None))
+            else:
+                counts.append((int(added),int(deleted)))
+        return counts
+
+
+    def git_paths(self,*args):
+        """ The path, or (from,to) for a rename, for each file """
+        paths = []
+        fields = iter(self.git('diff','--name-status','-z',*args).split('\0'))
+        for status in fields:
+            if not status: continue
+            if status[0] in 'RC':
+                paths.append((fields.next(),fields.next()))
+            else:
+                paths.append(fields.next())
+        return paths
+
+
+    def assert_matches_git(self,*args):
+        stats = self.numstat(*args)
+        self.assertEqual([(added,deleted) for added, deleted, path in stats],self.git_numstat(*args))
+        self.assertEqual([path for added, deleted, path in stats],self.git_paths(*args))
+        self.assertEqual(self.diff.stat_summary(stats),self.git('diff','--shortstat',*args).rstrip('\n'))
+        return stats
+
+
+    def test_changes(self):
+        self.fixture.write('repo/lines','\n'.join(str(i) for i in range(5,50)) + '\n')
+        self.fixture.write('repo/binary','\3\0' * 100)
+        self.fixture.write('repo/new','new\n')
+        self.git('add','-N','new')
+        self.git('rm','-q','going')
+        stats = self.assert_matches_git()
+        self.assertEqual(stats[0],(None,None,'binary'))
+
+
+    def test_renames(self):
+        self.git('mv','to rename','renamed')
+        os.mkdir(self.fixture.join('repo','dir'))
+        self.git('mv','lines','dir/moved lines')
+        self.fixture.write('repo/dir/moved lines','\n'.join(str(i) for i in range(39)) + '\nlast\n')
+        self.git('add','-A')
+        stats = self.assert_matches_git('--cached','-M')
+        self.assertEqual(sorted(path for added, deleted, path in stats),
+                         [('lines','dir/moved lines'),('to rename','renamed')])
+
+
+    def test_odd_paths(self):
+        """ Paths that the numstat without -z would quote """
+        for name in ['tab\there','new\nline','quote"d','caf\xc3\xa9']:
+            self.fixture.write('repo/' + name,'x\n')
+        self.git('add','.')
+        stats = self.numstat('--cached')
+        self.assertEqual(sorted(path for added, deleted, path in stats),
+                         sorted(['tab\there','new\nline','quote"d','caf\xc3\xa9']))
+        self.assertEqual(self.diff.stat_summary(stats),self.git('diff','--cached','--shortstat').rstrip('\n'))
+
+
+    def test_summaries(self):
+        """ Insertions and deletions are only left out when the other isn't 0 """
+        self.fixture.write('repo/lines','\n'.join(str(i) for i in range(41)) + '\n')
+        self.assert_matches_git()
+        self.git('checkout','lines')
+
+        self.fixture.write('repo/going','1\n')
+        self.assert_matches_git()
+        self.git('checkout','going')
+
+        self.fixture.write('repo/going','1\n2\n4\n')
+        self.assert_matches_git()
+        self.git('checkout','going')
+
+        self.git('update-index','--chmod=+x','going')
+        self.assert_matches_git('--cached')
+        self.git('update-index','--chmod=-x','going')
+
+        self.fixture.write('repo/binary','\4\0' * 10)
+        self.assert_matches_git()
+
+        # No changes, and no summary from either
+        self.git('checkout','binary')
+        self.assertEqual(self.numstat(),[])
+        self.assertEqual(self.git('diff','--shortstat'),'')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
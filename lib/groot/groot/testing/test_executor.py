@@ -0,0 +1,148 @@
+#
+# Executor (groot.command.base): output replayed in submodule order,
+# failures in the workers raised on the main thread, and -j 1 the same
+# as running serially
+#
+
+import threading
+import time
+import unittest
+
+from groot.command.base import Executor
+from groot.testing.fixture import GrootTestCase
+
+
+class FakeRepo(object):
+    """ Just enough of a Repo to be walked: a tree path and submodules """
+
+    def __init__(self,tree_path,submodules=()):
+        self.tree_path = tree_path
+        self.submodules = list(submodules)
+
+    def get_submodules(self):
+        return self.submodules
+
+
+
+class ExecutorTest(GrootTestCase):
+
+    NAMES = ['sub/s%d' % (i) for i in range(8)]
+
+    def setUp(self):
+        GrootTestCase.setUp(self)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.threads = set()
+
+
+    def task(self,subm):
+        """ Logs for subm, taking longer the earlier it comes, so the tasks
+            finish in the opposite order to the submodules """
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running,self.running)
+            self.threads.add(threading.current_thread())
+        try:
+            self.groot.log("# ---[ %s ]---" % (subm.tree_path),deferred=True)
+            time.sleep(0.01 * (len(ExecutorTest.NAMES) - ExecutorTest.NAMES.index(subm.tree_path)))
+            self.groot.log("done %s" % (subm.tree_path))
+            self.groot.warning("warning %s" % (subm.tree_path))
+            return subm.tree_path
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+    def run_map(self,jobs,func=None):
+        self.groot.jobs = jobs
+        submodules = [FakeRepo(name) for name in ExecutorTest.NAMES]
+        return Executor(self.groot).map(func or self.task,submodules)
+
+
+    def serial_output(self):
+        """ What the tasks write when simply run one after the other """
+        for name in ExecutorTest.NAMES:
+            self.task(FakeRepo(name))
+        return self.stdout.getvalue(), self.stderr.getvalue()
+
+
+    def test_replay_order(self):
+        expected = self.serial_output()
+        self.stdout.truncate(0)
+        self.stderr.truncate(0)
+
+        self.assertEqual(self.run_map(4),ExecutorTest.NAMES)
+        self.assertEqual((self.stdout.getvalue(),self.stderr.getvalue()),expected)
+        self.assertEqual(self.most_running,4)
+
+
+    def test_one_job(self):
+        """ -j 1 runs the tasks in order on the calling thread """
+        expected = self.serial_output()
+        self.stdout.truncate(0)
+        self.stderr.truncate(0)
+        self.threads = set()
+
+        self.assertEqual(self.run_map(1),ExecutorTest.NAMES)
+        self.assertEqual((self.stdout.getvalue(),self.stderr.getvalue()),expected)
+        self.assertEqual(self.threads,set([threading.current_thread()]))
+
+
+    def test_fatal(self):
+        """ groot.fatal() in a worker exits on the main thread, once the
+            output of the tasks before it has been replayed """
+        def task(subm):
+            if subm.tree_path == 'sub/s3':
+                self.groot.fatal("-E- failed in %s" % (subm.tree_path),exit=3)
+            return self.task(subm)
+
+        for jobs in [1,4]:
+            self.stdout.truncate(0)
+            self.stderr.truncate(0)
+            try:
+                self.run_map(jobs,task)
+                self.fail("no SystemExit with %d jobs" % (jobs))
+            except SystemExit, ex:
+                self.assertEqual(ex.code,3)
+            self.assertEqual(self.stdout.getvalue().splitlines()[-1],'done sub/s2')
+            self.assertEqual(self.stderr.getvalue().splitlines()[-2:],
+                             ['warning sub/s2','-E- failed in sub/s3'])
+
+
+    def test_exception(self):
+        """ Any other exception is raised on the main thread just the same """
+        def task(subm):
+            if subm.tree_path == 'sub/s5':
+                raise KeyError(subm.tree_path)
+            return self.task(subm)
+        self.assertRaises(KeyError,self.run_map,4,task)
+        self.assertFalse('sub/s5' in self.stdout.getvalue())
+
+
+    def test_walk(self):
+        """ Each submodule after the ones nested in it, with their results """
+        tree = FakeRepo('',[FakeRepo('a',[FakeRepo('a/x'),FakeRepo('a/y',[FakeRepo('a/y/z')])]),
+                            FakeRepo('b')])
+        done = []
+        def visit(subm,nested):
+            time.sleep(0.01)
+            with self.lock:
+                done.append(subm.tree_path)
+            self.groot.log(subm.tree_path)
+            return (subm.tree_path,nested)
+
+        for jobs in [1,3]:
+            self.groot.jobs = jobs
+            del done[:]
+            self.stdout.truncate(0)
+            results = Executor(self.groot).walk(visit,tree)
+            self.assertEqual(results,[('a',[('a/x',[]),('a/y',[('a/y/z',[])])]),('b',[])])
+            self.assertTrue(done.index('a') > max(done.index('a/x'),done.index('a/y')))
+            self.assertTrue(done.index('a/y') > done.index('a/y/z'))
+            self.assertEqual(self.stdout.getvalue().split(),['a/x','a/y/z','a/y','a','b'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
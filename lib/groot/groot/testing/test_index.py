@@ -0,0 +1,139 @@
+#
+# Index (groot.index) against 'git ls-files --stage', for each index version
+#
+
+import os
+import unittest
+
+from groot.index import Index
+from groot.testing.fixture import GitTestCase
+
+
+class IndexTest(GitTestCase):
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+        self.repo = self.fixture.init()
+        self.blob = self.git('hash-object','-w','--stdin',input='content\n').strip()
+
+        # Enough paths, sharing enough of their prefixes, to need more than
+        # one of version 4's whole paths to put the rest together from
+        entries = []
+        for d in range(12):
+            for f in range(30):
+                entries.append('100644 %s\tsrc/dir_%02d/sub/file_%03d.txt' % (self.blob,d,f))
+        entries.append('100755 %s\tbin/tool' % (self.blob))
+        entries.append('120000 %s\tlink' % (self.blob))
+        entries.append('160000 %s\tmodules/lib' % (self.commit()))
+        self.git('update-index','--add','--index-info',input='\n'.join(entries) + '\n')
+
+
+    def git(self,*args,**kwargs):
+        return self.fixture.git(cwd='repo',*args,**kwargs)
+
+
+    def commit(self):
+        return self.git('rev-parse','HEAD').strip()
+
+
+    def index(self):
+        return Index(os.path.join(self.repo,'.git','index'))
+
+
+    def ls_files(self):
+        """ (mode, SHA-1, stage, path) for each entry, as git lists them """
+        entries = []
+        for line in self.git('ls-files','--stage','-z').split('\0'):
+            if not line: continue
+            info, path = line.split('\t',1)
+            mode, sha1, stage = info.split(' ')
+            entries.append((int(mode,8),sha1,int(stage),path))
+        return entries
+
+
+    def assert_matches_git(self,version):
+        if version == 3:
+            # Git only writes version 3 for an index that needs it
+            self.git('update-index','--skip-worktree','bin/tool')
+        self.git('update-index','--index-version',str(version))
+        index = self.index()
+        self.assertEqual(index.version,version)
+
+        expected = self.ls_files()
+        self.assertEqual([(e.mode,e.sha1,e.stage(),e.path) for e in index.entries()],expected)
+        self.assertEqual(list(index.paths()),[e[3] for e in expected])
+        self.assertEqual(len(index),len(expected))
+
+        # Random access, which version 4 does differently from going in order
+        for pos in reversed(range(len(expected))):
+            self.assertEqual(index.path_at(pos),expected[pos][3])
+        for mode, sha1, stage, path in expected:
+            if stage == 0:
+                self.assertEqual(index.stat(path).sha1,sha1)
+        self.assertEqual(index.find('src/dir_05'),None)
+        self.assertEqual(index.find('zzz'),None)
+
+        self.assertEqual(index.gitlinks(),
+                         dict((e[3],e[1]) for e in expected if e[0] == Index.GITLINK_MODE))
+        index.close()
+
+
+    def test_v2(self):
+        self.assert_matches_git(2)
+
+    def test_v3(self):
+        self.assert_matches_git(3)
+
+    def test_v4(self):
+        self.assert_matches_git(4)
+
+
+    def test_extended_flags(self):
+        """ Intent-to-add and skip-worktree are in the version 3 extended flags """
+        self.fixture.write('repo/new','new\n')
+        self.git('add','-N','new')
+        self.git('update-index','--skip-worktree','README')
+        for version in [3,4]:
+            self.assert_matches_git(version)
+            index = self.index()
+            self.assertTrue(index.stat('new').extended_flags & Index.INTENT_TO_ADD)
+            self.assertTrue(index.stat('README').extended_flags & Index.SKIP_WORKTREE)
+            self.assertFalse(index.stat('link').extended_flags)
+            index.close()
+
+
+    def test_long_path(self):
+        """ A path too long for the length in the entry flags """
+        path = '/'.join(['d' * 200] * 25) + '/file'
+        self.git('update-index','--add','--cacheinfo','100644,%s,%s' % (self.blob,path))
+        for version in [2,3,4]:
+            self.assert_matches_git(version)
+
+
+    def test_unmerged(self):
+        path = 'src/dir_03/sub/file_007.txt'
+        self.git('update-index','--index-info',
+                 input='0 %s\t%s\n' % ('0' * 40,path) +
+                       ''.join('100644 %s %d\t%s\n' % (self.blob,stage,path) for stage in [1,2,3]))
+        for version in [2,3,4]:
+            self.assert_matches_git(version)
+
+
+    def test_cache_tree(self):
+        self.git('read-tree','HEAD')
+        self.assertEqual(self.index().cache_tree(),self.git('rev-parse','HEAD^{tree}').strip())
+        self.git('update-index','--add','--cacheinfo','100644,%s,other' % (self.blob))
+        self.assertEqual(self.index().cache_tree(),None)
+
+
+    def test_empty(self):
+        self.git('rm','-q','--cached','-r','.')
+        for version in [2,4]:
+            self.assert_matches_git(version)
+        os.unlink(os.path.join(self.repo,'.git','index'))
+        self.assertEqual(len(self.index()),0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#
+# RefStore (groot.git) against 'git show-ref' and 'git rev-parse'
+#
+
+import os
+import unittest
+
+from groot.git import Git
+from groot.testing.fixture import GitTestCase
+
+
+class RefStoreTest(GitTestCase):
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+        self.repo = self.fixture.init()
+        git = self.fixture.git
+        git('branch','topic',cwd='repo')
+        git('branch','feature/nested/name',cwd='repo')
+        git('tag','light',cwd='repo')
+        git('tag','-a','-m','annotated','annotated',cwd='repo')
+        git('tag','-a','-m','tag of a tag','nested','annotated',cwd='repo')
+        git('commit','-q','--allow-empty','-m','second',cwd='repo')
+        git('update-ref','refs/remotes/origin/master','HEAD~1',cwd='repo')
+        git('symbolic-ref','refs/remotes/origin/HEAD','refs/remotes/origin/master',cwd='repo')
+
+
+    def ref_store(self):
+        return Git(self.repo).ref_store
+
+
+    def show_ref(self,*args):
+        """ name -> SHA-1 for each ref git shows """
+        refs = {}
+        for line in self.fixture.git('show-ref',*args,cwd='repo').splitlines():
+            sha1, name = line.split(' ',1)
+            refs[name] = sha1
+        return refs
+
+
+    def assert_matches_git(self):
+        store = self.ref_store()
+        self.assertEqual(store.refs(),self.show_ref())
+        for name, sha1 in self.show_ref('-d').items():
+            if name.endswith('^{}'):
+                self.assertEqual(store.peel(name[:-3]),sha1)
+        for name in ['HEAD','refs/heads/topic','refs/remotes/origin/HEAD']:
+            self.assertEqual(store.resolve(name),
+                             self.fixture.git('rev-parse',name,cwd='repo').strip())
+
+
+    def test_loose(self):
+        self.assert_matches_git()
+
+
+    def test_packed(self):
+        self.fixture.git('pack-refs','--all',cwd='repo')
+        self.assertFalse(os.path.exists(os.path.join(self.repo,'.git','refs','heads','topic')))
+        self.assert_matches_git()
+
+
+    def test_loose_over_packed(self):
+        """ A loose ref takes the place of a packed one with the same name,
+            and a ref deleted after packing is gone from both """
+        git = self.fixture.git
+        git('pack-refs','--all',cwd='repo')
+        git('update-ref','refs/heads/topic','HEAD',cwd='repo')
+        git('branch','-D','feature/nested/name',cwd='repo')
+        git('branch','unpacked',cwd='repo')
+        self.assert_matches_git()
+
+
+    def test_detached_head(self):
+        self.fixture.git('checkout','-q','--detach','HEAD~1',cwd='repo')
+        store = self.ref_store()
+        self.assertFalse(store.read_ref('HEAD').startswith('ref:'))
+        self.assert_matches_git()
+
+
+    def test_missing(self):
+        store = self.ref_store()
+        self.assertEqual(store.resolve('refs/heads/nothing'),None)
+        self.assertEqual(store.read_ref('refs/tags/nothing'),None)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
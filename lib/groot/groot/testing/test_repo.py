@@ -0,0 +1,75 @@
+#
+# Finding the submodule a path is in (groot.repo), through nested
+# submodules and past paths that only share a prefix
+#
+
+import unittest
+
+from groot.testing.fixture import GitTestCase
+
+
+class WhichSubmoduleTest(GitTestCase):
+
+    # Each repo, with the submodules in its .gitmodules
+    TREE = { 'root': ['sub/s1','sub/s10','sub/s1-x'],
+             'root/sub/s1': ['lib/n1'],
+             'root/sub/s1/lib/n1': ['deep/m1'],
+             'root/sub/s10': [],
+             'root/sub/s1-x': [],
+             'root/sub/s1/lib/n1/deep/m1': [] }
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+        for path in sorted(WhichSubmoduleTest.TREE):
+            self.fixture.git('init','-q',path)
+            modules = ''.join('[submodule "%s"]\n\tpath = %s\n\turl = ../%s.git\n' % (name,name,name)
+                              for name in WhichSubmoduleTest.TREE[path])
+            if modules:
+                self.fixture.write(path + '/.gitmodules',modules)
+        self.root = self.groot.open_repo(self.fixture.join('root'))
+
+
+    def tearDown(self):
+        self.groot.close_repo(self.root)
+        GitTestCase.tearDown(self)
+
+
+    def which(self,path):
+        subm, sub_path = self.root.which_submodule(path)
+        return (subm and subm.tree_path,sub_path)
+
+
+    def test_which_submodule(self):
+        for path, expected in [('sub/s1',('sub/s1','')),
+                               ('sub/s1/file',('sub/s1','file')),
+                               ('sub/s10',('sub/s10','')),
+                               ('sub/s10/file',('sub/s10','file')),
+                               ('sub/s1-x/file',('sub/s1-x','file')),
+                               ('sub/s1/lib/n1',('sub/s1/lib/n1','')),
+                               ('sub/s1/lib/n1/a/b',('sub/s1/lib/n1','a/b')),
+                               ('sub/s1/lib/n10',('sub/s1','lib/n10')),
+                               ('sub/s1/lib/n1/deep/m1/x',('sub/s1/lib/n1/deep/m1','x')),
+                               ('sub/s1/lib/n1/deep/m10',('sub/s1/lib/n1','deep/m10')),
+                               ('sub/s',(None,'sub/s')),
+                               ('sub/s100',(None,'sub/s100')),
+                               ('sub',(None,'sub')),
+                               ('README',(None,'README'))]:
+            self.assertEqual(self.which(path),expected,path)
+
+
+    def test_get_submodule(self):
+        self.assertEqual(self.root.get_submodule('sub/s1/lib/n1').tree_path,'sub/s1/lib/n1')
+        self.assertEqual(self.root.get_submodule('sub/s10').tree_path,'sub/s10')
+        self.assertEqual(self.root.get_submodule('sub/s1/lib'),None)
+        self.assertEqual(self.root.get_submodule('sub/s1/lib/n1/x'),None)
+
+
+    def test_all_submodules(self):
+        """ Parents before the submodules in them """
+        self.assertEqual([subm.tree_path for subm in self.root.all_submodules()],
+                         ['sub/s1','sub/s1/lib/n1','sub/s1/lib/n1/deep/m1','sub/s1-x','sub/s10'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
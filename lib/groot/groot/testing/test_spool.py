@@ -0,0 +1,103 @@
+#
+# Spool (groot.spool): spilling to disk past the threshold, the threshold
+# from GROOT_SPOOL_SIZE, and reading the output back more than once
+#
+
+import os
+import unittest
+
+from groot.spool import Spool
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_size = os.environ.pop('GROOT_SPOOL_SIZE',None)
+
+
+    def tearDown(self):
+        os.environ.pop('GROOT_SPOOL_SIZE',None)
+        if self.saved_size is not None:
+            os.environ['GROOT_SPOOL_SIZE'] = self.saved_size
+
+
+    def on_disk(self,spool):
+        return spool.file._rolled
+
+
+    def test_threshold(self):
+        """ Kept in memory up to the threshold, and on disk past it """
+        spool = Spool(100)
+        spool.write('x' * 60)
+        spool.write('y' * 40)
+        self.assertFalse(spool.spilled())
+        self.assertFalse(self.on_disk(spool))
+
+        spool.write('z')
+        self.assertTrue(spool.spilled())
+        self.assertTrue(self.on_disk(spool))
+        self.assertEqual(len(spool),101)
+        self.assertEqual(spool.getvalue(),'x' * 60 + 'y' * 40 + 'z')
+        spool.close()
+
+
+    def test_size_setting(self):
+        for value, expected in [(None,Spool.THRESHOLD),
+                                ('',Spool.THRESHOLD),
+                                ('100',100),
+                                ('4k',4096),
+                                (' 2M ',2 * 1024 * 1024),
+                                ('1g',1024 ** 3),
+                                ('k',Spool.THRESHOLD),
+                                ('lots',Spool.THRESHOLD),
+                                ('1.5m',Spool.THRESHOLD)]:
+            os.environ.pop('GROOT_SPOOL_SIZE',None)
+            if value is not None:
+                os.environ['GROOT_SPOOL_SIZE'] = value
+            self.assertEqual(Spool.threshold(),expected,repr(value))
+
+        os.environ['GROOT_SPOOL_SIZE'] = '1k'
+        spool = Spool()
+        spool.write('x' * 1025)
+        self.assertTrue(self.on_disk(spool))
+        spool.close()
+
+
+    def test_read_again(self):
+        """ Lines, chunks and the whole value, in any order and more than
+            once, with lines crossing the chunk boundaries """
+        lines = ['line %d %s\n' % (i,'x' * (i % 50)) for i in range(5000)]
+        text = ''.join(lines)
+        self.assertTrue(len(text) > 2 * Spool.CHUNK_SIZE)
+
+        for threshold in [len(text) * 2,1000]:
+            spool = Spool(threshold)
+            spool.write(text)
+            self.assertEqual(self.on_disk(spool),threshold < len(text))
+
+            self.assertEqual(list(spool),lines)
+            chunks = list(spool.chunks())
+            self.assertEqual(''.join(chunks),text)
+            self.assertTrue(all(len(chunk) <= Spool.CHUNK_SIZE for chunk in chunks))
+
+            # Reading only part of it doesn't stop it being read again
+            next(spool.chunks())
+            self.assertEqual(list(spool),lines)
+            self.assertEqual(spool.getvalue(),text)
+            self.assertEqual(''.join(spool.chunks()),text)
+            spool.close()
+
+
+    def test_empty(self):
+        spool = Spool()
+        self.assertFalse(spool)
+        self.assertEqual(list(spool),[])
+        self.assertEqual(list(spool.chunks()),[])
+        spool.write('')
+        self.assertFalse(spool)
+        self.assertTrue(Spool.of('x'))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#
+# StateCache (groot.state): entries dropped when a file they were worked
+# out from changes, and a damaged cache file taken as an empty one
+#
+
+import marshal
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from groot.state import StateCache
+from groot.testing.fixture import GrootTestCase
+
+
+class StateCacheTest(GrootTestCase):
+
+    def setUp(self):
+        GrootTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp(prefix='groot-test-')
+        self.cache_path = os.path.join(self.dir,'groot','state.cache')
+        self.file = self.write('file','contents\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir,ignore_errors=True)
+        GrootTestCase.tearDown(self)
+
+
+    def write(self,name,data,age=60):
+        """ Write the file, dated age seconds ago, so it's settled """
+        path = os.path.join(self.dir,name)
+        fh = open(path,'w')
+        try: fh.write(data)
+        finally: fh.close()
+        self.backdate(path,age)
+        return path
+
+
+    def backdate(self,path,age):
+        then = time.time() - age
+        os.utime(path,(then,then))
+
+
+    def saved(self,name='entry',paths=None,value='value'):
+        """ A new StateCache, reading the file a value was saved to """
+        cache = StateCache(self.cache_path)
+        cache.put(name,paths or [self.file],value)
+        cache.save()
+        return StateCache(self.cache_path)
+
+
+    def test_round_trip(self):
+        missing = os.path.join(self.dir,'missing')
+        subdir = os.path.join(self.dir,'subdir')
+        os.mkdir(subdir)
+        self.backdate(subdir,60)
+        value = { 'list': [1,2], 'tuple': ('a',None), 'text': 'x' * 1000 }
+        cache = self.saved(paths=[self.file,subdir,missing],value=value)
+        self.assertEqual(cache.get('entry'),value)
+        self.assertEqual(cache.get('other'),None)
+
+
+    def test_changed_contents(self):
+        cache = self.saved()
+        self.write('file','different contents\n')
+        self.assertEqual(cache.get('entry'),None)
+
+
+    def test_changed_mtime(self):
+        """ Same size, same inode, only the time changed """
+        cache = self.saved()
+        self.backdate(self.file,30)
+        self.assertEqual(cache.get('entry'),None)
+
+
+    def test_replaced(self):
+        """ A new file of the same size renamed over it, with the same time """
+        stat = os.stat(self.file)
+        cache = self.saved()
+        new = self.write('new','CONTENTS\n')
+        os.utime(new,(stat.st_atime,stat.st_mtime))
+        os.rename(new,self.file)
+        self.assertEqual(cache.get('entry'),None)
+
+
+    def test_deleted_and_created(self):
+        missing = os.path.join(self.dir,'missing')
+        cache = self.saved(paths=[missing])
+        self.assertEqual(cache.get('entry'),'value')
+        self.write('missing','now here\n')
+        self.assertEqual(cache.get('entry'),None)
+
+        cache = self.saved(paths=[self.file])
+        os.unlink(self.file)
+        self.assertEqual(cache.get('entry'),None)
+
+
+    def test_directory(self):
+        """ A file added to a directory changes the directory's key """
+        subdir = os.path.join(self.dir,'subdir')
+        os.mkdir(subdir)
+        self.backdate(subdir,60)
+        cache = self.saved(paths=[subdir])
+        self.write('subdir/added','added\n')
+        self.assertEqual(cache.get('entry'),None)
+
+
+    def test_racy(self):
+        """ Not stored if a file is too new for its time to be trusted """
+        self.backdate(self.file,0)
+        cache = self.saved()
+        self.assertEqual(cache.get('entry'),None)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+
+    def test_damaged(self):
+        """ A cache file that can't be read is taken as empty, and is
+            written over the next time the cache is saved """
+        good = marshal.dumps({ 'version': StateCache.VERSION,
+                               'entries': { 'entry': (((self.file,(0.0,1,2)),),'value') } })
+        for data in ['',
+                     'not marshal data at all',
+                     good[:len(good) // 2],
+                     good[:-1],
+                     marshal.dumps(['a','list']),
+                     marshal.dumps({ 'version': StateCache.VERSION + 1, 'entries': {} }),
+                     marshal.dumps({ 'version': StateCache.VERSION, 'entries': ['a','list'] }),
+                     marshal.dumps({ 'version': StateCache.VERSION }),
+                     marshal.dumps({ 'version': StateCache.VERSION, 'entries': { 'entry': 'junk' } }),
+                     marshal.dumps({ 'version': StateCache.VERSION, 'entries': { 'entry': ((1,2),'value') } })]:
+            if not os.path.isdir(os.path.dirname(self.cache_path)):
+                os.makedirs(os.path.dirname(self.cache_path))
+            fh = open(self.cache_path,'wb')
+            try: fh.write(data)
+            finally: fh.close()
+
+            self.assertEqual(StateCache(self.cache_path).get('entry'),None,repr(data))
+            self.assertEqual(self.saved(name='new').get('new'),'value',repr(data))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#
+# RepoStatus (groot.git) on real 'git status --porcelain=v2 --branch -z'
+# output, checked against the porcelain v1 listing and git's refs
+#
+
+import unittest
+
+from groot.git import Git, RepoStatus
+from groot.testing.fixture import GitTestCase
+
+
+UNMERGED = ['DD','AU','UD','UA','DU','AA','UU']
+
+
+class RepoStatusTest(GitTestCase):
+
+    def setUp(self):
+        GitTestCase.setUp(self)
+        self.repo = self.fixture.init()
+        self.fixture.write('repo/a file','a\n' * 20)
+        self.fixture.write('repo/other','other\n')
+        self.git('add','.')
+        self.git('commit','-q','-m','files')
+
+
+    def git(self,*args,**kwargs):
+        return self.fixture.git(cwd='repo',*args,**kwargs)
+
+
+    def git_or_none(self,*args):
+        try:
+            return self.git(*args).strip() or None
+        except AssertionError:
+            return None
+
+
+    def status(self,untracked=True):
+        """ The RepoStatus for git's own output """
+        mode = untracked and 'all' or 'no'
+        return RepoStatus(self.git('status','--porcelain=v2','--branch','-z',
+                                   '--untracked-files=%s' % (mode)))
+
+
+    def porcelain_v1(self):
+        """ (staged, unstaged, unmerged, untracked) paths, from the v1 listing """
+        staged, unstaged, unmerged, untracked = [], [], [], []
+        fields = iter(self.git('status','--porcelain','-z','--untracked-files=all').split('\0'))
+        for field in fields:
+            if not field: continue
+            xy, path = field[:2], field[3:]
+            if xy[0] in 'RC':
+                next(fields)
+            if xy == '??':
+                untracked.append(path)
+            elif xy in UNMERGED:
+                unmerged.append(path)
+            else:
+                if xy[0] != ' ': staged.append(path)
+                if xy[1] != ' ': unstaged.append(path)
+        return staged, unstaged, unmerged, untracked
+
+
+    def assert_matches_git(self):
+        status = self.status()
+        self.assertEqual(status.oid,self.git_or_none('rev-parse','-q','--verify','HEAD'))
+        self.assertEqual(status.branch,self.git_or_none('symbolic-ref','-q','--short','HEAD'))
+        self.assertEqual(status.upstream,self.git_or_none('rev-parse','--abbrev-ref','@{u}'))
+        if status.upstream:
+            ahead, behind = self.git('rev-list','--left-right','--count','HEAD...@{u}').split()
+            self.assertEqual((status.ahead,status.behind),(int(ahead),int(behind)))
+
+        self.assertEqual((sorted(status.staged),sorted(status.unstaged),
+                          sorted(status.unmerged),sorted(status.untracked)),
+                         tuple(sorted(paths) for paths in self.porcelain_v1()))
+
+        # As the status for checking a repo is clean has it (see Git.status)
+        self.assertEqual(self.status(untracked=False).untracked,[])
+        return status
+
+
+    def test_clean(self):
+        status = self.assert_matches_git()
+        self.assertTrue(status.is_clean())
+        self.assertEqual(status.branch,'master')
+        self.assertTrue(Git(self.repo).status().is_clean())
+
+
+    def test_initial(self):
+        self.fixture.git('init','-q','empty')
+        self.fixture.write('empty/new','new\n')
+        self.fixture.git('add','new',cwd='empty')
+        status = RepoStatus(self.fixture.git('status','--porcelain=v2','--branch','-z',cwd='empty'))
+        self.assertEqual((status.oid,status.branch,status.staged),(None,'master',['new']))
+
+
+    def test_detached(self):
+        self.git('checkout','-q','--detach','HEAD~1')
+        status = self.assert_matches_git()
+        self.assertTrue(status.is_detached())
+
+
+    def test_ahead_behind(self):
+        self.git('remote','add','origin',self.repo)
+        self.git('update-ref','refs/remotes/origin/master','HEAD')
+        self.git('branch','-q','--set-upstream-to','origin/master')
+        self.assertEqual((self.assert_matches_git().ahead,self.status().behind),(0,0))
+
+        self.git('commit','-q','--allow-empty','-m','ahead 1')
+        self.git('commit','-q','--allow-empty','-m','ahead 2')
+        self.git('update-ref','refs/remotes/origin/master','HEAD~3')
+        status = self.assert_matches_git()
+        self.assertEqual((status.upstream,status.ahead,status.behind),('origin/master',3,0))
+
+        self.git('update-ref','refs/remotes/origin/master',
+                 self.git('commit-tree','-p','HEAD~3','-m','behind','HEAD^{tree}').strip())
+        status = self.assert_matches_git()
+        self.assertEqual((status.ahead,status.behind),(3,1))
+
+
+    def test_changes(self):
+        self.fixture.write('repo/other','changed\n')
+        self.fixture.write('repo/README','staged\n')
+        self.git('add','README')
+        self.fixture.write('repo/README','staged, then changed\n')
+        self.fixture.write('repo/new file','new\n')
+        self.git('add','new file')
+        self.git('rm','-q','--cached','other')
+        self.assertFalse(self.assert_matches_git().is_clean())
+
+
+    def test_rename(self):
+        self.git('mv','a file','renamed file')
+        status = self.assert_matches_git()
+        self.assertEqual(status.staged,['renamed file'])
+
+        # ...and changed after it was staged, with an entry after it
+        self.fixture.write('repo/renamed file','a\n' * 19 + 'b\n')
+        self.fixture.write('repo/other','changed\n')
+        status = self.assert_matches_git()
+        self.assertEqual(status.unstaged,['other','renamed file'])
+
+
+    def test_untracked(self):
+        self.fixture.write('repo/untracked','x\n')
+        self.fixture.write('repo/dir/with space/deeper','x\n')
+        status = self.assert_matches_git()
+        self.assertEqual(sorted(status.untracked),['dir/with space/deeper','untracked'])
+        self.assertTrue(status.is_clean())
+
+
+    def test_unmerged(self):
+        self.git('checkout','-q','-b','topic')
+        self.fixture.write('repo/other','topic\n')
+        self.git('commit','-q','-am','topic')
+        self.git('checkout','-q','master')
+        self.fixture.write('repo/other','master\n')
+        self.git('rm','-q','a file')
+        self.git('commit','-q','-am','master')
+        self.fixture.write('repo/untracked','x\n')
+        try:
+            self.git('merge','-q','topic')
+        except AssertionError:
+            pass
+        status = self.assert_matches_git()
+        self.assertEqual(status.unmerged,['other'])
+        self.assertFalse(status.is_clean())
+        self.assertFalse(Git(self.repo).status().is_clean())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#
+# TaskGraph (groot.command.base), run with plain callables: dependencies,
+# what's skipped after a failure, and a barrier like pull's 'pull root'
+#
+
+import threading
+import time
+import unittest
+
+from groot.command.base import Executor, TaskGraph
+from groot.testing.fixture import GrootTestCase
+
+
+class TaskGraphTest(GrootTestCase):
+
+    def setUp(self):
+        GrootTestCase.setUp(self)
+        self.lock = threading.Lock()
+        self.events = []
+
+
+    def step(self,name,delay=0.0,result=None):
+        """ A task that notes when it starts and ends, and logs its name """
+        def func():
+            self.note('start',name)
+            time.sleep(delay)
+            self.groot.log(name)
+            self.note('end',name)
+            return result
+        return func
+
+
+    def note(self,what,name):
+        with self.lock:
+            self.events.append((what,name))
+
+
+    def at(self,what,name):
+        return self.events.index((what,name))
+
+
+    def ran(self,name):
+        return ('start',name) in self.events
+
+
+    def schedule(self,tasks,jobs):
+        self.groot.jobs = jobs
+        Executor(self.groot).schedule(tasks)
+
+
+    def assert_after(self,name,dependencies):
+        for dependency in dependencies:
+            self.assertTrue(self.at('start',name) > self.at('end',dependency),
+                            "%s started before %s was done" % (name,dependency))
+
+
+    def test_dependencies(self):
+        for jobs in [1,4]:
+            del self.events[:]
+            self.stdout.truncate(0)
+            tasks = TaskGraph()
+            tasks.add('a',self.step('a',0.05,'A'))
+            tasks.add('b',self.step('b',0.01,'B'))
+            tasks.add('c',self.step('c',0.0,'C'),after=['a'])
+            tasks.add('d',self.step('d',0.0,'D'),after=['b','c'])
+            tasks.add('e',self.step('e',0.0,'E'))
+            self.schedule(tasks,jobs)
+
+            self.assert_after('c',['a'])
+            self.assert_after('d',['b','c'])
+            self.assertEqual([tasks.result(name) for name in 'abcde'],list('ABCDE'))
+            # Output in the order the tasks were added, not run
+            self.assertEqual(self.stdout.getvalue().split(),list('abcde'))
+
+
+    def test_independent_overlap(self):
+        """ Tasks that don't depend on each other run at the same time """
+        tasks = TaskGraph()
+        tasks.add('a',self.step('a',0.05))
+        tasks.add('b',self.step('b',0.05))
+        self.schedule(tasks,2)
+        self.assertTrue(self.at('start','b') < self.at('end','a'))
+
+
+    def test_failure_skips_dependents(self):
+        def fail():
+            self.note('start','fail')
+            raise ValueError('failed')
+
+        for jobs in [1,4]:
+            del self.events[:]
+            tasks = TaskGraph()
+            tasks.add('before',self.step('before',0.02))
+            tasks.add('fail',fail)
+            tasks.add('dependent',self.step('dependent'),after=['fail'])
+            tasks.add('indirect',self.step('indirect'),after=['dependent','before'])
+            self.assertRaises(ValueError,self.schedule,tasks,jobs)
+
+            self.assertTrue(self.ran('before'))
+            self.assertFalse(self.ran('dependent'))
+            self.assertFalse(self.ran('indirect'))
+            self.assertEqual(tasks.result('dependent'),None)
+
+
+    def pull_graph(self,clean=True):
+        """ Tasks shaped like a pull: check each submodule is clean, fetch
+            and pull each (nested ones first), then pull the root """
+        tasks = TaskGraph()
+        names = ['s1/n1','s1','s2','s3']
+        checks = [tasks.add(('clean',name),self.step('clean ' + name,0.0,True)) for name in names]
+
+        def require_clean():
+            self.note('start','clean')
+            if not clean:
+                self.groot.fatal("-E- The repo must be clean before pulling")
+            self.note('end','clean')
+        tasks.add('clean',require_clean,after=checks)
+
+        pulled = []
+        for name in names:
+            fetch = tasks.add(('fetch',name),self.step('fetch ' + name,0.02))
+            after = ['clean',fetch]
+            if name == 's1':
+                after.append(('pull','s1/n1'))
+            pulled.append(tasks.add(('pull',name),self.step('pull ' + name,0.01),after=after))
+        tasks.add('pull root',self.step('pull root'),after=['clean'] + pulled)
+        return tasks, names
+
+
+    def test_barrier(self):
+        for jobs in [1,3]:
+            del self.events[:]
+            tasks, names = self.pull_graph()
+            self.schedule(tasks,jobs)
+            self.assert_after('pull root',['pull ' + name for name in names])
+            self.assert_after('pull s1',['pull s1/n1'])
+            for name in names:
+                self.assert_after('pull ' + name,['clean','fetch ' + name])
+
+
+    def test_barrier_fails(self):
+        """ Nothing is pulled if the clean gate fails, and the root's pull
+            doesn't run either """
+        for jobs in [1,3]:
+            del self.events[:]
+            tasks, names = self.pull_graph(clean=False)
+            self.assertRaises(SystemExit,self.schedule,tasks,jobs)
+            self.assertFalse([event for event in self.events if event[1].startswith('pull')])
+
+
+    def test_duplicate(self):
+        tasks = TaskGraph()
+        tasks.add('a',self.step('a'))
+        self.assertRaises(ValueError,tasks.add,'a',self.step('a'))
+        self.assertRaises(KeyError,tasks.add,'b',self.step('b'),after=['missing'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
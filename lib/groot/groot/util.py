@@ -1,24 +1,72 @@
-
-import os
-import random
-import string
-
-
-class safe_chdir(object):
-    def __init__(self,newpath):
-        self.save_pwd = os.getcwd()
-        os.chdir(newpath)
-
-    def __del__(self):
-        os.chdir(self.save_pwd)
-
-    def __enter__(self):
-        pass
-
-    def __exit__(self, type, value, traceback):
-        return False # Pass exceptions
-
-
-def random_string(size=6, chars=string.ascii_lowercase + string.digits):
-    return ''.join(random.choice(chars) for x in range(size))
-
+
+import os
+import random
+import re
+import string
+
+
+def random_string(size=6, chars=string.ascii_lowercase + string.digits):
+    return ''.join(random.choice(chars) for x in range(size))
+
+
+
+def url_host(url):
+    """ The host a git remote URL connects to (lower case, as host names
+        aren't case-sensitive), or None for a local repo """
+    m = re.match(r'([a-z][a-z0-9+.-]*)://(?:[^@/]*@)?(\[[^\]]*\]|[^:/]*)',url,re.I)
+    if m:
+        if m.group(1).lower() == 'file':
+            return None
+        return m.group(2).lower() or None
+    # scp-like syntax, [user@]host:path, with the colon before any slash.
+    # A single letter is a Windows drive, not a host
+    m = re.match(r'(?:[^@/:]*@)?(\[[^\]/]*\]|[^/:\[]+):',url)
+    if m and len(m.group(1)) > 1:
+        return m.group(1).lower()
+    return None
+
+
+class PathTrie(object):
+    """ Maps paths to values, for finding the deepest stored path that a
+        given path is in, one path component at a time """
+
+    def __init__(self):
+        self.root = {}
+
+
+    def split(self,path):
+        return [part for part in path.split('/') if part and part != '.']
+
+
+    def add(self,path,value):
+        node = self.root
+        for part in self.split(path):
+            node = node.setdefault(part,{})
+        node[None] = value
+
+
+    def find(self,path):
+        """ Returns (value,rest): the value for the deepest stored path that
+            path is, or is under, and the rest of path below it ('' if it's
+            the stored path itself). (None,path) if there isn't one """
+        parts = self.split(path)
+        node = self.root
+        found = None
+        for depth, part in enumerate(parts):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                found = (node[None],depth + 1)
+
+        if found is None:
+            return (None,path)
+        return (found[0],'/'.join(parts[found[1]:]))
+
+
+    def get(self,path):
+        """ The value stored for exactly this path, or None """
+        value, rest = self.find(path)
+        if rest:
+            return None
+        return value
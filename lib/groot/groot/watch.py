@@ -0,0 +1,213 @@
+# Tracking changes to repos with Linux inotify, through ctypes
+#
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+from groot.boot import Groot
+from groot.err import *
+
+
+class WatchError(Exception):
+    """ Error indicating changes can't be watched for (e.g. not Linux) """
+    pass
+
+
+
+class Inotify(object):
+    """ Minimal wrapper around the inotify system calls """
+
+    # Flags for inotify_init1
+    NONBLOCK = 04000
+    CLOEXEC = 02000000
+
+    # Event masks
+    MODIFY = 0x2
+    ATTRIB = 0x4
+    CLOSE_WRITE = 0x8
+    MOVED_FROM = 0x40
+    MOVED_TO = 0x80
+    CREATE = 0x100
+    DELETE = 0x200
+    DELETE_SELF = 0x400
+    MOVE_SELF = 0x800
+    Q_OVERFLOW = 0x4000
+    IGNORED = 0x8000
+    ONLYDIR = 0x1000000
+    ISDIR = 0x40000000
+
+    CHANGES = MODIFY | ATTRIB | CLOSE_WRITE | MOVED_FROM | MOVED_TO | \
+              CREATE | DELETE | DELETE_SELF | MOVE_SELF
+
+    event_header = struct.Struct('iIII')
+
+    def __init__(self):
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',use_errno=True)
+            self.libc.inotify_init1
+        except (OSError,AttributeError), ex:
+            raise WatchError("inotify isn't available: %s" % (ex))
+
+        self.fd = self.libc.inotify_init1(Inotify.NONBLOCK | Inotify.CLOEXEC)
+        if self.fd < 0:
+            raise WatchError("inotify_init1: %s" % (os.strerror(ctypes.get_errno())))
+
+
+    def add_watch(self,path,mask):
+        """ Returns the watch descriptor. Raises OSError on failure, with
+            errno ENOSPC when the user's watch limit has been reached """
+        wd = self.libc.inotify_add_watch(self.fd,path,mask | Inotify.ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err,os.strerror(err),path)
+        return wd
+
+
+    def rm_watch(self,wd):
+        self.libc.inotify_rm_watch(self.fd,wd)
+
+
+    def read(self):
+        """ All the events queued so far, as (wd,mask,name) tuples """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd,65536)
+            except OSError, ex:
+                if ex.errno == errno.EAGAIN: break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = Inotify.event_header.unpack_from(data,offset)
+                offset += Inotify.event_header.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((wd,mask,name))
+        return events
+
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+
+class Watcher(object):
+    """ Keeps track of which repos have had anything written to their working
+        tree, index or refs. Each repo's working tree directories are watched
+        (leaving out nested submodules, which are watched as repos of their
+        own), along with its git dir and refs.
+
+        Changes are counted with tokens: poll() returns the current token, and
+        changed_since(token) the repos written to after it was returned.
+
+        If the system's limit on watches is reached while watching a repo,
+        just its top-level directory and git dir are watched instead. That
+        repo is then always reported as changed, since changes deeper down
+        could be missed.
+
+        Only the groot daemon watches (see groot.daemon): commands run without
+        one get the benefit only through what the daemon answers them """
+
+    def __init__(self):
+        self.groot = Groot.instance
+        self.inotify = Inotify()
+        self.token = 0
+        self.changed = {}
+        self.partial = set()
+        self.watches = {}
+        self.repo_wds = {}
+
+
+    def watch_repo(self,repo_path,git_dir,common_dir):
+        """ Start watching the repo with its working tree at repo_path """
+        self.repo_wds[repo_path] = set()
+        try:
+            self.watch_dir(repo_path,git_dir,False)
+            if common_dir != git_dir:
+                self.watch_dir(repo_path,common_dir,False)
+            self.watch_tree(repo_path,os.path.join(common_dir,'refs'),False)
+            self.watch_tree(repo_path,repo_path,True)
+        except OSError, ex:
+            if ex.errno != errno.ENOSPC: raise
+            self.groot.debug("# Out of inotify watches, only watching the top of %s" % (repo_path))
+            self.unwatch_repo(repo_path)
+            self.repo_wds[repo_path] = set()
+            self.partial.add(repo_path)
+            try:
+                self.watch_dir(repo_path,git_dir,False)
+                self.watch_dir(repo_path,repo_path,True)
+            except OSError, ex:
+                if ex.errno != errno.ENOSPC: raise
+        self.changed[repo_path] = self.token
+
+
+    def unwatch_repo(self,repo_path):
+        for wd in self.repo_wds.pop(repo_path,[]):
+            self.inotify.rm_watch(wd)
+            self.watches.pop(wd,None)
+        self.partial.discard(repo_path)
+
+
+    def watch_dir(self,repo_path,path,work_tree):
+        wd = self.inotify.add_watch(path,Inotify.CHANGES)
+        self.watches[wd] = (repo_path,path,work_tree)
+        self.repo_wds[repo_path].add(wd)
+
+
+    def watch_tree(self,repo_path,top,work_tree):
+        """ Watch top and every directory under it. In a working tree, that
+            leaves out .git, and any nested submodules """
+        for dirpath, dirnames, filenames in os.walk(top):
+            if work_tree:
+                if dirpath != top and '.git' in dirnames + filenames:
+                    dirnames[:] = []
+                    continue
+                if '.git' in dirnames: dirnames.remove('.git')
+            self.watch_dir(repo_path,dirpath,work_tree)
+
+
+    def poll(self):
+        """ Take note of the changes since the last poll, and return
+            the current token """
+        events = self.inotify.read()
+        if events:
+            self.token += 1
+        for wd, mask, name in events:
+            if mask & Inotify.Q_OVERFLOW:
+                # Events were lost, so anything could have changed
+                for repo_path in self.changed: self.changed[repo_path] = self.token
+                continue
+            if not wd in self.watches:
+                continue
+
+            repo_path, path, work_tree = self.watches[wd]
+            if mask & Inotify.IGNORED:
+                # The directory is gone
+                del self.watches[wd]
+                self.repo_wds[repo_path].discard(wd)
+            self.changed[repo_path] = self.token
+
+            # New directories in a working tree need watching too
+            if work_tree and mask & Inotify.ISDIR and mask & (Inotify.CREATE | Inotify.MOVED_TO) and \
+                   not repo_path in self.partial:
+                try:
+                    self.watch_tree(repo_path,os.path.join(path,name),True)
+                except OSError, ex:
+                    if ex.errno != errno.ENOSPC: raise
+                    self.partial.add(repo_path)
+        return self.token
+
+
+    def changed_since(self,token):
+        """ The set of repo paths changed after the token was returned by poll() """
+        changed = set(path for path, last in self.changed.items() if last > token)
+        return changed | self.partial
+
+
+    def close(self):
+        self.inotify.close()